@@ -0,0 +1,52 @@
+"""add full text index to quotes
+
+Revision ID: 03bab5463169
+Revises: 5c1e8d2f7a93
+Create Date: 2026-10-18 09:33:08.412857
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+from kmua.models.quote_index import (
+    MYSQL_FULLTEXT_INDEX,
+    SQLITE_FTS_REBUILD,
+    SQLITE_TRIGRAM_DDL,
+    SQLITE_TRIGRAM_TRIGGERS,
+)
+
+# revision identifiers, used by Alembic.
+revision: str = "03bab5463169"
+down_revision: Union[str, None] = "5c1e8d2f7a93"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    try:
+        if bind.dialect.name == "sqlite":
+            # quotes_fts_ngram 在 7a2d9e4b1c85 中创建
+            for ddl in SQLITE_TRIGRAM_DDL + SQLITE_FTS_REBUILD[:1]:
+                op.execute(ddl)
+        elif bind.dialect.name == "mysql":
+            op.execute(
+                f"ALTER TABLE quotes ADD FULLTEXT INDEX {MYSQL_FULLTEXT_INDEX} "
+                "(text) WITH PARSER ngram"
+            )
+    except Exception as e:
+        print(e)
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    try:
+        if bind.dialect.name == "sqlite":
+            for trigger in SQLITE_TRIGRAM_TRIGGERS:
+                op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            op.execute("DROP TABLE IF EXISTS quotes_fts")
+        elif bind.dialect.name == "mysql":
+            op.drop_index(MYSQL_FULLTEXT_INDEX, table_name="quotes")
+    except Exception as e:
+        print(e)
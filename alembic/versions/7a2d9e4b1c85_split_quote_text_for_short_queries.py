@@ -0,0 +1,64 @@
+"""split quote text for short queries
+
+Revision ID: 7a2d9e4b1c85
+Revises: 03bab5463169
+Create Date: 2026-10-18 10:40:12.305118
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+from kmua.models.quote_index import (
+    SQLITE_FTS_REBUILD,
+    SQLITE_NGRAM_DDL,
+    SQLITE_NGRAM_TRIGGERS,
+    split_chars,
+)
+
+# revision identifiers, used by Alembic.
+revision: str = "7a2d9e4b1c85"
+down_revision: Union[str, None] = "03bab5463169"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    try:
+        op.add_column("quotes", sa.Column("text_ngram", sa.Text(), nullable=True))
+    except Exception as e:
+        print(e)
+    bind = op.get_bind()
+    if bind.dialect.name != "sqlite":
+        return
+    try:
+        # 旧版本的 quotes_fts_ngram 的触发器调用了 python 函数, 删除后重新创建
+        for trigger in SQLITE_NGRAM_TRIGGERS:
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS quotes_fts_ngram")
+        rows = bind.execute(
+            sa.text("SELECT rowid, text FROM quotes WHERE text IS NOT NULL")
+        ).all()
+        if rows:
+            bind.execute(
+                sa.text("UPDATE quotes SET text_ngram = :text WHERE rowid = :rowid"),
+                [{"rowid": rowid, "text": split_chars(text)} for rowid, text in rows],
+            )
+        for ddl in SQLITE_NGRAM_DDL + SQLITE_FTS_REBUILD[1:]:
+            op.execute(ddl)
+    except Exception as e:
+        print(e)
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    try:
+        if bind.dialect.name == "sqlite":
+            for trigger in SQLITE_NGRAM_TRIGGERS:
+                op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            op.execute("DROP TABLE IF EXISTS quotes_fts_ngram")
+        op.drop_column("quotes", "text_ngram")
+    except Exception as e:
+        print(e)
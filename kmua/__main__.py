@@ -15,7 +15,9 @@ from telegram.ext import (
 )
 
 import kmua.dao._db as db
-from kmua.callbacks.jobs import clean_data
+from kmua import common, dao
+from kmua.callbacks.jobs import clean_data, flush_write_buffer
+from kmua.callbacks.search import index_messages_job
 from kmua.config import settings
 from kmua.handlers import (
     callback_query_handlers,
@@ -27,6 +29,7 @@ from kmua.handlers import (
 )
 from kmua.logger import logger
 from kmua.middlewares import after_middleware, before_middleware
+from kmua.render.pool import shutdown_render_pool
 
 
 class HealthCheckHandler(BaseHTTPRequestHandler):
@@ -68,13 +71,22 @@ async def init_data(app: Application):
             ("help", "帮助|更多功能"),
         ]
     )
+    if app.bot_data.get("waifu_rollover", {}).get("pending"):
+        logger.info("Found unfinished data cleaning, resuming...")
+        app.job_queue.run_once(clean_data, 30, name="clean_data")
     logger.success("started bot")
 
 
 async def stop(app: Application):
+    logger.debug("flush write buffer...")
+    dao.flush_write_buffer()
     logger.debug("close database connection...")
     db.commit()
     db.close()
+    dao.aio.shutdown()
+    shutdown_render_pool()
+    if common.meili_client is not None:
+        await common.meili_client.close()
     logger.debug("flush persistence...")
     await app.persistence.flush()
     logger.success("stopped bot")
@@ -121,6 +133,17 @@ def run_bot():
         ),
         name="clean_data",
     )
+    job_queue.run_repeating(
+        flush_write_buffer,
+        interval=settings.get("write_buffer_interval", 5),
+        name="flush_write_buffer",
+    )
+    if common.meili_client is not None and common.redis_client is not None:
+        job_queue.run_repeating(
+            index_messages_job,
+            interval=settings.get("meilisearch_scheduler_interval", 10),
+            name="index_messages",
+        )
     app.add_handlers(
         {
             -1: before_middleware,
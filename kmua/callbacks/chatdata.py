@@ -11,7 +11,7 @@ async def chat_data_info(update: Update, _: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
     logger.info(f"chat_data_manage: {chat.title}")
     message = update.effective_message
-    text = common.get_chat_info(chat)
+    text = await common.get_chat_info(chat)
     await message.reply_text(text=text)
 
 
@@ -1,55 +1,142 @@
 import asyncio
 import gc
+import time
+from datetime import datetime
 
 from telegram.ext import ContextTypes
 
 from kmua import common, dao
 from kmua.config import settings
 from kmua.logger import logger
-from kmua.models.models import ChatData
 
 from .waifu import send_waifu_graph
 
+# 正在进行的每日重置, 避免手动触发和定时任务同时运行
+_rollover_running = False
+
 
 async def clean_data(context: ContextTypes.DEFAULT_TYPE):
+    """
+    每日重置: 逐个 chat 发送老婆关系图并重置, 然后清理头像
+
+    进度保存在 bot_data["waifu_rollover"] 中, 重启后会从中断处继续
+    """
+    global _rollover_running
+    if _rollover_running:
+        logger.warning("Data cleaning is already running")
+        return
+    _rollover_running = True
     logger.info("Start cleaning data")
     try:
-        context.bot_data["cleaning_data"] = True
-        await _send_waifu_graphs(dao.get_all_chats(), context)
+        rollover = await _get_rollover(context)
+        await _rollover_chats(rollover, context)
+        await _clean_avatars()
+        context.bot_data.pop("waifu_rollover", None)
+        await _checkpoint(context)
+        logger.success("Data has been cleaned")
     except Exception as err:
         logger.error(f"{err.__class__.__name__}: {err} happend when cleaning data")
     finally:
-        await asyncio.sleep(1)
-        await dao.refresh_all_waifu_data()
-        if common.DB_PATH and common.DB_PATH.exists() and common.DB_PATH.is_file():
-            size = common.DB_PATH.stat().st_size / 1024 / 1024
-            if size > settings.get("max_db_size", 100):
-                logger.debug(f"Database size {size:.2f} MB is too large, cleaning...")
-                count = dao.clear_inactived_users_avatar(
-                    settings.get("avatar_expire", 1)
-                )
-                logger.debug(f"Cleaned {count} inactived users' avatar")
-        else:
-            count = dao.clear_inactived_users_avatar(settings.get("avatar_expire", 1))
-            logger.debug(f"Cleaned {count} inactived users' avatar")
+        _rollover_running = False
         gc.collect()
-        logger.success("Data has been cleaned")
-        context.bot_data["cleaning_data"] = False
 
 
-async def _send_waifu_graphs(
-    chats: list[ChatData], context: ContextTypes.DEFAULT_TYPE, max_concurrent: int = 10
-):
-    semaphore = asyncio.Semaphore(max_concurrent)
+async def _get_rollover(context: ContextTypes.DEFAULT_TYPE) -> dict:
+    """
+    同一天内中断的重置直接继续, 否则将未完成的 chat 合并到今天的重置中
+    """
+    today = datetime.now(context.bot.defaults.tzinfo).date().isoformat()
+    rollover = context.bot_data.get("waifu_rollover")
+    if rollover and rollover["date"] == today and rollover["pending"]:
+        logger.info(
+            f"Resume data cleaning of {today}, {len(rollover['pending'])} chats left"
+        )
+        return rollover
+    pending = await dao.aio.get_chats_id_has_waifu()
+    if rollover:
+        pending = list(dict.fromkeys(rollover["pending"] + pending))
+    rollover = {"date": today, "pending": pending, "done": 0}
+    context.bot_data["waifu_rollover"] = rollover
+    await _checkpoint(context)
+    logger.info(f"{len(pending)} chats to be refreshed")
+    return rollover
+
+
+async def _rollover_chats(rollover: dict, context: ContextTypes.DEFAULT_TYPE):
+    interval = settings.get("waifu_rollover_interval", 1.0)
+    checkpoint_interval = settings.get("waifu_rollover_checkpoint_interval", 10)
+    pending: list[int] = rollover["pending"]
+    try:
+        while pending:
+            chat_id = pending[0]
+            rollover["current"] = chat_id
+            await _rollover_chat(chat_id, context)
+            pending.pop(0)
+            rollover["done"] += 1
+            if rollover["done"] % checkpoint_interval == 0:
+                await _checkpoint(context)
+            # 控制发送速度, 避免触发 telegram 的限制
+            await asyncio.sleep(interval)
+    finally:
+        rollover.pop("current", None)
+
+
+async def _rollover_chat(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
+    """
+    发送一个 chat 的老婆关系图并重置, 出错时记录日志, 不影响其他 chat
+
+    重置在主线程的 session 中执行, 使其中缓存的 UserChatAssociation 同步更新
+    """
+    try:
+        chat = await dao.aio.get_chat_by_id(chat_id, dao.LoadProfile.IDENTITY)
+        if chat is not None:
+            await send_waifu_graph(chat, context)
+    except Exception as err:
+        logger.error(
+            f"{err.__class__.__name__}: {err} happend when sending waifu graph "
+            f"for <{chat_id}>"
+        )
+    try:
+        dao.refresh_chat_waifu_data(chat_id)
+    except Exception as err:
+        logger.error(
+            f"{err.__class__.__name__}: {err} happend when refreshing waifu data "
+            f"for <{chat_id}>"
+        )
+
+
+async def _checkpoint(context: ContextTypes.DEFAULT_TYPE):
+    if context.application.persistence is None:
+        return
+    try:
+        await context.application.update_persistence()
+        await context.application.persistence.flush()
+    except Exception as err:
+        logger.warning(f"{err.__class__.__name__}: {err} happend when saving progress")
+
+
+async def _clean_avatars():
+    if common.DB_PATH and common.DB_PATH.exists() and common.DB_PATH.is_file():
+        size = common.DB_PATH.stat().st_size / 1024 / 1024
+        if size > settings.get("max_db_size", 100):
+            logger.debug(f"Database size {size:.2f} MB is too large, cleaning...")
+            count = await dao.aio.clear_inactived_users_avatar(
+                settings.get("avatar_expire", 1)
+            )
+            logger.debug(f"Cleaned {count} inactived users' avatar")
+    else:
+        count = await dao.aio.clear_inactived_users_avatar(
+            settings.get("avatar_expire", 1)
+        )
+        logger.debug(f"Cleaned {count} inactived users' avatar")
+    snapshot_time = time.time()
+    keep = await dao.aio.get_all_avatar_hashes()
+    count = await asyncio.to_thread(common.prune_avatars, keep, snapshot_time)
+    logger.debug(f"Pruned {count} unused avatar files")
 
-    async def send_with_semaphore(chat: ChatData):
-        async with semaphore:
-            return await send_waifu_graph(chat, context)
 
-    await asyncio.gather(
-        *(send_with_semaphore(chat) for chat in chats),
-        return_exceptions=True,
-    )
+async def flush_write_buffer(_: ContextTypes.DEFAULT_TYPE):
+    dao.flush_write_buffer()
 
 
 async def delete_message(context: ContextTypes.DEFAULT_TYPE):
@@ -46,8 +46,7 @@ async def bot_data_refresh(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         await query.answer("正在刷新 bot 数据...")
         db_bot_user = dao.get_user_by_id(context.bot.id)
-        avatar = await common.download_big_avatar(context.bot.id, context)
-        db_bot_user.avatar_big_blob = avatar
+        avatar = await common.update_user_avatar(db_bot_user, context, big=True)
         sent_message = await chat.send_photo(
             photo=avatar,
             caption="此消息用于获取 bot 头像缓存 id",
@@ -185,11 +184,11 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         if not query:
             await update.effective_message.reply_text(
-                common.get_bot_status(), reply_markup=_status_markup
+                await common.get_bot_status(), reply_markup=_status_markup
             )
             return
         await query.edit_message_text(
-            common.get_bot_status(), reply_markup=_status_markup
+            await common.get_bot_status(), reply_markup=_status_markup
         )
     finally:
         await asyncio.sleep(1)
@@ -206,7 +205,7 @@ async def clear_inactive_user_avatar(
     if query := update.callback_query:
         days = int(query.data.split(" ")[-1])
         await query.answer("正在清理...")
-        count = dao.clear_inactived_users_avatar(days)
+        count = await dao.aio.clear_inactived_users_avatar(days)
         await query.edit_message_text(f"已清理 {count} 个用户的头像缓存")
         return
     message = update.effective_message
@@ -220,7 +219,7 @@ async def clear_inactive_user_avatar(
     if days < 1:
         await message.reply_text("请输入正确的天数")
         return
-    count = dao.get_inactived_users_count(days)
+    count = await dao.aio.get_inactived_users_count(days)
     _clear_inactive_user_avatar_markup = InlineKeyboardMarkup(
         [
             [
@@ -252,7 +251,11 @@ async def fix_quotes(update: Update, _: ContextTypes.DEFAULT_TYPE):
         return
     logger.info(f"{update.effective_user.name} <fix_quotes>")
     await update.effective_message.reply_text("开始修复...")
-    quote_count, invalid_chat_count, failed_count = dao.fix_none_chat_id_quotes()
+    (
+        quote_count,
+        invalid_chat_count,
+        failed_count,
+    ) = await dao.aio.fix_none_chat_id_quotes()
     await update.effective_message.reply_text(
         f"修复完成\n"
         f"共找到 {quote_count} 条没有 chat_id 的 quote\n"
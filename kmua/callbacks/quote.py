@@ -126,15 +126,27 @@ async def _generate_and_send_quote_img(
     if not avatar:
         with open(common.DEFAULT_BIG_AVATAR_PATH, "rb") as f:
             avatar = f.read()
+    name = quote_user.title if isinstance(quote_user, Chat) else quote_user.name
+    cache_key = common.get_quote_img_cache_key(avatar, quote_message.text, name)
+    if cached_file_id := common.get_cached_quote_img(cache_key):
+        try:
+            sent_photo = await update.effective_chat.send_photo(photo=cached_file_id)
+            return sent_photo.photo[0].file_id
+        except Exception as err:
+            logger.warning(
+                f"Failed to send cached quote image: {err.__class__.__name__}: {err}"
+            )
+            common.set_cached_quote_img(cache_key, None)
     _, quote_img = await asyncio.gather(
         update.effective_chat.send_action(ChatAction.UPLOAD_PHOTO),
         common.generate_quote_img(
             avatar=avatar,
             text=quote_message.text,
-            name=quote_user.title if isinstance(quote_user, Chat) else quote_user.name,
+            name=name,
         ),
     )
     sent_photo = await update.effective_chat.send_photo(photo=quote_img)
+    common.set_cached_quote_img(cache_key, sent_photo.photo[-1].file_id)
     return sent_photo.photo[0].file_id
 
 
@@ -201,16 +213,20 @@ async def random_quote(update: Update, _: ContextTypes.DEFAULT_TYPE):
     私聊中的消息将直接由 keyword_reply_handler 处理
     """
     chat = update.effective_chat
-    user = update.effective_user
     message = update.effective_message
-    logger.trace(f"[{chat.title}]({user.name}) <random_quote>")
+    stats = common.random_quote_stats
+    stats["messages"] += 1
+    # 概率来自内存中的群组设置缓存, 缓存和概率都命中时不访问数据库和 API
+    cached = dao.is_chat_config_cached(chat.id)
     pb = dao.get_chat_quote_probability(chat)
     flag = common.random_unit(pb)
-    if message.text is not None:
-        if message.text.startswith("/qrand") and pb >= 0:
-            flag = True
+    if not flag and message.text is not None:
+        flag = message.text.startswith("/qrand") and pb >= 0
     if not flag:
+        stats["skipped" if cached else "skipped_after_lookup"] += 1
         return
+    stats["triggered"] += 1
+    logger.trace(f"[{chat.title}]({update.effective_user.name}) <random_quote>")
     quote = dao.get_chat_random_quote(chat)
     if not quote:
         return
@@ -220,6 +236,7 @@ async def random_quote(update: Update, _: ContextTypes.DEFAULT_TYPE):
             message_id=quote.message_id,
             message_thread_id=update.effective_message.message_thread_id,
         )
+        stats["forwarded"] += 1
         logger.info(f"Bot forward message: {sent_message.text}")
     except Exception as e:
         logger.warning(f"{e.__class__.__name__}: {e}")
@@ -309,7 +326,7 @@ async def _chat_quote_manage(update: Update, _: ContextTypes.DEFAULT_TYPE):
     quotes = dao.get_chat_quotes_page(
         chat=update.effective_chat, page=page, page_size=common.QUOTE_PAGE_SIZE
     )
-    quotes_count = dao.get_chat_quotes_count(chat)
+    quotes_count = await dao.aio.get_chat_quotes_count(chat)
     max_page = ceil(quotes_count / common.QUOTE_PAGE_SIZE)
     if quotes_count == 0 and not update.callback_query:
         await message.reply_text("本群还没有语录哦")
@@ -382,7 +399,7 @@ async def chat_quote_page_jump(update: Update, context: ContextTypes.DEFAULT_TYP
     if not await common.verify_user_can_manage_bot_in_chat(user, chat, update, context):
         return
     logger.info(f"[{chat.title}]({user.name})" + f" {update.callback_query.data}")
-    quotes_count = dao.get_chat_quotes_count(chat)
+    quotes_count = await dao.aio.get_chat_quotes_count(chat)
     if quotes_count == 0:
         await update.callback_query.edit_message_text("已经没有语录啦")
         return
@@ -1,10 +1,12 @@
-import pickle
+import asyncio
+import itertools
+import os
 import tempfile
-from typing import Any, Generator
+import time
+from typing import BinaryIO, Generator, Iterable
 from uuid import uuid4
 
-import orjson
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Message, Update
 from telegram.ext import ContextTypes
 from telegram.helpers import escape_markdown
 
@@ -12,6 +14,8 @@ from kmua import common, config, dao
 from kmua.logger import logger
 
 _enable_search = common.meili_client is not None and common.redis_client is not None
+# 启动后是否已检查过旧版本的消息队列
+_legacy_queue_checked = False
 
 
 async def search_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -27,8 +31,8 @@ async def search_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = " ".join(context.args)
     logger.info(f"[{chat.title}]({update.effective_user.name}) search: {query}")
     try:
-        result = common.meili_client.index(f"kmua_{chat.id}").search(
-            query, _get_search_params()
+        result = await common.meili_client.search(
+            f"kmua_{chat.id}", query, _get_search_params()
         )
     except Exception as e:
         logger.error(f"search error: {e.__class__.__name__}: {e}")
@@ -38,8 +42,11 @@ async def search_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("没有在本群找到相关内容呢")
         return
     chat_id_str = str(chat.id).removeprefix("-100")
+    names = await dao.aio.get_user_display_names(
+        {hit["user_id"] for hit in result["hits"]}
+    )
     text = ""
-    for hit_text in _get_hit_text(result["hits"], chat_id_str):
+    for hit_text in _get_hit_text(result["hits"], chat_id_str, names):
         text += hit_text
     if not text:
         await update.callback_query.answer("没有更多结果了", cache_time=60)
@@ -87,8 +94,8 @@ async def search_message_page(update: Update, _: ContextTypes.DEFAULT_TYPE):
     common.redis_client.expire(f"kmua_cqdata_{query_uuid}", 6000)
     offset = int(offset)
     try:
-        result = common.meili_client.index(f"kmua_{update.effective_chat.id}").search(
-            query, _get_search_params(offset)
+        result = await common.meili_client.search(
+            f"kmua_{update.effective_chat.id}", query, _get_search_params(offset)
         )
     except Exception as e:
         logger.error(f"search error: {e.__class__.__name__}: {e}")
@@ -100,8 +107,11 @@ async def search_message_page(update: Update, _: ContextTypes.DEFAULT_TYPE):
         await update.callback_query.answer("没有更多结果了", cache_time=60)
         return
     chat_id_str = str(update.effective_chat.id).removeprefix("-100")
+    names = await dao.aio.get_user_display_names(
+        {hit["user_id"] for hit in result["hits"]}
+    )
     text = ""
-    for hit_text in _get_hit_text(result["hits"], chat_id_str):
+    for hit_text in _get_hit_text(result["hits"], chat_id_str, names):
         text += hit_text
     if not text:
         await update.callback_query.answer("没有更多结果了", cache_time=60)
@@ -159,14 +169,14 @@ async def enable_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("你没有权限哦")
         return
     try:
-        common.meili_client.create_index(
-            f"kmua_{chat.id}", {"primaryKey": "message_id"}
+        await common.meili_client.create_index(
+            f"kmua_{chat.id}", primary_key="message_id"
         )
-        common.meili_client.index(f"kmua_{chat.id}").update_searchable_attributes(
-            ["text"]
+        await common.meili_client.update_searchable_attributes(
+            f"kmua_{chat.id}", ["text"]
         )
-        common.meili_client.index(f"kmua_{chat.id}").update_filterable_attributes(
-            ["type", "user_id"]
+        await common.meili_client.update_filterable_attributes(
+            f"kmua_{chat.id}", ["type", "user_id"]
         )
     except Exception as e:
         logger.error(f"create index error: {e.__class__.__name__}: {e}")
@@ -186,8 +196,6 @@ async def disable_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await common.verify_user_can_manage_bot_in_chat(user, chat, update, context):
         await update.effective_message.reply_text("你没有权限哦")
         return
-    for job in context.job_queue.get_jobs_by_name(f"update_index_{chat.id}"):
-        job.schedule_removal()
     dao.update_chat_message_search_enabled(chat, False)
     await update.effective_message.reply_text(
         "已关闭搜索功能, 要删除此前的索引嘛?",
@@ -228,8 +236,8 @@ async def delete_search_index(update: Update, context: ContextTypes.DEFAULT_TYPE
         try:
             context.chat_data.pop("pending_messages", None)
             await context.application.persistence.flush()
-            common.redis_client.delete(f"kmua_chatmsg_{chat.id}")
-            common.meili_client.delete_index(f"kmua_{chat.id}")
+            common.delete_index_queue(chat.id)
+            await common.meili_client.delete_index(f"kmua_{chat.id}")
         except Exception as e:
             logger.error(f"delete index error: {e.__class__.__name__}: {e}")
             await update.callback_query.edit_message_text(
@@ -253,9 +261,6 @@ async def import_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not dao.get_chat_message_search_enabled(chat):
         await update.effective_message.reply_text("本群没有开启搜索功能哦")
         return
-    if context.chat_data.get("updating_index"):
-        await update.effective_message.reply_text("正在更新索引, 请稍后再试")
-        return
     if not await common.verify_user_can_manage_bot_in_chat(
         update.effective_user, update.effective_chat, update, context
     ):
@@ -290,39 +295,8 @@ async def import_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
         with tempfile.TemporaryDirectory() as temp_dir:
             file_path = f"{temp_dir}/{chat.id}_history.json"
             await history_file.download_to_drive(file_path)
-            with open(file_path, "r") as f:
-                history_raw: dict[str, Any] = orjson.loads(f.read())
-
-        if not history_raw:
-            await sent_message.edit_text("导入失败, 请检查文件格式")
-            return
-
-        chat_id = "-100" + str(history_raw["id"])
-        if chat_id != str(chat.id):
-            await sent_message.edit_text("导入失败, 文件中的历史记录不属于此群")
-            return
-        if history_raw["type"] not in ("private_supergroup", "public_supergroup"):
-            await sent_message.edit_text("导入失败, 非超级群组历史记录")
-            return
-        history_raw_messages: list = history_raw.get("messages")
-        if not history_raw_messages:
-            await sent_message.edit_text("文件中没有消息记录")
-            return
-
-        await sent_message.edit_text(
-            f"正在导入历史消息, 共 {len(history_raw_messages)} 条"
-        )
-
-        count = 0
-        for msg in _get_message_meili(history_raw_messages):
-            count += 1
-            if context.chat_data.get("updating_index"):
-                if not context.chat_data.get("pending_messages"):
-                    context.chat_data["pending_messages"] = []
-                context.chat_data["pending_messages"].append(msg)
-                continue
-            common.redis_client.rpush(f"kmua_chatmsg_{chat.id}", pickle.dumps(msg))
-        await target_message.reply_text(f"已将 {count} 条消息加入队列, 请稍等更新哦")
+            with open(file_path, "rb") as f:
+                await _import_history_file(chat.id, f, sent_message, target_message)
     except Exception as e:
         logger.error(f"import history error: {e.__class__.__name__}: {e}")
         await message.reply_text("出错了喵, 导入失败")
@@ -330,6 +304,62 @@ async def import_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.chat_data["importing_history"] = False
 
 
+async def _import_history_file(
+    chat_id: int, file: BinaryIO, sent_message: Message, target_message: Message
+):
+    """
+    逐条解析导出的历史记录, 分批加入索引队列, 并定期更新进度
+    """
+    reader = common.ChatHistoryReader(file)
+    try:
+        header = await asyncio.to_thread(reader.read_header)
+    except ValueError:
+        await sent_message.edit_text("导入失败, 请检查文件格式")
+        return
+    if "id" not in header or "type" not in header:
+        await sent_message.edit_text("导入失败, 请检查文件格式")
+        return
+    if "-100" + str(header["id"]) != str(chat_id):
+        await sent_message.edit_text("导入失败, 文件中的历史记录不属于此群")
+        return
+    if header["type"] not in ("private_supergroup", "public_supergroup"):
+        await sent_message.edit_text("导入失败, 非超级群组历史记录")
+        return
+
+    file_size = os.fstat(file.fileno()).st_size
+    batch_size = config.settings.get("meilisearch_import_batch_size", 1000)
+    progress_interval = config.settings.get("meilisearch_import_progress_interval", 5)
+    messages = _get_message_meili(reader.iter_messages())
+    count = 0
+    last_progress = time.monotonic()
+    await sent_message.edit_text("正在导入历史消息...")
+    while batch := await asyncio.to_thread(
+        common.enqueue_messages,
+        chat_id,
+        itertools.islice(messages, batch_size),
+        batch_size,
+    ):
+        count += batch
+        if time.monotonic() - last_progress < progress_interval:
+            continue
+        last_progress = time.monotonic()
+        try:
+            await sent_message.edit_text(
+                f"正在导入历史消息 {reader.position / file_size:.0%}, "
+                f"已读取 {reader.messages_read} 条, 已加入队列 {count} 条"
+            )
+        except Exception as e:
+            logger.debug(f"edit import progress error: {e.__class__.__name__}: {e}")
+
+    if not reader.messages_read:
+        await sent_message.edit_text("文件中没有消息记录")
+        return
+    await sent_message.edit_text(
+        f"已读取 {reader.messages_read} 条历史消息, 加入队列 {count} 条"
+    )
+    await target_message.reply_text(f"已将 {count} 条消息加入队列, 请稍等更新哦")
+
+
 async def update_index(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not common.verify_user_can_manage_bot(update.effective_user):
         return
@@ -340,9 +370,6 @@ async def update_index(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not dao.get_chat_message_search_enabled(chat):
         await update.effective_message.reply_text("本群没有开启搜索功能哦")
         return
-    if context.chat_data.get("updating_index"):
-        await update.effective_message.reply_text("正在更新索引, 请稍后再试")
-        return
     logger.info(f"[{chat.title}]({update.effective_user.name}) <update index>")
     context.job_queue.run_once(
         update_index_job,
@@ -359,7 +386,7 @@ async def index_stats(update: Update, _: ContextTypes.DEFAULT_TYPE):
         return
     if common.verify_user_can_manage_bot(update.effective_user):
         try:
-            all_stats = common.meili_client.get_all_stats()
+            all_stats = await common.meili_client.get_all_stats()
             await update.effective_message.reply_text(
                 f"数据库大小: {all_stats['databaseSize'] / 1024 / 1024:.2f}MB\n"
                 f"已索引对话: {len(all_stats['indexes'])} 个\n"
@@ -373,10 +400,12 @@ async def index_stats(update: Update, _: ContextTypes.DEFAULT_TYPE):
     if chat.type not in (chat.SUPERGROUP, chat.GROUP):
         return
     try:
-        index_stats = common.meili_client.index(f"kmua_{chat.id}").get_stats()
-        await update.effective_message.reply_text(
-            f"本群已索引 {index_stats.number_of_documents} 条消息"
-        )
+        index_stats = await common.meili_client.get_stats(f"kmua_{chat.id}")
+        pending, lag = common.get_index_lag(chat.id)
+        text = f"本群已索引 {index_stats['numberOfDocuments']} 条消息"
+        if pending:
+            text += f"\n等待索引 {pending} 条, 最早的已等待 {lag:.0f} 秒"
+        await update.effective_message.reply_text(text)
     except Exception as e:
         logger.error(f"get index stats error: {e.__class__.__name__}: {e}")
         await update.effective_message.reply_text("出错了喵, 获取失败")
@@ -384,35 +413,73 @@ async def index_stats(update: Update, _: ContextTypes.DEFAULT_TYPE):
 
 
 async def update_index_job(context: ContextTypes.DEFAULT_TYPE):
-    if context.chat_data.get("updating_index"):
-        logger.trace(f"index is updating for {context.job.chat_id}, skip")
-    msg_cache = common.redis_client.lrange(f"kmua_chatmsg_{context.job.chat_id}", 0, -1)
-    if not msg_cache:
-        logger.trace(f"no message to update for {context.job.chat_id}")
-        return
-    logger.trace(f"updating index for {context.job.chat_id}")
-    context.chat_data["updating_index"] = True
     try:
-        messages: list[common.MessageInMeili] = [
-            pickle.loads(msg).to_dict() for msg in msg_cache
-        ]
-        logger.trace(f"load {len(messages)} messages for {context.job.chat_id}")
-        common.meili_client.index(f"kmua_{context.job.chat_id}").add_documents(
-            documents=messages,
-            primary_key="message_id",
-        )
-        common.redis_client.delete(f"kmua_chatmsg_{context.job.chat_id}")
+        count = await common.index_chat_messages(context.job.chat_id)
     except Exception as e:
-        logger.error(f"load message error: {e.__class__.__name__}: {e}")
-        common.redis_client.delete(f"kmua_chatmsg_{context.job.chat_id}")
+        logger.error(f"update index error: {e.__class__.__name__}: {e}")
         return
-    finally:
-        context.chat_data["updating_index"] = False
-    logger.trace(f"Index updated for {context.job.chat_id}")
+    if count:
+        logger.trace(f"Indexed {count} messages for {context.job.chat_id}")
+
+
+async def _move_pending_messages(context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    将旧版本在更新索引时暂存在 chat_data 中的消息加入索引队列
+
+    :return: chat 数
+    """
+    count = 0
+    # 等待写入时可能有新的 chat, 先复制一份
+    for chat_id, chat_data in list(context.application.chat_data.items()):
+        if not (pending_messages := chat_data.get("pending_messages")):
+            continue
+        await asyncio.to_thread(common.enqueue_messages, chat_id, pending_messages)
+        # 加入队列后才从 chat_data 中删除
+        del chat_data["pending_messages"]
+        context.application.mark_data_for_update_persistence(chat_ids=chat_id)
+        count += 1
+    return count
+
+
+async def index_messages_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    全局唯一的索引任务, 按优先级处理有消息积压的 chat,
+    同时写入的 chat 数不超过 meilisearch_index_concurrency
+    """
+    global _legacy_queue_checked
+    if not _legacy_queue_checked:
+        count = await asyncio.to_thread(common.mark_legacy_chats_dirty)
+        if count:
+            logger.info(f"Found {count} chats with legacy index queue")
+        count = await _move_pending_messages(context)
+        if count:
+            logger.info(f"Moved pending messages of {count} chats to index queue")
+        _legacy_queue_checked = True
+    chat_ids = await asyncio.to_thread(common.get_due_index_chats)
+    if not chat_ids:
+        return
+    semaphore = asyncio.Semaphore(
+        config.settings.get("meilisearch_index_concurrency", 4)
+    )
+
+    async def index_chat(chat_id: int) -> int:
+        async with semaphore:
+            return await common.index_chat_messages(chat_id)
+
+    results = await asyncio.gather(
+        *(index_chat(chat_id) for chat_id in chat_ids), return_exceptions=True
+    )
+    for chat_id, result in zip(chat_ids, results):
+        if isinstance(result, Exception):
+            logger.error(
+                f"update index error for {chat_id}: {result.__class__.__name__}: {result}"
+            )
+    indexed = sum(result for result in results if isinstance(result, int))
+    logger.trace(f"Indexed {indexed} messages for {len(chat_ids)} chats")
 
 
 def _get_message_meili(
-    raw_messages: list,
+    raw_messages: Iterable[dict],
 ) -> Generator[common.MessageInMeili, None, None]:
     for msg_export in raw_messages:
         if msg_export["type"] != "message":
@@ -481,17 +548,16 @@ def _get_message_type_emoji(type: int) -> str:
             return "💬"
 
 
-def _get_hit_text(hits: list[dict], chat_id: str) -> Generator[str, None, None]:
+def _get_hit_text(
+    hits: list[dict], chat_id: str, names: dict[int, str]
+) -> Generator[str, None, None]:
     for hit in hits:
         emoji = _get_message_type_emoji(hit["type"])
         message_link = f"https://t.me/c/{chat_id}/{hit['message_id']}"
         formatted_text = hit["_formatted"]["text"].replace("\n", " ")
         formatted_text = f"{escape_markdown(emoji, 2)} [{escape_markdown(formatted_text, 2)}]({message_link})\n\n"
         user_id: int = hit["user_id"]
-        if db_user := dao.get_user_by_id(user_id):
-            user_text = escape_markdown(f"[{db_user.full_name}]:\n", 2)
-        else:
-            user_text = escape_markdown(f"[{user_id}]:\n", 2)
+        user_text = escape_markdown(f"[{names.get(user_id, user_id)}]:\n", 2)
         yield f"{user_text}{formatted_text}"
 
 
@@ -47,9 +47,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     db_bot_user = dao.get_user_by_id(context.bot.id)
     if not db_bot_user:
         db_bot_user = dao.add_user((await context.bot.get_me()))
-        db_bot_user.avatar_big_blob = await common.download_big_avatar(
-            context.bot.id, context
-        )
+        await common.update_user_avatar(db_bot_user, context, big=True)
         dao.commit()
     photo = db_bot_user.avatar_big_id
     if not photo:
@@ -41,10 +41,10 @@ async def user_data_manage(update: Update, _: ContextTypes.DEFAULT_TYPE):
             reply_markup=_user_data_manage_markup,
         )
         return
-    if db_user.avatar_big_blob:
+    if avatar_big := common.get_user_avatar(db_user, big=True):
         await query.edit_message_media(
             media=InputMediaPhoto(
-                media=db_user.avatar_big_blob,
+                media=avatar_big,
                 caption=info,
             ),
             reply_markup=_user_data_manage_markup,
@@ -78,8 +78,9 @@ async def user_data_refresh(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.application.drop_user_data(user.id)
     username = user.username
     full_name = user.full_name
-    avatar_big_blob = await common.download_big_avatar(user.id, context)
-    avatar_small_blob = await common.download_small_avatar(user.id, context)
+    db_user = dao.get_user_by_id(user.id)
+    avatar_big_blob = await common.update_user_avatar(db_user, context, big=True)
+    await common.update_user_avatar(db_user, context, big=False)
     avatar_big_id = None
     if avatar_big_blob:
         sent_message = await update.effective_chat.send_photo(
@@ -88,13 +89,11 @@ async def user_data_refresh(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         avatar_big_id = sent_message.photo[-1].file_id
         await sent_message.delete()
-    db_user = dao.get_user_by_id(user.id)
     db_user.username = username
     db_user.full_name = full_name
-    db_user.avatar_big_blob = avatar_big_blob
-    db_user.avatar_small_blob = avatar_small_blob
     db_user.avatar_big_id = avatar_big_id
     dao.commit()
+    dao.update_user_display_names({db_user.id: db_user.full_name})
     info = common.get_user_info(user)
     info += "\n刷新成功"
     if avatar_big_id:
@@ -158,8 +157,8 @@ async def refresh_user_data_by_id(update: Update, context: ContextTypes.DEFAULT_
         return
 
     target = await context.bot.get_chat(chat_id)
-    avatar_big_blob = await common.download_big_avatar(chat_id, context)
-    avatar_small_blob = await common.download_small_avatar(chat_id, context)
+    avatar_big_blob = await common.update_user_avatar(db_user, context, big=True)
+    await common.update_user_avatar(db_user, context, big=False)
     avatar_big_id = None
 
     sent_message = None
@@ -172,10 +171,9 @@ async def refresh_user_data_by_id(update: Update, context: ContextTypes.DEFAULT_
 
     db_user.username = target.username
     db_user.full_name = target.full_name or target.title
-    db_user.avatar_big_blob = avatar_big_blob
-    db_user.avatar_small_blob = avatar_small_blob
     db_user.avatar_big_id = avatar_big_id
     dao.commit()
+    dao.update_user_display_names({db_user.id: db_user.full_name})
 
     info = common.get_user_info(target) + "\n刷新成功"
     if avatar_big_id and sent_message:
@@ -296,7 +294,7 @@ async def _user_quote_manage(update: Update, _: ContextTypes.DEFAULT_TYPE):
     logger.info(f"({user.name}) <user quote manage>")
     page = int(query.data.split(" ")[-1]) if len(query.data.split(" ")) > 1 else 1
     page_size = 5
-    quotes_count = dao.get_user_quotes_count(user)
+    quotes_count = await dao.aio.get_user_quotes_count(user)
     max_page = ceil(quotes_count / page_size)
     if quotes_count == 0:
         caption = (
@@ -348,7 +346,7 @@ async def _qer_quote_manage(update: Update, _: ContextTypes.DEFAULT_TYPE):
     logger.info(f"({user.name}) <qer quote manage>")
     page = int(query.data.split(" ")[-1]) if len(query.data.split(" ")) > 1 else 1
     page_size = 5
-    quotes_count = dao.get_qer_quotes_count(user)
+    quotes_count = await dao.aio.get_qer_quotes_count(user)
     max_page = ceil(quotes_count / page_size)
     if quotes_count == 0:
         await query.edit_message_caption(
@@ -33,7 +33,8 @@ async def waifu_graph(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     if dao.get_chat_waifu_disabled(update.effective_chat):
         return
-    if context.bot_data.get("cleaning_data", False):
+    rollover = context.bot_data.get("waifu_rollover")
+    if rollover and rollover.get("current") == update.effective_chat.id:
         return
 
     msg_id = update.effective_message.id
@@ -51,10 +52,27 @@ async def send_waifu_graph(
 ):
     logger.debug(f"Generating waifu graph for {chat.title}<{chat.id}>")
     try:
-        participate_users, participate_user_count = (
-            dao.get_chat_user_participated_waifu_data(chat)
-        )
-        if participate_user_count < 2 or not participate_users:
+        version = dao.get_chat_waifu_version(chat.id)
+        if cached := common.get_cached_waifu_graph(chat.id, version):
+            file_id, participate_user_count = cached
+            try:
+                await context.bot.send_document(
+                    chat.id,
+                    document=file_id,
+                    caption=f"老婆关系图:\n {participate_user_count} users",
+                    reply_to_message_id=msg_id,
+                    allow_sending_without_reply=True,
+                )
+                logger.success(f"Send cached waifu graph for {chat.title}<{chat.id}>")
+                return
+            except Exception as err:
+                logger.warning(
+                    f"Failed to send cached waifu graph: {err.__class__.__name__}: {err}"
+                )
+                common.set_cached_waifu_graph(chat.id, version, None)
+        relationships, participate_users = dao.get_chat_waifu_graph_data(chat)
+        participate_user_count = len(participate_users)
+        if participate_user_count < 2:
             if msg_id:
                 await context.bot.send_message(
                     chat.id,
@@ -62,18 +80,18 @@ async def send_waifu_graph(
                     reply_to_message_id=msg_id,
                 )
             return
-        relationships = common.get_chat_waifu_relationships(chat)
 
         with open(common.DEFAULT_SMALL_AVATAR_PATH, "rb") as f:
             default_avatar = f.read()
-        user_info = (
+        avatars = common.get_users_small_avatar(participate_users)
+        user_info = [
             {
                 "id": user.id,
                 "username": user.username or f"{user.id}",
-                "avatar": user.avatar_small_blob or default_avatar,
+                "avatar": avatars.get(user.id, default_avatar),
             }
             for user in participate_users
-        )
+        ]
         image_bytes = await common.render_waifu_graph(
             relationships, user_info, participate_user_count
         )
@@ -86,6 +104,9 @@ async def send_waifu_graph(
             reply_to_message_id=msg_id,
             allow_sending_without_reply=True,
         )
+        common.set_cached_waifu_graph(
+            chat.id, version, sent_message.document.file_id, participate_user_count
+        )
         logger.success(
             f"Send waifu graph for {chat.title}<{chat.id}>, size: {sent_message.document.file_size}"
         )
@@ -164,15 +185,11 @@ async def today_waifu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
     finally:
         if waifu:
-            if not waifu.avatar_small_blob:
-                waifu.avatar_small_blob = await common.download_small_avatar(
-                    waifu.id, context
-                )
+            if not waifu.avatar_small_hash:
+                await common.update_user_avatar(waifu, context, big=False)
         db_user = dao.get_user_by_id(user.id)
-        if not db_user.avatar_small_blob:
-            db_user.avatar_small_blob = await common.download_small_avatar(
-                user.id, context
-            )
+        if not db_user.avatar_small_hash:
+            await common.update_user_avatar(db_user, context, big=False)
         dao.commit()
         context.user_data["waifu_waiting"] = False
 
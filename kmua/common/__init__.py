@@ -1,6 +1,7 @@
 from .bot import *  # noqa
 from .chat import *  # noqa
 from .user import *  # noqa
+from .avatar import *  # noqa
 from .utils import *  # noqa
 from .message import *  # noqa
 from .quote import *  # noqa
@@ -9,4 +10,6 @@ from .constants import *  # noqa
 from .meilisearch import *  # noqa
 from .dataclass import *  # noqa
 from .redis import *  # noqa
+from .ingest import *  # noqa
+from .history import *  # noqa
 from .openai import *  # noqa
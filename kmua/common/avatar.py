@@ -0,0 +1,96 @@
+import hashlib
+import os
+from pathlib import Path
+
+from kmua.config import data_dir, settings
+from kmua.logger import logger
+
+AVATAR_DIR = Path(settings.get("avatar_dir", data_dir / "avatars"))
+# 保存后到提交前的头像不在数据库中, 清理时跳过最近使用过的文件
+PRUNE_GRACE_SECONDS = 600
+# telegram file_unique_id -> 头像内容的 sha256
+_UNIQUE_ID_DIR = AVATAR_DIR / "unique_id"
+
+
+def _get_avatar_path(digest: str) -> Path:
+    return AVATAR_DIR / digest[:2] / digest
+
+
+def save_avatar(avatar: bytes, file_unique_id: str | None = None) -> str:
+    """
+    保存头像, 以内容的 sha256 作为文件名, 相同的头像只保存一份
+
+    :param avatar: 头像
+    :param file_unique_id: telegram 的 file_unique_id, 提供时会记录到索引中
+    :return: 头像的 sha256
+    """
+    digest = hashlib.sha256(avatar).hexdigest()
+    path = _get_avatar_path(digest)
+    try:
+        # 已存在的文件更新修改时间, 避免在提交前被清理
+        os.utime(path)
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{digest}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(avatar)
+        tmp_path.replace(path)
+    if file_unique_id:
+        _UNIQUE_ID_DIR.mkdir(parents=True, exist_ok=True)
+        (_UNIQUE_ID_DIR / file_unique_id).write_text(digest)
+    return digest
+
+
+def load_avatar(digest: str | None) -> bytes | None:
+    if not digest:
+        return None
+    try:
+        return _get_avatar_path(digest).read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def get_avatar_hash_by_unique_id(file_unique_id: str) -> str | None:
+    """
+    通过 file_unique_id 查找已保存的头像, 头像未变化时无需重新下载
+    """
+    try:
+        digest = (_UNIQUE_ID_DIR / file_unique_id).read_text().strip()
+    except FileNotFoundError:
+        return None
+    if not _get_avatar_path(digest).exists():
+        return None
+    return digest
+
+
+def prune_avatars(keep: set[str], snapshot_time: float) -> int:
+    """
+    删除不再被任何用户引用的头像文件
+
+    :param keep: 仍在使用的头像 sha256
+    :param snapshot_time: 开始查询 keep 的时间, 此前 PRUNE_GRACE_SECONDS 内
+        保存或使用过的文件可能还未提交, 不会被删除
+    :return: 删除的文件数
+    """
+    if not AVATAR_DIR.exists():
+        return 0
+    cutoff = snapshot_time - PRUNE_GRACE_SECONDS
+    count = 0
+    for path in AVATAR_DIR.glob("??/*"):
+        if path.name in keep:
+            continue
+        try:
+            if path.stat().st_mtime >= cutoff:
+                continue
+            path.unlink()
+            count += 1
+        except OSError as err:
+            logger.warning(f"Failed to remove avatar {path}: {err}")
+    if _UNIQUE_ID_DIR.exists():
+        for path in _UNIQUE_ID_DIR.iterdir():
+            try:
+                digest = path.read_text().strip()
+                if digest not in keep and not _get_avatar_path(digest).exists():
+                    path.unlink()
+            except OSError:
+                continue
+    return count
@@ -5,19 +5,62 @@ import time
 import psutil
 
 from kmua import common, dao
+from kmua.render.pool import get_waifu_graph_pending_jobs, waifu_graph_render_stats
 
 
-def get_bot_status() -> str:
+async def get_bot_status() -> str:
     db_status = f"""
 Database Status:
-    - Users: {dao.get_all_users_count()}
-    - Chats: {dao.get_all_chats_count()}
-    - Quotes: {dao.get_all_quotes_count()}
-    - Associations: {dao.get_all_associations_count()}
+    - Users: {await dao.aio.get_all_users_count()}
+    - Chats: {await dao.aio.get_all_chats_count()}
+    - Quotes: {await dao.aio.get_all_quotes_count()}
+    - Associations: {await dao.aio.get_all_associations_count()}
     """
     if common.DB_PATH and common.DB_PATH.exists() and common.DB_PATH.is_file():
         db_status += f"- Size: {common.DB_PATH.stat().st_size / 1024 / 1024:.2f} MB"
     db_status += "\n"
+    buffer_stats = dao.get_write_buffer_stats()
+    db_status += f"""
+Write Buffer:
+    - Pending: {buffer_stats["pending"]}
+    - Coalesced: {buffer_stats["rows_coalesced"]}
+    - Flushed: {buffer_stats["rows_flushed"]} rows in {buffer_stats["flush_count"]} flushes
+    - Flush Latency: avg {buffer_stats["avg_flush_ms"]:.2f}ms, max {buffer_stats["max_flush_ms"]:.2f}ms
+    """
+    config_cache_info = dao.get_chat_config_cache_info()
+    db_status += f"""
+Chat Config Cache:
+    - Size: {config_cache_info.currsize}/{config_cache_info.maxsize}
+    - Hits: {config_cache_info.hits}
+    - Misses: {config_cache_info.misses}
+    """
+    quote_stats = common.random_quote_stats
+    db_status += f"""
+Random Quote:
+    - Messages: {quote_stats["messages"]}
+    - Skipped (no I/O): {quote_stats["skipped"]}
+    - Skipped (config lookup): {quote_stats["skipped_after_lookup"]}
+    - Triggered: {quote_stats["triggered"]}
+    - Forwarded: {quote_stats["forwarded"]}
+    """
+    quote_img_stats = common.quote_img_cache_stats
+    db_status += f"""
+Quote Image Cache:
+    - Hits: {quote_img_stats["hits"]}
+    - Misses: {quote_img_stats["misses"]}
+    """
+    graph_stats = waifu_graph_render_stats
+    avg_render_seconds = graph_stats["render_seconds"] / max(1, graph_stats["renders"])
+    avg_wait_seconds = graph_stats["wait_seconds"] / max(1, graph_stats["renders"])
+    db_status += f"""
+Waifu Graph Render:
+    - Rendered: {graph_stats["renders"]}
+    - Failed: {graph_stats["failures"]} (timeouts {graph_stats["timeouts"]}, rejected {graph_stats["rejected"]})
+    - Pending: {get_waifu_graph_pending_jobs()}
+    - Render Time: avg {avg_render_seconds:.2f}s, max {graph_stats["max_render_seconds"]:.2f}s
+    - Queue Wait: avg {avg_wait_seconds:.2f}s
+    - Cache Hits: {common.waifu_graph_cache_stats["hits"]}/{common.waifu_graph_cache_stats["hits"] + common.waifu_graph_cache_stats["misses"]}
+    """
     pid = os.getpid()
     p = psutil.Process(pid)
     process_status = f"""
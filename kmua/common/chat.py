@@ -4,12 +4,14 @@ from kmua import dao
 from kmua.models.models import ChatData
 
 
-def get_chat_info(chat: Chat | ChatData) -> str:
+async def get_chat_info(chat: Chat | ChatData) -> str:
+    members_count = await dao.aio.get_chat_members_count(chat)
+    quotes_count = await dao.aio.get_chat_quotes_count(chat)
     db_chat = dao.add_chat(chat)
     text = f"chat_id: {db_chat.id}\n"
     text += f"title: {db_chat.title}\n\n"
-    text += f"记录中共有 {len(db_chat.members)} 个成员\n"
-    text += f"记录中共有 {len(db_chat.quotes)} 条语录\n\n"
+    text += f"记录中共有 {members_count} 个成员\n"
+    text += f"记录中共有 {quotes_count} 条语录\n\n"
     text += f"created_at: {db_chat.created_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
     text += f"updated_at: {db_chat.updated_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
     return text
@@ -0,0 +1,122 @@
+# Telegram 导出的聊天记录的流式读取
+# 只把顶层字段和单条消息解析为对象, 不会一次性载入整个文件
+import codecs
+import json
+import re
+from typing import Any, BinaryIO, Generator
+
+_WHITESPACE = re.compile(r"[ \t\r\n]*")
+_NUMBER_CHARS = frozenset("0123456789.eE+-")
+# json.JSONDecoder.raw_decode 可以从指定位置解析一个值, 用来逐条解析消息
+_decoder = json.JSONDecoder()
+
+
+class ChatHistoryReader:
+    """
+    按块读取导出的 json 文件, 先用 read_header 读取 messages 之前的顶层字段,
+    再用 iter_messages 逐条读取消息
+    """
+
+    def __init__(self, file: BinaryIO, chunk_size: int = 1 << 16):
+        self._file = file
+        self._chunk_size = chunk_size
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._has_messages = False
+        self.messages_read = 0
+
+    @property
+    def position(self) -> int:
+        """
+        已读取的字节数
+        """
+        return self._file.tell()
+
+    def _more(self):
+        """
+        读取下一块数据, 丢弃已解析的部分
+        """
+        if self._eof:
+            raise ValueError("unexpected end of json")
+        data = self._file.read(self._chunk_size)
+        self._eof = not data
+        self._buf = self._buf[self._pos :] + self._utf8.decode(data, final=self._eof)
+        self._pos = 0
+
+    def _peek(self) -> str:
+        """
+        跳过空白, 返回下一个字符
+        """
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            self._more()
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise ValueError(f"expected {char!r} at {self.position}")
+        self._pos += 1
+
+    def _read_value(self) -> Any:
+        """
+        读取下一个完整的 json 值, 数据不完整时读取更多再重新解析
+        """
+        while True:
+            self._peek()
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+                self._more()
+                continue
+            # 数字可能在块的边界被截断, 如 "2." 会被解析为 2
+            if not self._eof and (
+                end == len(self._buf) or self._buf[end] in _NUMBER_CHARS
+            ):
+                self._more()
+                continue
+            self._pos = end
+            return value
+
+    def read_header(self) -> dict[str, Any]:
+        """
+        读取 messages 之前的顶层字段, 文件中没有 messages 时读取全部字段
+        """
+        header = {}
+        if self._peek() == "\ufeff":
+            self._pos += 1
+        self._expect("{")
+        if self._peek() == "}":
+            return header
+        while True:
+            key = self._read_value()
+            self._expect(":")
+            if key == "messages":
+                self._has_messages = True
+                return header
+            header[key] = self._read_value()
+            if self._peek() == "}":
+                return header
+            self._expect(",")
+
+    def iter_messages(self) -> Generator[dict[str, Any], None, None]:
+        """
+        逐条读取 messages 中的消息, 需要先调用 read_header
+        """
+        if not self._has_messages:
+            return
+        self._has_messages = False
+        self._expect("[")
+        if self._peek() == "]":
+            return
+        while True:
+            yield self._read_value()
+            self.messages_read += 1
+            if self._peek() == "]":
+                self._pos += 1
+                return
+            self._expect(",")
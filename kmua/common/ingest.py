@@ -0,0 +1,261 @@
+# 消息搜索的索引队列
+# 每个 chat 一个 redis stream, 消息写入 meilisearch 成功后才会被确认并删除
+import pickle
+import time
+from typing import Iterable
+
+import orjson
+
+from kmua.config import settings
+from kmua.logger import logger
+
+from .dataclass import MessageInMeili
+from .meilisearch import meili_client
+from .redis import redis_client
+
+_GROUP = "kmua_indexer"
+_CONSUMER = "kmua"
+# 有消息等待写入的 chat, score 为开始等待的时间
+_DIRTY_KEY = "kmua_msgstream_dirty"
+
+# 正在写入索引的 chat
+_indexing: set[int] = set()
+# 已创建消费组的 stream
+_stream_groups: set[str] = set()
+# chat_id -> (连续失败次数, 下次重试的时间)
+_index_retry: dict[int, tuple[int, float]] = {}
+
+
+def _get_stream_key(chat_id: int) -> str:
+    return f"kmua_msgstream_{chat_id}"
+
+
+def _get_legacy_key(chat_id: int) -> str:
+    # 旧版本使用的 pickle 列表
+    return f"kmua_chatmsg_{chat_id}"
+
+
+def _encode_message(message: MessageInMeili) -> bytes:
+    return orjson.dumps(
+        [message.message_id, message.user_id, message.type.value, message.text]
+    )
+
+
+def _decode_message(data: bytes) -> dict | None:
+    try:
+        message_id, user_id, message_type, text = orjson.loads(data)
+    except (orjson.JSONDecodeError, TypeError, ValueError):
+        return None
+    return {
+        "message_id": message_id,
+        "text": text,
+        "user_id": user_id,
+        "type": message_type,
+    }
+
+
+def enqueue_messages(
+    chat_id: int, messages: Iterable[MessageInMeili], batch_size: int = 500
+) -> int:
+    """
+    将消息加入 chat 的索引队列
+
+    :return: 加入的消息数
+    """
+    key = _get_stream_key(chat_id)
+    count = 0
+    pipe = redis_client.pipeline(transaction=False)
+    for message in messages:
+        pipe.xadd(key, {"m": _encode_message(message)})
+        count += 1
+        if count % batch_size == 0:
+            pipe.execute()
+    if count:
+        pipe.zadd(_DIRTY_KEY, {chat_id: time.time()}, nx=True)
+    pipe.execute()
+    return count
+
+
+def mark_legacy_chats_dirty() -> int:
+    """
+    将旧版本列表中还有消息的 chat 加入待处理集合, 在下次调度时立即处理
+
+    :return: chat 数
+    """
+    count = 0
+    for key in redis_client.scan_iter(match=_get_legacy_key("*"), count=1000):
+        chat_id = int(key.decode().removeprefix(_get_legacy_key("")))
+        redis_client.zadd(_DIRTY_KEY, {chat_id: 0}, nx=True)
+        count += 1
+    return count
+
+
+def get_due_index_chats() -> list[int]:
+    """
+    获取需要写入索引的 chat: 积压达到一批, 或等待超过 meilisearch_update_interval
+
+    按积压量和等待时间从高到低排序
+    """
+    dirty = redis_client.zrange(_DIRTY_KEY, 0, -1, withscores=True)
+    if not dirty:
+        return []
+    pipe = redis_client.pipeline(transaction=False)
+    for chat_id, _ in dirty:
+        pipe.xlen(_get_stream_key(int(chat_id)))
+    backlogs = pipe.execute()
+    batch_size = settings.get("meilisearch_batch_size", 1000)
+    interval = settings.get("meilisearch_update_interval", 300)
+    now = time.time()
+    due = []
+    for (chat_id, since), backlog in zip(dirty, backlogs):
+        age = now - since
+        if backlog >= batch_size or age >= interval:
+            due.append((backlog / batch_size + age / interval, int(chat_id)))
+    due.sort(reverse=True)
+    return [chat_id for _, chat_id in due]
+
+
+def _ensure_group(key: str):
+    if key in _stream_groups:
+        return
+    try:
+        redis_client.xgroup_create(key, _GROUP, id="0", mkstream=True)
+    except Exception as err:
+        if "BUSYGROUP" not in str(err):
+            raise
+    _stream_groups.add(key)
+
+
+def _drain_legacy_list(chat_id: int, batch_size: int) -> int:
+    """
+    将旧版本列表中的消息转移到 stream, 转移后才从列表中删除
+    """
+    key = _get_legacy_key(chat_id)
+    moved = 0
+    while raw_messages := redis_client.lrange(key, 0, batch_size - 1):
+        messages = []
+        for raw_message in raw_messages:
+            try:
+                messages.append(pickle.loads(raw_message))
+            except Exception as err:
+                logger.warning(f"invalid legacy message: {err.__class__.__name__}")
+        enqueue_messages(chat_id, messages)
+        redis_client.ltrim(key, len(raw_messages), -1)
+        moved += len(raw_messages)
+    if moved:
+        logger.debug(f"moved {moved} legacy messages to stream for {chat_id}")
+    return moved
+
+
+def _read_batch(key: str, stream_id: str, count: int) -> list:
+    try:
+        result = redis_client.xreadgroup(
+            _GROUP, _CONSUMER, {key: stream_id}, count=count
+        )
+    except Exception as err:
+        if "NOGROUP" not in str(err):
+            raise
+        # stream 被删除后重新创建消费组
+        _stream_groups.discard(key)
+        _ensure_group(key)
+        result = redis_client.xreadgroup(
+            _GROUP, _CONSUMER, {key: stream_id}, count=count
+        )
+    return result[0][1] if result else []
+
+
+async def index_chat_messages(chat_id: int) -> int:
+    """
+    将 chat 队列中的消息写入 meilisearch, 每批最多 meilisearch_batch_size 条
+
+    写入失败的消息保留在队列中, 按指数退避重试. 同一个 chat 同时只会有一个写入
+
+    :return: 写入的消息数
+    """
+    if chat_id in _indexing:
+        return 0
+    _indexing.add(chat_id)
+    since = None
+    try:
+        batch_size = settings.get("meilisearch_batch_size", 1000)
+        _drain_legacy_list(chat_id, batch_size)
+        # 先移出待处理集合, 处理期间加入的消息会重新标记
+        since = redis_client.zscore(_DIRTY_KEY, chat_id)
+        redis_client.zrem(_DIRTY_KEY, chat_id)
+        return await _index_chat_messages(chat_id, batch_size)
+    finally:
+        # redis 出错时也要移出 _indexing, 否则这个 chat 之后不会再被写入
+        try:
+            if redis_client.xlen(_get_stream_key(chat_id)):
+                redis_client.zadd(_DIRTY_KEY, {chat_id: since or time.time()}, nx=True)
+        finally:
+            _indexing.discard(chat_id)
+
+
+async def _index_chat_messages(chat_id: int, batch_size: int) -> int:
+    failures, retry_at = _index_retry.get(chat_id, (0, 0.0))
+    if time.monotonic() < retry_at:
+        return 0
+    key = _get_stream_key(chat_id)
+    _ensure_group(key)
+    indexed = 0
+    # 先处理已读取但未确认的消息 (上次写入失败或进程退出), 再读取新消息
+    stream_id = "0"
+    while True:
+        entries = _read_batch(key, stream_id, batch_size)
+        if not entries:
+            if stream_id == ">":
+                break
+            stream_id = ">"
+            continue
+        entry_ids = [entry_id for entry_id, _ in entries]
+        documents = [
+            document
+            for _, fields in entries
+            if fields and (document := _decode_message(fields.get(b"m")))
+        ]
+        try:
+            if documents:
+                await meili_client.add_documents(
+                    f"kmua_{chat_id}", documents, primary_key="message_id"
+                )
+        except Exception as err:
+            failures += 1
+            delay = min(
+                settings.get("meilisearch_retry_base", 5) * 2 ** (failures - 1),
+                settings.get("meilisearch_retry_max", 600),
+            )
+            _index_retry[chat_id] = (failures, time.monotonic() + delay)
+            logger.error(
+                f"index messages error for {chat_id}: {err.__class__.__name__}: {err}, "
+                f"retry in {delay}s"
+            )
+            return indexed
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.xack(key, _GROUP, *entry_ids)
+        pipe.xdel(key, *entry_ids)
+        pipe.execute()
+        indexed += len(documents)
+    _index_retry.pop(chat_id, None)
+    return indexed
+
+
+def get_index_lag(chat_id: int) -> tuple[int, float]:
+    """
+    :return: (队列中等待写入的消息数, 最早的消息已等待的秒数)
+    """
+    key = _get_stream_key(chat_id)
+    pending = redis_client.xlen(key) + redis_client.llen(_get_legacy_key(chat_id))
+    oldest = redis_client.xrange(key, count=1)
+    if not oldest:
+        return pending, 0.0
+    oldest_ms = int(oldest[0][0].split(b"-")[0])
+    return pending, max(0.0, time.time() - oldest_ms / 1000)
+
+
+def delete_index_queue(chat_id: int):
+    key = _get_stream_key(chat_id)
+    redis_client.delete(key, _get_legacy_key(chat_id))
+    redis_client.zrem(_DIRTY_KEY, chat_id)
+    _stream_groups.discard(key)
+    _index_retry.pop(chat_id, None)
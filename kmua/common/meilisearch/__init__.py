@@ -1,18 +1,19 @@
 from kmua.config import settings
 from kmua.logger import logger
 
-meili_client = None
+from .client import AsyncMeiliClient, MeiliError
+
+meili_client: AsyncMeiliClient | None = None
 meili_api = settings.get("meilisearch_api")
 meili_key = settings.get("meilisearch_key")
 if meili_api and meili_key:
     logger.debug("initing meilisearch client...")
-    import meilisearch
-
     try:
-        meili_client = meilisearch.Client(
+        meili_client = AsyncMeiliClient(
             meili_api,
             meili_key,
-            client_agents=("kmua",),
+            timeout=settings.get("meilisearch_timeout", 10),
+            max_connections=settings.get("meilisearch_max_connections", 20),
         )
         logger.debug(f"meilisearch client: {meili_client.health()}")
     except Exception as e:
@@ -0,0 +1,127 @@
+from typing import Any
+
+import httpx
+
+
+class MeiliError(Exception):
+    """
+    meilisearch 返回了错误的状态码
+    """
+
+    def __init__(self, status_code: int, message: str, code: str | None = None):
+        super().__init__(f"{status_code} {code or ''}: {message}")
+        self.status_code = status_code
+        self.code = code
+
+
+class AsyncMeiliClient:
+    """
+    基于 httpx.AsyncClient 的 meilisearch 客户端, 只实现了用到的接口
+
+    写入类的接口返回 meilisearch 的任务信息, 不等待任务完成
+    """
+
+    def __init__(
+        self,
+        url: str,
+        api_key: str,
+        timeout: float = 10,
+        max_connections: int = 20,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        if "://" not in url:
+            url = f"http://{url}"
+        self.url = url.rstrip("/")
+        self._headers = {
+            "Authorization": f"Bearer {api_key}",
+            "User-Agent": "kmua",
+        }
+        self._timeout = httpx.Timeout(timeout)
+        self._limits = httpx.Limits(max_connections=max_connections)
+        self._transport = transport
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # 在第一次使用时创建, 使连接池属于 bot 的事件循环
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.url,
+                headers=self._headers,
+                timeout=self._timeout,
+                limits=self._limits,
+                transport=self._transport,
+            )
+        return self._client
+
+    async def _request(self, method: str, path: str, **kwargs) -> Any:
+        response = await self.client.request(method, path, **kwargs)
+        if response.is_error:
+            try:
+                error = response.json()
+            except ValueError:
+                error = {}
+            raise MeiliError(
+                response.status_code,
+                error.get("message", response.text),
+                error.get("code"),
+            )
+        if not response.content:
+            return None
+        return response.json()
+
+    def health(self) -> dict:
+        """
+        同步检查 meilisearch 是否可用, 在启动时调用
+        """
+        response = httpx.get(f"{self.url}/health", timeout=self._timeout)
+        response.raise_for_status()
+        return response.json()
+
+    async def search(self, index: str, query: str, params: dict | None = None) -> dict:
+        return await self._request(
+            "POST", f"/indexes/{index}/search", json={"q": query, **(params or {})}
+        )
+
+    async def add_documents(
+        self, index: str, documents: list[dict], primary_key: str | None = None
+    ) -> dict:
+        return await self._request(
+            "POST",
+            f"/indexes/{index}/documents",
+            params={"primaryKey": primary_key} if primary_key else None,
+            json=documents,
+        )
+
+    async def create_index(self, index: str, primary_key: str | None = None) -> dict:
+        return await self._request(
+            "POST", "/indexes", json={"uid": index, "primaryKey": primary_key}
+        )
+
+    async def update_searchable_attributes(
+        self, index: str, attributes: list[str]
+    ) -> dict:
+        return await self._request(
+            "PUT", f"/indexes/{index}/settings/searchable-attributes", json=attributes
+        )
+
+    async def update_filterable_attributes(
+        self, index: str, attributes: list[str]
+    ) -> dict:
+        return await self._request(
+            "PUT", f"/indexes/{index}/settings/filterable-attributes", json=attributes
+        )
+
+    async def get_stats(self, index: str) -> dict:
+        return await self._request("GET", f"/indexes/{index}/stats")
+
+    async def get_all_stats(self) -> dict:
+        return await self._request("GET", "/stats")
+
+    async def delete_index(self, index: str) -> dict:
+        return await self._request("DELETE", f"/indexes/{index}")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
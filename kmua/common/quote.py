@@ -1,10 +1,9 @@
-import io
+import hashlib
+import threading
 from datetime import datetime
-from pathlib import Path
 from uuid import uuid4
 
-from PIL import Image, ImageFont
-from pilmoji import Pilmoji
+import cachetools
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
@@ -14,7 +13,22 @@ from telegram import (
 )
 
 from kmua import dao
+from kmua.config import settings
+from kmua.logger import logger
 from kmua.models.models import Quote
+from kmua.render.pool import render_quote_img_async
+
+from .redis import redis_client
+
+# random_quote 的处理统计, 未命中概率直接返回的消息中,
+# skipped 为群组设置已缓存 (没有任何 IO) 的消息数, skipped_after_lookup 为需要查询数据库的消息数
+random_quote_stats = {
+    "messages": 0,
+    "skipped": 0,
+    "skipped_after_lookup": 0,
+    "triggered": 0,
+    "forwarded": 0,
+}
 
 qer_quote_manage_button = [
     InlineKeyboardButton(
@@ -131,58 +145,60 @@ Create at {datetime.strftime(quote.created_at, "%Y-%m-%d %H:%M:%S")} by {qer_use
 
 
 async def generate_quote_img(avatar: bytes, text: str, name: str) -> bytes:
-    text = text.replace("\n", " ")
-    script_dir = Path(__file__).resolve().parent
-    font_path = str(script_dir.parent / "resource" / "TsukuA.ttc")
-    base_img_path = str(script_dir.parent / "resource" / "quote_base.png")
-
-    img_width, img_height = 1200, 640
-    font_size = 42
-    name_font_size = 24
-
-    font = ImageFont.truetype(font_path, font_size)
-    name_font = ImageFont.truetype(font_path, name_font_size)
-    base_img = Image.open(base_img_path)
-    avatar_img = Image.open(io.BytesIO(avatar))
-
-    img = Image.new("RGBA", (img_width, img_height), (255, 255, 255, 0))
-    img.paste(avatar_img, (0, 0))
-    img.paste(base_img, (0, 0), base_img)
-
-    text_list = [text[i : i + 18] for i in range(0, len(text), 18)]
-    new_text_height = font_size * len(text_list)
-    new_text_width = max(font.getbbox(x)[2] - font.getbbox(x)[0] for x in text_list)
-    text_x = 540 + int((560 - new_text_width) / 2)
-    text_y = int((img_height - new_text_height) / 2)
-
-    with Pilmoji(img) as pilmoji:
-        for i, v in enumerate(text_list):
-            pilmoji.text(
-                (text_x, text_y + i * font_size),
-                text=v,
-                fill=(255, 255, 252),
-                font=font,
-                align="center",
-                emoji_position_offset=(0, 12),
-            )
+    return await render_quote_img_async(avatar, text, name)
 
-    left, top, right, bottom = name_font.getbbox(name)
-    name_width = right - left
-    name_height = bottom - top
-    name_x = 600 + int((560 - name_width) / 2)
-    name_y = img_height - name_height - 20
-
-    with Pilmoji(img) as pilmoji:
-        pilmoji.text(
-            (name_x, name_y),
-            text=f"{name}",
-            font=name_font,
-            fill=(255, 255, 252),
-            align="center",
-        )
-
-    img_byte_arr = io.BytesIO()
-    img = img.convert("RGB")
-    img.save(img_byte_arr, format="png")
-    img_byte_arr.seek(0)
-    return img_byte_arr.getvalue()
+
+# 语录图片缓存: (头像, 文本, 名称) -> 已发送图片的 file_id
+# 配置了 redis 时使用 redis, 否则使用进程内的 LRU
+_quote_img_cache_lock = threading.Lock()
+_quote_img_cache: cachetools.LRUCache[str, str] = cachetools.LRUCache(
+    maxsize=settings.get("quote_img_cache_size", 4096)
+)
+quote_img_cache_stats = {"hits": 0, "misses": 0}
+
+
+def get_quote_img_cache_key(avatar: bytes, text: str, name: str) -> str:
+    key = hashlib.sha256(hashlib.sha256(avatar).digest())
+    key.update(text.encode("utf-8"))
+    key.update(b"\0")
+    key.update(name.encode("utf-8"))
+    return key.hexdigest()
+
+
+def get_cached_quote_img(key: str) -> str | None:
+    file_id = None
+    if redis_client:
+        try:
+            if cached := redis_client.get(f"kmua_quoteimg_{key}"):
+                file_id = cached.decode("utf-8")
+        except Exception as err:
+            logger.warning(f"{err.__class__.__name__}: {err}")
+    else:
+        with _quote_img_cache_lock:
+            file_id = _quote_img_cache.get(key)
+    quote_img_cache_stats["hits" if file_id else "misses"] += 1
+    return file_id
+
+
+def set_cached_quote_img(key: str, file_id: str | None):
+    """
+    file_id 为 None 时删除缓存
+    """
+    if redis_client:
+        try:
+            if file_id is None:
+                redis_client.delete(f"kmua_quoteimg_{key}")
+            else:
+                redis_client.set(
+                    f"kmua_quoteimg_{key}",
+                    file_id,
+                    ex=settings.get("quote_img_cache_ttl", 2592000),
+                )
+        except Exception as err:
+            logger.warning(f"{err.__class__.__name__}: {err}")
+        return
+    with _quote_img_cache_lock:
+        if file_id is None:
+            _quote_img_cache.pop(key, None)
+        else:
+            _quote_img_cache[key] = file_id
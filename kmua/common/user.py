@@ -1,3 +1,4 @@
+import cachetools
 from telegram import (
     Chat,
     Update,
@@ -12,7 +13,83 @@ from kmua.config import settings
 from kmua.logger import logger
 from kmua.models.models import ChatData, UserData
 
+from .avatar import get_avatar_hash_by_unique_id, load_avatar, save_avatar
+
 fake_users_id = [ChatID.FAKE_CHANNEL, ChatID.ANONYMOUS_ADMIN, ChatID.SERVICE_CHAT]
+# 已查询过旧版本头像的 (user_id, big), 旧版本的头像只会被迁移一次, 无需再次查询
+_legacy_avatar_checked: cachetools.LRUCache[tuple[int, bool], bool] = (
+    cachetools.LRUCache(maxsize=100000)
+)
+
+
+def get_user_avatar(db_user: UserData, big: bool) -> bytes | None:
+    """
+    从头像存储中读取用户头像, 旧版本保存在 user_data 表中的头像会在此时迁移
+
+    :param big: True 为大尺寸头像, False 为小尺寸头像
+    """
+    digest = db_user.avatar_big_hash if big else db_user.avatar_small_hash
+    if avatar := load_avatar(digest):
+        return avatar
+    return migrate_users_legacy_avatar([db_user], big).get(db_user.id)
+
+
+def get_users_small_avatar(db_users: list[UserData]) -> dict[int, bytes]:
+    """
+    批量读取用户的小尺寸头像, 没有头像的用户不会出现在返回值中
+    """
+    avatars = {}
+    missing = []
+    for db_user in db_users:
+        if avatar := load_avatar(db_user.avatar_small_hash):
+            avatars[db_user.id] = avatar
+        else:
+            missing.append(db_user)
+    avatars.update(migrate_users_legacy_avatar(missing, big=False))
+    return avatars
+
+
+def migrate_users_legacy_avatar(
+    db_users: list[UserData], big: bool
+) -> dict[int, bytes]:
+    user_ids = [
+        db_user.id
+        for db_user in db_users
+        if (db_user.id, big) not in _legacy_avatar_checked
+    ]
+    legacy_avatars = dao.get_users_legacy_avatar(user_ids, big)
+    if legacy_avatars:
+        # 先保存头像文件, 成功后才从表中清除旧版本的头像
+        dao.set_users_legacy_avatar_migrated(
+            {
+                user_id: save_avatar(avatar)
+                for user_id, avatar in legacy_avatars.items()
+            },
+            big,
+        )
+        logger.debug(f"Migrated {len(legacy_avatars)} legacy avatars")
+    for user_id in user_ids:
+        _legacy_avatar_checked[(user_id, big)] = True
+    return legacy_avatars
+
+
+def _set_user_avatar_hash(db_user: UserData, digest: str | None, big: bool):
+    if big:
+        db_user.avatar_big_hash = digest
+    else:
+        db_user.avatar_small_hash = digest
+
+
+async def update_user_avatar(
+    db_user: UserData, context: ContextTypes.DEFAULT_TYPE, big: bool
+) -> bytes | None:
+    """
+    下载用户头像并更新头像 hash, 下载失败时清除 hash, 需要调用者 commit
+    """
+    downloaded = await _download_avatar(db_user.id, context, big)
+    avatar, digest = downloaded or (None, None)
+    _set_user_avatar_hash(db_user, digest, big)
+    return avatar
 
 
 async def get_big_avatar_bytes(
@@ -21,13 +98,14 @@ async def get_big_avatar_bytes(
     logger.debug(f"Get big avatar for {chat_id}")
     db_user = dao.get_user_by_id(chat_id)
     if db_user:
-        if db_user.avatar_big_blob:
-            return db_user.avatar_big_blob
-        avatar = await download_big_avatar(chat_id, context)
-        if avatar:
-            db_user.avatar_big_blob = avatar
+        if avatar := get_user_avatar(db_user, big=True):
+            return avatar
+        if downloaded := await _download_avatar(chat_id, context, big=True):
+            avatar, digest = downloaded
+            _set_user_avatar_hash(db_user, digest, big=True)
             dao.commit()
-        return avatar
+            return avatar
+        return None
     return await download_big_avatar(chat_id, context)
 
 
@@ -35,17 +113,8 @@ async def download_big_avatar(
     chat_id: int, context: ContextTypes.DEFAULT_TYPE
 ) -> bytes | None:
     logger.debug(f"Downloading big avatar for {chat_id}")
-    try:
-        avatar_photo = (await context.bot.get_chat(chat_id=chat_id)).photo
-        if not avatar_photo:
-            return None
-        avatar = await (await avatar_photo.get_big_file()).download_as_bytearray()
-        avatar = bytes(avatar)
-        logger.success(f"Success downloaded big avatar for {chat_id}")
-        return avatar
-    except Exception as err:
-        logger.warning(f"Failed download: {err.__class__.__name__}: {err}")
-        return None
+    downloaded = await _download_avatar(chat_id, context, big=True)
+    return downloaded[0] if downloaded else None
 
 
 async def get_small_avatar_bytes(
@@ -54,13 +123,14 @@ async def get_small_avatar_bytes(
     logger.debug(f"Get small avatar for {chat_id}")
     db_user = dao.get_user_by_id(chat_id)
     if db_user:
-        if db_user.avatar_small_blob:
-            return db_user.avatar_small_blob
-        avatar = await download_small_avatar(chat_id, context)
-        if avatar:
-            db_user.avatar_small_blob = avatar
+        if avatar := get_user_avatar(db_user, big=False):
+            return avatar
+        if downloaded := await _download_avatar(chat_id, context, big=False):
+            avatar, digest = downloaded
+            _set_user_avatar_hash(db_user, digest, big=False)
             dao.commit()
-        return avatar
+            return avatar
+        return None
     return await download_small_avatar(chat_id, context)
 
 
@@ -68,14 +138,41 @@ async def download_small_avatar(
     chat_id: int, context: ContextTypes.DEFAULT_TYPE
 ) -> bytes | None:
     logger.debug(f"Downloading small avatar for {chat_id}")
+    downloaded = await _download_avatar(chat_id, context, big=False)
+    return downloaded[0] if downloaded else None
+
+
+async def _download_avatar(
+    chat_id: int, context: ContextTypes.DEFAULT_TYPE, big: bool
+) -> tuple[bytes, str] | None:
+    """
+    下载并保存头像
+
+    :return: (头像, 头像的 sha256)
+    """
     try:
         avatar_photo = (await context.bot.get_chat(chat_id=chat_id)).photo
         if not avatar_photo:
             return None
-        avatar = await (await avatar_photo.get_small_file()).download_as_bytearray()
-        avatar = bytes(avatar)
-        logger.success(f"Success downloaded small avatar for {chat_id}")
-        return avatar
+        if big:
+            file_unique_id = avatar_photo.big_file_unique_id
+        else:
+            file_unique_id = avatar_photo.small_file_unique_id
+        # 头像未变化时直接使用已保存的文件
+        digest = get_avatar_hash_by_unique_id(file_unique_id)
+        if avatar := load_avatar(digest):
+            logger.debug(f"Avatar of {chat_id} is not changed, skip downloading")
+            return avatar, digest
+        if big:
+            avatar_file = await avatar_photo.get_big_file()
+        else:
+            avatar_file = await avatar_photo.get_small_file()
+        avatar = bytes(await avatar_file.download_as_bytearray())
+        digest = save_avatar(avatar, file_unique_id)
+        logger.success(
+            f"Success downloaded {'big' if big else 'small'} avatar for {chat_id}"
+        )
+        return avatar, digest
     except Exception as err:
         logger.warning(f"Failed download: {err.__class__.__name__}: {err}")
         return None
@@ -1,29 +1,52 @@
-import os
-import shutil
-import tempfile
-from math import ceil, sqrt
-from typing import Any, Generator
+from typing import Any, Iterable
 
-import graphviz
+import cachetools
 from telegram import Chat, InlineKeyboardButton, InlineKeyboardMarkup, User
 from telegram.helpers import escape_markdown
 
 from kmua import dao
+from kmua.config import settings
 from kmua.logger import logger
 from kmua.models.models import ChatData, UserData
+from kmua.render.pool import render_waifu_graph_async
 
 from .user import mention_markdown_v2
 
-
-def get_chat_waifu_relationships(
-    chat: Chat | ChatData,
-) -> Generator[tuple[int, int], None, None]:
-    logger.debug(f"Get chat waifu relationships for {chat.title}<{chat.id}>")
-    members, _ = dao.get_chat_user_participated_waifu_data(chat)
-    for member in members:
-        waifu = dao.get_user_waifu_in_chat_exclude_married(member, chat)
-        if waifu:
-            yield (member.id, waifu.id)
+# chat_id -> (老婆关系版本, 关系图的 file_id, 参与人数)
+_waifu_graph_cache: cachetools.LRUCache[int, tuple[tuple[int, int], str, int]] = (
+    cachetools.LRUCache(maxsize=settings.get("waifu_graph_cache_size", 1024))
+)
+waifu_graph_cache_stats = {"hits": 0, "misses": 0}
+
+
+def get_cached_waifu_graph(
+    chat_id: int, version: tuple[int, int]
+) -> tuple[str, int] | None:
+    """
+    获取已发送过的关系图, 老婆关系在此之后有变化时返回 None
+
+    :return: (file_id, 参与人数)
+    """
+    cached = _waifu_graph_cache.get(chat_id)
+    if cached is None or cached[0] != version:
+        waifu_graph_cache_stats["misses"] += 1
+        return None
+    waifu_graph_cache_stats["hits"] += 1
+    return cached[1], cached[2]
+
+
+def set_cached_waifu_graph(
+    chat_id: int, version: tuple[int, int], file_id: str | None, user_count: int = 0
+):
+    """
+    version 应为渲染前获取的版本, 渲染期间老婆关系有变化时缓存会自然失效
+
+    file_id 为 None 时删除缓存
+    """
+    if file_id is None:
+        _waifu_graph_cache.pop(chat_id, None)
+    else:
+        _waifu_graph_cache[chat_id] = (version, file_id, user_count)
 
 
 def get_chat_waifu_info_dict(
@@ -31,10 +54,7 @@ def get_chat_waifu_info_dict(
 ) -> dict[int, int]:
     # waifu_info_dict: a dict that maps user_id to waifu_id
     logger.debug(f"Get chat waifu info dict for {chat.title}<{chat.id}>")
-    waifu_info_dict = {}
-    for user_id, waifu_id in get_chat_waifu_relationships(chat):
-        waifu_info_dict[user_id] = waifu_id
-    return waifu_info_dict
+    return dict(dao.get_chat_waifu_edges(chat))
 
 
 def get_user_waifu_info(user: User | UserData) -> str:
@@ -123,72 +143,11 @@ def get_waifu_text(
 
 
 async def render_waifu_graph(
-    relationships: Generator[tuple[int, int], None, None],
-    user_info: Generator[dict[str, Any], None, None],
+    relationships: Iterable[tuple[int, int]],
+    user_info: Iterable[dict[str, Any]],
     length: int = 0,
 ) -> bytes:
-    dpi = max(150, ceil(5 * sqrt(length / 3)) * 20)
-    dot = graphviz.Digraph(
-        graph_attr={
-            "dpi": str(dpi),
-            "beautify": "true",
-            "compound": "true",
-            "ranksep": "1",
-            "splines": "ortho",
-        },
-        format="webp",
-    )
-
-    tempdir = tempfile.mkdtemp()
-
-    try:
-        # Create nodes
-        has_avatar = set()
-        for user in user_info:
-            user_id = user["id"]
-            username = user.get("username")
-            username = (
-                username[:6] + "..." if username and len(username) > 6 else username
-            )
-            if not user.get("avatar"):
-                dot.node(str(user_id), label=username)
-                continue
-            has_avatar.add(user_id)
-            avatar = user["avatar"]
-            avatar_path = os.path.join(tempdir, f"{user_id}_avatar.png")
-            with open(avatar_path, "wb") as avatar_file:
-                avatar_file.write(avatar)
-
-            with dot.subgraph(name=f"cluster_{user_id}") as subgraph:
-                # Set the attributes for the subgraph
-                subgraph.attr(label=username)
-                subgraph.attr(rank="same")  # Ensure nodes are on the same rank
-                subgraph.attr(labelloc="b")  # Label position at the bottom
-                subgraph.attr(style="filled")
-
-                # Create a node within the subgraph
-                subgraph.node(
-                    str(user_id),
-                    label="",
-                    shape="none",
-                    image=avatar_path,
-                    imagescale="true",
-                )
-
-        # Create edges
-        for user_id, waifu_id in relationships:
-            dot.edge(
-                str(user_id),
-                str(waifu_id),
-                lhead=f"cluster_{waifu_id}" if waifu_id in has_avatar else "",
-                ltail=f"cluster_{user_id}" if user_id in has_avatar else "",
-            )
-
-        return dot.pipe()
-
-    finally:
-        if os.path.exists(tempdir):
-            shutil.rmtree(tempdir)
+    return await render_waifu_graph_async(list(relationships), list(user_info), length)
 
 
 def get_waifu_markup(
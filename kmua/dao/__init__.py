@@ -1,3 +1,4 @@
+from . import aio  # noqa: F401
 from .association import *  # noqa: F403
 from .chat import *  # noqa: F403
 from .chat_service import *  # noqa: F403
@@ -6,3 +7,4 @@ from .quote import *  # noqa: F403
 from .user import *  # noqa: F403
 from .user_service import *  # noqa: F403
 from .waifu import *  # noqa: F403
+from .write_buffer import *  # noqa: F403
@@ -10,11 +10,16 @@ from kmua.config import data_dir, settings
 from kmua.logger import logger
 from kmua.models.models import Base
 
+db_url = settings.get("db_url", "sqlite:///./data/kmua.db")
+data_dir.mkdir(exist_ok=True)
+
 try:
     logger.debug("migrating database...")
     _alembic_config = alembic.config.Config(
         pathlib.Path(__file__).resolve().parent.parent.parent / "alembic.ini"
     )
+    # 迁移 db_url 指向的数据库, 而不是 alembic.ini 中的默认地址
+    _alembic_config.set_main_option("sqlalchemy.url", db_url.replace("%", "%%"))
     alembic.command.upgrade(_alembic_config, "head")
 except Exception as err:
     logger.warning(f"migrate database failed: {err}")
@@ -22,11 +27,10 @@ except Exception as err:
         "if you are running the bot for the first time, or your database does not need to be migrated, ignore this warning"
     )
 
-engine = create_engine(settings.get("db_url", "sqlite:///./data/kmua.db"))
+engine = create_engine(db_url)
 _session = scoped_session(sessionmaker(autoflush=False, bind=engine))
-_db = _session()
-
-data_dir.mkdir(exist_ok=True)
+# 每个线程使用独立的 session, 事件循环所在的线程始终使用同一个
+_db = _session
 
 logger.info("Connecting to database...")
 
@@ -44,4 +48,4 @@ def commit():
 
 
 def close():
-    _db.close()
+    _session.remove()
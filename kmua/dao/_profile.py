@@ -0,0 +1,43 @@
+from enum import Enum
+
+from sqlalchemy.orm import load_only, undefer
+
+from kmua.models.models import ChatData, UserData
+
+
+class LoadProfile(Enum):
+    """
+    查询 UserData / ChatData 时加载的列
+
+    IDENTITY: 只加载 id 和名称等标识字段
+    DISPLAY: 加载除旧版头像以外的所有列, 默认
+    FULL: 加载所有列
+
+    未加载的列在访问时会再次查询, 只影响性能, 不影响正确性
+    """
+
+    IDENTITY = "identity"
+    DISPLAY = "display"
+    FULL = "full"
+
+
+def user_load_options(profile: LoadProfile) -> list:
+    if profile == LoadProfile.IDENTITY:
+        return [
+            load_only(
+                UserData.id,
+                UserData.username,
+                UserData.full_name,
+                UserData.is_bot,
+                UserData.is_real_user,
+            )
+        ]
+    if profile == LoadProfile.FULL:
+        return [undefer(UserData.avatar_small_blob), undefer(UserData.avatar_big_blob)]
+    return []
+
+
+def chat_load_options(profile: LoadProfile) -> list:
+    if profile == LoadProfile.IDENTITY:
+        return [load_only(ChatData.id, ChatData.title, ChatData.username)]
+    return []
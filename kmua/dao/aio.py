@@ -0,0 +1,132 @@
+"""
+在独立的数据库线程中执行 dao 函数, 避免慢查询阻塞事件循环
+
+用法与同步版本相同, 只需 await:
+
+    count = await dao.aio.clear_inactived_users_avatar(days)
+
+每次调用都在数据库线程中使用新的 session, 返回前会加载已过期的列并关闭 session.
+返回的 ORM 对象与 session 分离, 不要再访问未加载的关系属性;
+生成器会被展开为 list. 参数请传递 telegram 对象或 id, 不要传递主线程 session 中的 ORM 对象.
+
+只有只读的慢查询 (统计, 分页计数, 批量查询名称) 使用数据库线程, 以下调用保持同步:
+
+- 写入 (add_user, add_chat, 写缓冲, 配置更新等): sqlite 同一时间只允许一个连接写入,
+  在两个连接中写入会互相等待, 超时后报错 "database is locked"
+- 返回的 ORM 对象之后还会被修改或访问关系属性的查询 (get_user_by_id,
+  get_chat_waifu_graph_data, 语录分页和搜索等): 这些对象需要属于主线程的 session
+- 已缓存的查询 (chat 配置, 随机语录索引等): 命中缓存时没有 I/O
+
+写入数据库的管理操作 (清理头像缓存及其中的 VACUUM, 修复语录) 在 sqlite 中通过 run_exclusive
+在没有其他数据库操作时执行, 其他数据库中在数据库线程执行
+"""
+
+import asyncio
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import sqlalchemy
+
+import kmua.dao as dao
+from kmua.config import settings
+from kmua.models.models import Base
+
+from ._db import _db, _session, engine
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.get("db_executor_workers", 1),
+    thread_name_prefix="kmua-db",
+)
+_queue_size = settings.get("db_executor_queue_size", 256)
+_slots: asyncio.Semaphore | None = None
+# run_exclusive 持有期间, 新的调用需要等待
+_exclusive = asyncio.Lock()
+# 数据库线程中没有正在执行的调用
+_idle = asyncio.Event()
+_idle.set()
+_running = 0
+# 写入数据库的管理操作, sqlite 中使用 run_exclusive, 避免主线程的写入失败
+_SQLITE_EXCLUSIVE = {"clear_inactived_users_avatar", "fix_none_chat_id_quotes"}
+
+
+def _load(obj: Any):
+    if isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            _load(item)
+        return
+    if not isinstance(obj, Base):
+        return
+    state = sqlalchemy.inspect(obj)
+    if state.session is not None and state.expired_attributes:
+        state.session.refresh(obj, attribute_names=list(state.expired_attributes))
+
+
+def _call(fn: Callable, args: tuple, kwargs: dict) -> Any:
+    try:
+        result = fn(*args, **kwargs)
+        if inspect.isgenerator(result):
+            result = list(result)
+        _load(result)
+        return result
+    except Exception:
+        _db.rollback()
+        raise
+    finally:
+        _session.remove()
+
+
+async def run(fn: Callable, *args, **kwargs) -> Any:
+    """
+    在数据库线程中执行 fn
+
+    排队的调用数量超过 db_executor_queue_size 时, 调用方会等待
+    """
+    global _slots, _running
+    if _slots is None:
+        _slots = asyncio.Semaphore(_queue_size)
+    async with _slots:
+        if _exclusive.locked():
+            async with _exclusive:
+                pass
+        _running += 1
+        _idle.clear()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                _executor, _call, fn, args, kwargs
+            )
+        finally:
+            _running -= 1
+            if not _running:
+                _idle.set()
+
+
+async def run_exclusive(fn: Callable, *args, **kwargs) -> Any:
+    """
+    等待数据库线程中的调用全部结束后, 在事件循环线程中执行 fn,
+    执行期间事件循环被阻塞, 主线程 session 和数据库线程都不会有其他读写
+    """
+    async with _exclusive:
+        await _idle.wait()
+        return fn(*args, **kwargs)
+
+
+def shutdown():
+    _executor.shutdown(wait=True)
+
+
+def __getattr__(name: str):
+    fn = getattr(dao, name, None)
+    if fn is None or not callable(fn) or inspect.iscoroutinefunction(fn):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    runner = run
+    if name in _SQLITE_EXCLUSIVE and engine.dialect.name == "sqlite":
+        runner = run_exclusive
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await runner(fn, *args, **kwargs)
+
+    return wrapper
@@ -1,8 +1,47 @@
+import threading
+
+import cachetools
 from telegram import Chat, User
 
+import kmua.dao.waifu as waifu_dao
+import kmua.dao.write_buffer as write_buffer_dao
+from kmua.config import settings
 from kmua.dao._db import _db, commit
 from kmua.models.models import ChatData, UserChatAssociation, UserData
 
+_user_chat_ids_lock = threading.RLock()
+_user_chat_ids: cachetools.LRUCache[int, frozenset[int]] = cachetools.LRUCache(
+    maxsize=settings.get("user_chats_cache_size", 4096)
+)
+
+
+def get_user_chat_ids(user: User | UserData | Chat | ChatData) -> frozenset[int]:
+    """
+    获取用户所在的所有群组 id, 结果会被缓存
+    """
+    with _user_chat_ids_lock:
+        chat_ids = _user_chat_ids.get(user.id)
+        if chat_ids is None:
+            rows = (
+                _db.query(UserChatAssociation.chat_id)
+                .filter(UserChatAssociation.user_id == user.id)
+                .all()
+            )
+            chat_ids = frozenset(chat_id for (chat_id,) in rows)
+            _user_chat_ids[user.id] = chat_ids
+        return chat_ids
+
+
+def invalidate_user_chat_ids(user_id: int | None = None):
+    """
+    清除用户所在群组的缓存, user_id 为 None 时清除所有
+    """
+    with _user_chat_ids_lock:
+        if user_id is None:
+            _user_chat_ids.clear()
+        else:
+            _user_chat_ids.pop(user_id, None)
+
 
 def get_association_in_chat_by_user(
     chat: Chat | ChatData, user: User | UserData | Chat | ChatData
@@ -39,6 +78,7 @@ def add_association_in_chat(
         )
     )
     commit()
+    invalidate_user_chat_ids(user.id)
     return get_association_in_chat_by_user(chat, user)
 
 
@@ -51,9 +91,12 @@ def delete_association_in_chat(
     :param user: User or UserData object
     :param chat: Chat or ChatData object
     """
+    write_buffer_dao.forget_buffered_association(chat.id, user.id)
     if association := get_association_in_chat_by_user(chat, user):
         _db.delete(association)
         commit()
+        waifu_dao.bump_chat_waifu_version(chat.id)
+    invalidate_user_chat_ids(user.id)
 
 
 def get_associations_of_user(user: User | UserData) -> list[UserChatAssociation]:
@@ -1,14 +1,25 @@
+import copy
 import json
-import random
+import threading
 from typing import Any, Generator
 
+import cachetools
 import sqlalchemy
 from sqlalchemy import func
 from sqlalchemy.sql import update
 from telegram import Chat
 
+import kmua.dao.quote as quote_dao
+from kmua.config import settings
 from kmua.dao._db import _db, commit
-from kmua.models.models import ChatConfig, ChatData, Quote, UserData
+from kmua.dao._profile import LoadProfile, chat_load_options, user_load_options
+from kmua.models.models import (
+    ChatConfig,
+    ChatData,
+    Quote,
+    UserChatAssociation,
+    UserData,
+)
 
 
 def _get_stmt(chat_id: int, key: str, value: Any) -> sqlalchemy.sql.Update:
@@ -25,8 +36,46 @@ def _get_stmt(chat_id: int, key: str, value: Any) -> sqlalchemy.sql.Update:
     )
 
 
-def get_chat_by_id(chat_id: int) -> ChatData | None:
-    return _db.query(ChatData).filter(ChatData.id == chat_id).first()
+_chat_config_lock = threading.RLock()
+
+
+@cachetools.cached(
+    cachetools.LRUCache(maxsize=settings.get("chat_config_cache_size", 4096)),
+    key=lambda chat: chat.id,
+    lock=_chat_config_lock,
+    info=True,
+)
+def _get_chat_config_dict(chat: Chat | ChatData) -> dict:
+    """
+    获取 chat 的原始 config, 结果会被缓存, 修改 config 后需调用 invalidate_chat_config
+    """
+    _db_chat = add_chat(chat)
+    return dict(_db_chat.config or {})
+
+
+def invalidate_chat_config(chat_id: int):
+    with _chat_config_lock:
+        _get_chat_config_dict.cache.pop(chat_id, None)
+
+
+def get_chat_config_cache_info() -> cachetools._CacheInfo:
+    return _get_chat_config_dict.cache_info()
+
+
+def is_chat_config_cached(chat_id: int) -> bool:
+    with _chat_config_lock:
+        return chat_id in _get_chat_config_dict.cache
+
+
+def get_chat_by_id(
+    chat_id: int, profile: LoadProfile = LoadProfile.DISPLAY
+) -> ChatData | None:
+    return (
+        _db.query(ChatData)
+        .options(*chat_load_options(profile))
+        .filter(ChatData.id == chat_id)
+        .first()
+    )
 
 
 def add_chat(chat: Chat | ChatData) -> ChatData:
@@ -52,44 +101,54 @@ def add_chat(chat: Chat | ChatData) -> ChatData:
     return get_chat_by_id(chat.id)
 
 
-def get_chat_members(chat: Chat | ChatData) -> list[UserData]:
-    _db_chat = get_chat_by_id(chat.id)
-    if _db_chat is None:
+def _query_chat_members(chat: Chat | ChatData, profile: LoadProfile):
+    return (
+        _db.query(UserData)
+        .options(*user_load_options(profile))
+        .join(UserChatAssociation, UserChatAssociation.user_id == UserData.id)
+        .filter(UserChatAssociation.chat_id == chat.id)
+    )
+
+
+def get_chat_members(
+    chat: Chat | ChatData, profile: LoadProfile = LoadProfile.DISPLAY
+) -> list[UserData]:
+    if get_chat_by_id(chat.id, LoadProfile.IDENTITY) is None:
         add_chat(chat)
         return []
-    return _db_chat.members
+    return _query_chat_members(chat, profile).all()
 
 
 def get_chat_members_id(chat: Chat | ChatData) -> Generator[int, None, None]:
-    members = get_chat_members(chat)
-    return (member.id for member in members)
+    user_ids = (
+        _db.query(UserChatAssociation.user_id)
+        .filter(UserChatAssociation.chat_id == chat.id)
+        .all()
+    )
+    return (user_id for (user_id,) in user_ids)
+
+
+def get_chat_members_count(chat: Chat | ChatData) -> int:
+    return (
+        _db.query(func.count(UserChatAssociation.user_id))
+        .filter(UserChatAssociation.chat_id == chat.id)
+        .scalar()
+    )
 
 
 def get_chat_quote_probability(chat: Chat | ChatData) -> float:
-    _db_chat = get_chat_by_id(chat.id)
-    if _db_chat is None:
-        add_chat(chat)
-        return 0.001
-    return _db_chat.config.get("quote_probability", 0.001)
+    return _get_chat_config_dict(chat).get("quote_probability", 0.001)
 
 
 def update_chat_quote_probability(chat: Chat | ChatData, probability: float):
-    _db_chat = get_chat_by_id(chat.id)
-    if _db_chat is None:
-        add_chat(chat)
-        _db_chat = get_chat_by_id(chat.id)
+    add_chat(chat)
     _db.execute(_get_stmt(chat.id, "$.quote_probability", probability))
     commit()
+    invalidate_chat_config(chat.id)
 
 
 def get_chat_random_quote(chat: Chat | ChatData) -> Quote | None:
-    count = _db.query(Quote).filter(Quote.chat_id == chat.id).count()
-    if count == 0:
-        return None
-    random_offset = random.randint(0, count - 1)
-    return (
-        _db.query(Quote).filter(Quote.chat_id == chat.id).offset(random_offset).first()
-    )
+    return quote_dao.get_chat_random_quote_by_index(chat.id)
 
 
 def get_chat_quotes_count(chat: Chat | ChatData) -> int:
@@ -109,22 +168,28 @@ def get_chat_quotes_page(
 
 
 def get_chat_users_without_bots(
-    chat: Chat | ChatData,
+    chat: Chat | ChatData, profile: LoadProfile = LoadProfile.DISPLAY
 ) -> Generator[UserData, None, None]:
-    _db_chat = add_chat(chat)
-    return (user for user in _db_chat.members if not user.is_bot)
+    users = _query_chat_members(chat, profile).filter(UserData.is_bot.is_(False)).all()
+    return (user for user in users)
 
 
 def get_chat_users_without_bots_id(chat: Chat | ChatData) -> Generator[int, None, None]:
-    return (user.id for user in get_chat_users_without_bots(chat))
+    user_ids = (
+        _db.query(UserChatAssociation.user_id)
+        .join(UserData, UserChatAssociation.user_id == UserData.id)
+        .filter(UserChatAssociation.chat_id == chat.id, UserData.is_bot.is_(False))
+        .all()
+    )
+    return (user_id for (user_id,) in user_ids)
 
 
-def get_all_chats() -> list[ChatData]:
-    return _db.query(ChatData).all()
+def get_all_chats(profile: LoadProfile = LoadProfile.DISPLAY) -> list[ChatData]:
+    return _db.query(ChatData).options(*chat_load_options(profile)).all()
 
 
 def get_all_chats_id() -> Generator[int, None, None]:
-    return (chat.id for chat in get_all_chats())
+    return (chat_id for (chat_id,) in _db.query(ChatData.id).all())
 
 
 def delete_chat(chat: Chat | ChatData):
@@ -133,6 +198,7 @@ def delete_chat(chat: Chat | ChatData):
         return
     _db.delete(_db_chat)
     commit()
+    invalidate_chat_config(chat.id)
 
 
 def get_all_chats_count() -> int:
@@ -140,47 +206,49 @@ def get_all_chats_count() -> int:
 
 
 def get_chat_waifu_disabled(chat: Chat | ChatData) -> bool:
-    _db_chat = add_chat(chat)
-    return not _db_chat.config.get("waifu_enabled", False)
+    return not _get_chat_config_dict(chat).get("waifu_enabled", False)
 
 
 def update_chat_waifu_disabled(chat: Chat | ChatData, disabled: bool):
     add_chat(chat)
     _db.execute(_get_stmt(chat.id, "$.waifu_enabled", not disabled))
     commit()
+    invalidate_chat_config(chat.id)
 
 
 def get_chat_delete_events_enabled(chat: Chat | ChatData) -> bool:
-    _db_chat = add_chat(chat)
-    return _db_chat.config.get("delete_events_enabled", False)
+    return _get_chat_config_dict(chat).get("delete_events_enabled", False)
 
 
 def update_chat_delete_events_enabled(chat: Chat | ChatData, enabled: bool):
     add_chat(chat)
     _db.execute(_get_stmt(chat.id, "$.delete_events_enabled", enabled))
     commit()
+    invalidate_chat_config(chat.id)
 
 
 def get_chat_unpin_channel_pin_enabled(chat: Chat | ChatData) -> bool:
-    _db_chat = add_chat(chat)
-    return _db_chat.config.get("unpin_channel_pin_enabled", False)
+    return _get_chat_config_dict(chat).get("unpin_channel_pin_enabled", False)
 
 
 def update_chat_unpin_channel_pin_enabled(chat: Chat | ChatData, enabled: bool):
     add_chat(chat)
     _db.execute(_get_stmt(chat.id, "$.unpin_channel_pin_enabled", enabled))
     commit()
+    invalidate_chat_config(chat.id)
 
 
 def get_chat_title_permissions(chat: Chat | ChatData) -> dict:
-    _db_chat = add_chat(chat)
-    if _db_chat.config.get("title_permissions") is None:
+    title_permissions = _get_chat_config_dict(chat).get("title_permissions")
+    if title_permissions is None:
         _db.execute(_get_stmt(chat.id, "$.title_permissions", "{}"))
         commit()
-    if isinstance(_db_chat.config["title_permissions"], str):
-        return json.loads(_db_chat.config["title_permissions"])
-    elif isinstance(_db_chat.config["title_permissions"], dict):
-        return _db_chat.config["title_permissions"]
+        invalidate_chat_config(chat.id)
+        return {}
+    if isinstance(title_permissions, str):
+        return json.loads(title_permissions)
+    elif isinstance(title_permissions, dict):
+        return dict(title_permissions)
     else:
         return {}
 
@@ -193,31 +261,33 @@ def update_chat_title_permissions(chat: Chat | ChatData, permissions: dict):
         )
     )
     commit()
+    invalidate_chat_config(chat.id)
 
 
 def get_chat_message_search_enabled(chat: Chat | ChatData) -> bool:
-    _db_chat = add_chat(chat)
-    return _db_chat.config.get("message_search_enabled", False)
+    return _get_chat_config_dict(chat).get("message_search_enabled", False)
 
 
 def update_chat_message_search_enabled(chat: Chat | ChatData, enabled: bool):
     add_chat(chat)
     _db.execute(_get_stmt(chat.id, "$.message_search_enabled", enabled))
     commit()
+    invalidate_chat_config(chat.id)
 
 
 def update_chat_greet(chat: Chat | ChatData, greet: str):
     add_chat(chat)
     _db.execute(_get_stmt(chat.id, "$.greeting", greet))
     commit()
+    invalidate_chat_config(chat.id)
 
 
 def get_chat_config(chat: Chat | ChatData) -> ChatConfig:
-    _db_chat = add_chat(chat)
-    return ChatConfig.from_dict(_db_chat.config)
+    return ChatConfig.from_dict(copy.deepcopy(_get_chat_config_dict(chat)))
 
 
 def update_chat_config(chat: Chat | ChatData, config: ChatConfig):
     _db_chat = add_chat(chat)
     _db_chat.config = config.to_dict()
     commit()
+    invalidate_chat_config(chat.id)
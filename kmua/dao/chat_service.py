@@ -1,22 +1,29 @@
 from telegram import Chat
 
+import kmua.dao.association as association_dao
 import kmua.dao.chat as chat_dao
 import kmua.dao.quote as quote_dao
+import kmua.dao.waifu as waifu_dao
+import kmua.dao.write_buffer as write_buffer_dao
 from kmua.models.models import ChatData
 
 from ._db import commit
 
 
 def delete_chat_data_and_quotes(chat_id: int):
+    write_buffer_dao.forget_buffered_chat(chat_id)
     db_chat = chat_dao.get_chat_by_id(chat_id)
     if db_chat is None:
         return
     quote_dao.delete_chat_quotes(db_chat)
     chat_dao.delete_chat(db_chat)
     commit()
+    association_dao.invalidate_user_chat_ids()
+    waifu_dao.bump_chat_waifu_version(chat_id)
 
 
 def update_chat_id(old_id: int, new_id: int):
+    write_buffer_dao.forget_buffered_chat(old_id)
     db_chat = chat_dao.get_chat_by_id(old_id)
     if db_chat is None:
         return
@@ -24,6 +31,11 @@ def update_chat_id(old_id: int, new_id: int):
         return
     db_chat.id = new_id
     commit()
+    chat_dao.invalidate_chat_config(old_id)
+    chat_dao.invalidate_chat_config(new_id)
+    quote_dao.invalidate_chat_quote_index(old_id)
+    quote_dao.invalidate_chat_quote_index(new_id)
+    association_dao.invalidate_user_chat_ids()
 
 
 def update_chat_title(chat: Chat | ChatData, title: str):
@@ -3,6 +3,7 @@ from kmua.logger import logger
 from kmua.models.models import ChatData, Quote
 
 from .chat_service import delete_chat_data_and_quotes
+from .quote import invalidate_chat_quote_index
 
 
 def fix_none_chat_id_quotes() -> tuple[int, int, int]:
@@ -30,6 +31,7 @@ def fix_none_chat_id_quotes() -> tuple[int, int, int]:
             continue
         quote.chat_id = db_chat.id
         commit()
+    invalidate_chat_quote_index()
     return len(quotes), len(invalid_chat_ids), failed_count
 
 
@@ -1,9 +1,99 @@
+import random
+import threading
+
 import cachetools
+import sqlalchemy
 from sqlalchemy import func, or_
 from telegram import Chat, Message, User
 
+import kmua.dao.association as association_dao
+from kmua.config import settings
 from kmua.dao._db import _db, commit
+from kmua.logger import logger
 from kmua.models.models import ChatData, Quote, UserData
+from kmua.models.quote_index import (
+    MYSQL_FULLTEXT_INDEX,
+    SQLITE_FTS_REBUILD,
+    SQLITE_FTS_TABLES,
+    split_chars,
+)
+
+
+class _QuoteLinkIndex:
+    """
+    一个群组中所有语录的 link, 支持 O(1) 的添加, 删除和随机选取
+    """
+
+    def __init__(self, links: list[str]):
+        self._links = links
+        self._positions = {link: i for i, link in enumerate(links)}
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    def add(self, link: str):
+        if link in self._positions:
+            return
+        self._positions[link] = len(self._links)
+        self._links.append(link)
+
+    def remove(self, link: str):
+        position = self._positions.pop(link, None)
+        if position is None:
+            return
+        last = self._links.pop()
+        if last != link:
+            self._links[position] = last
+            self._positions[last] = position
+
+    def choice(self) -> str | None:
+        if not self._links:
+            return None
+        return random.choice(self._links)
+
+
+_quote_index_lock = threading.RLock()
+_quote_index: cachetools.LRUCache[int, _QuoteLinkIndex] = cachetools.LRUCache(
+    maxsize=settings.get("quote_index_cache_size", 1024)
+)
+
+
+def _get_chat_quote_index(chat_id: int) -> _QuoteLinkIndex:
+    with _quote_index_lock:
+        index = _quote_index.get(chat_id)
+        if index is None:
+            links = _db.query(Quote.link).filter(Quote.chat_id == chat_id).all()
+            index = _QuoteLinkIndex([link for (link,) in links])
+            _quote_index[chat_id] = index
+        return index
+
+
+def invalidate_chat_quote_index(chat_id: int | None = None):
+    """
+    清除群组的语录索引, chat_id 为 None 时清除所有
+    """
+    with _quote_index_lock:
+        if chat_id is None:
+            _quote_index.clear()
+        else:
+            _quote_index.pop(chat_id, None)
+
+
+def get_chat_random_quote_by_index(chat_id: int) -> Quote | None:
+    """
+    从缓存的索引中随机选取一条语录, 只查询被选中的那一条
+    """
+    for _ in range(3):
+        with _quote_index_lock:
+            link = _get_chat_quote_index(chat_id).choice()
+        if link is None:
+            return None
+        if quote := get_quote_by_link(link):
+            return quote
+        # 索引中的语录已被删除
+        with _quote_index_lock:
+            _get_chat_quote_index(chat_id).remove(link)
+    return None
 
 
 def get_quote_by_link(link: str) -> Quote | None:
@@ -11,13 +101,18 @@ def get_quote_by_link(link: str) -> Quote | None:
 
 
 def delete_quote(quote: Quote):
+    chat_id, link = quote.chat_id, quote.link
     _db.delete(quote)
     commit()
+    with _quote_index_lock:
+        if (index := _quote_index.get(chat_id)) is not None:
+            index.remove(link)
 
 
 def delete_chat_quotes(chat: Chat | ChatData):
     _db.query(Quote).filter(Quote.chat_id == chat.id).delete()
     commit()
+    invalidate_chat_quote_index(chat.id)
 
 
 def delete_quote_by_link(link: str) -> bool:
@@ -55,10 +150,16 @@ def add_quote(
             link=link,
             qer_id=qer.id,
             text=message.text,
+            text_ngram=(
+                split_chars(message.text) if _get_quote_text_index() == "fts5" else None
+            ),
             img=img,
         )
     )
     commit()
+    with _quote_index_lock:
+        if (index := _quote_index.get(chat.id)) is not None:
+            index.add(link)
     return get_quote_by_link(link)
 
 
@@ -66,24 +167,123 @@ def get_all_quotes_count() -> int:
     return _db.query(Quote).count()
 
 
-@cachetools.cached(cachetools.TTLCache(maxsize=1024, ttl=30))
+# mysql 布尔模式的运算符, 查询中包含时使用 LIKE
+_MYSQL_BOOLEAN_OPERATORS = frozenset('+-<>()~*"@')
+
+_quote_text_index: str | None = None
+
+
+def _get_quote_text_index() -> str:
+    """
+    检查迁移创建的语录全文索引, 见 kmua.models.quote_index
+
+    :return: "fts5", "fulltext", 不存在时为 ""
+    """
+    global _quote_text_index
+    if _quote_text_index is not None:
+        return _quote_text_index
+    dialect = _db.get_bind().dialect.name
+    index = ""
+    try:
+        if dialect == "sqlite":
+            tables = _db.execute(
+                sqlalchemy.text(
+                    "SELECT name FROM sqlite_master "
+                    "WHERE type = 'table' AND name IN :names"
+                ).bindparams(sqlalchemy.bindparam("names", expanding=True)),
+                {"names": list(SQLITE_FTS_TABLES)},
+            ).all()
+            if len(tables) == len(SQLITE_FTS_TABLES):
+                index = "fts5"
+        elif dialect == "mysql":
+            if _db.execute(
+                sqlalchemy.text("SHOW INDEX FROM quotes WHERE Key_name = :name"),
+                {"name": MYSQL_FULLTEXT_INDEX},
+            ).first():
+                index = "fulltext"
+    except Exception as err:
+        logger.warning(
+            f"Check quote text index failed: {err.__class__.__name__}: {err}"
+        )
+    if not index:
+        logger.warning("Quote text index not found, fallback to LIKE")
+    _quote_text_index = index
+    return index
+
+
+def rebuild_quote_text_index():
+    """
+    重建 sqlite 的 fts5 索引, 在 VACUUM 之后调用 (VACUUM 可能改变 rowid)
+
+    不是由 add_quote 添加的语录 (如直接使用 SQL 插入) 会在此时补全 text_ngram
+    """
+    if _get_quote_text_index() != "fts5":
+        return
+    rows = _db.execute(
+        sqlalchemy.text(
+            "SELECT rowid, text FROM quotes "
+            "WHERE text IS NOT NULL AND text_ngram IS NULL"
+        )
+    ).all()
+    if rows:
+        _db.execute(
+            sqlalchemy.text(
+                "UPDATE quotes SET text_ngram = :text WHERE rowid = :rowid"
+            ),
+            [{"rowid": rowid, "text": split_chars(text)} for rowid, text in rows],
+        )
+    for statement in SQLITE_FTS_REBUILD:
+        _db.execute(sqlalchemy.text(statement))
+    commit()
+
+
+def _quote_user_can_see(user: User | UserData):
+    return or_(
+        Quote.chat_id.in_(association_dao.get_user_chat_ids(user)),
+        Quote.user_id == user.id,
+        Quote.qer_id == user.id,
+    )
+
+
+@cachetools.cached(
+    cachetools.TTLCache(maxsize=1024, ttl=30),
+    key=lambda user, text, limit=10: (user.id, text, limit),
+)
 def query_quote_user_can_see_by_text(
     user: User | UserData, text: str, limit: int = 10
 ) -> list[Quote]:
-    return (
-        _db.query(Quote)
-        .filter(
-            or_(
-                Quote.chat_id.in_(
-                    _db.query(ChatData.id).filter(
-                        ChatData.members.any(UserData.id == user.id)
-                    )
-                ),
-                Quote.user_id == user.id,
-                Quote.qer_id == user.id,
-            ),
-            Quote.text.like(f"%{text}%"),
+    index = _get_quote_text_index()
+    query = _db.query(Quote).filter(_quote_user_can_see(user))
+    if index == "fts5":
+        # trigram 分词只能处理 3 个字符以上的查询, 更短的查询使用逐字拆分的索引
+        fts_table = "quotes_fts" if len(text) >= 3 else "quotes_fts_ngram"
+        match_text = text if len(text) >= 3 else split_chars(text)
+        if any(char.isalnum() for char in text):
+            quotes_fts = sqlalchemy.table(
+                fts_table, sqlalchemy.column("rowid"), sqlalchemy.column("rank")
+            )
+            return (
+                query.join(
+                    quotes_fts,
+                    quotes_fts.c.rowid == sqlalchemy.literal_column("quotes.rowid"),
+                )
+                .filter(sqlalchemy.text(f"{fts_table} MATCH :phrase"))
+                .params(phrase='"' + match_text.replace('"', '""') + '"')
+                .order_by(quotes_fts.c.rank)
+                .limit(limit)
+                .all()
+            )
+    elif index == "fulltext" and not _MYSQL_BOOLEAN_OPERATORS.intersection(text):
+        # ngram_token_size 默认为 2, 单个字符用前缀匹配以它开头的 ngram
+        phrase = f"{text}*" if len(text) == 1 else f'"{text}"'
+        return (
+            query.filter(Quote.text.match(phrase))
+            .order_by(Quote.text.match(phrase).desc())
+            .limit(limit)
+            .all()
         )
+    return (
+        query.filter(Quote.text.like(f"%{text}%"))
         .order_by(func.random())
         .limit(limit)
         .all()
@@ -1,31 +1,84 @@
 import datetime
+import threading
+from typing import Iterable
 
-from sqlalchemy import text
+import cachetools
+from sqlalchemy import or_, text, update
 from telegram import Chat, ChatFullInfo, User
 from telegram.constants import ChatType
 
+import kmua.dao.quote as quote_dao
+from kmua.config import settings
 from kmua.dao._db import _db, commit
+from kmua.dao._profile import LoadProfile, user_load_options
 from kmua.models.models import ChatData, Quote, UserData
 
+_user_names_lock = threading.Lock()
+_user_names: cachetools.LRUCache[int, str] = cachetools.LRUCache(
+    maxsize=settings.get("user_names_cache_size", 4096)
+)
 
-def get_user_by_id(user_id: int) -> UserData | None:
-    return _db.query(UserData).filter(UserData.id == user_id).first()
 
+def get_user_by_id(
+    user_id: int, profile: LoadProfile = LoadProfile.DISPLAY
+) -> UserData | None:
+    return (
+        _db.query(UserData)
+        .options(*user_load_options(profile))
+        .filter(UserData.id == user_id)
+        .first()
+    )
 
-def add_user(user: User | Chat | ChatFullInfo | ChatData | UserData) -> UserData:
+
+def get_user_display_names(user_ids: Iterable[int]) -> dict[int, str]:
     """
-    添加用户，如果用户已存在则返回已存在的用户
+    批量获取用户名称, 结果会被缓存, 未缓存的用户只需一次查询
+    数据库中不存在的用户不会出现在结果中
+    """
+    names = {}
+    missing = set()
+    with _user_names_lock:
+        for user_id in user_ids:
+            if (name := _user_names.get(user_id)) is not None:
+                names[user_id] = name
+            else:
+                missing.add(user_id)
+    if not missing:
+        return names
+    rows = (
+        _db.query(UserData.id, UserData.full_name)
+        .filter(UserData.id.in_(missing))
+        .all()
+    )
+    with _user_names_lock:
+        for user_id, full_name in rows:
+            names[user_id] = full_name
+            _user_names[user_id] = full_name
+    return names
+
+
+def update_user_display_names(names: dict[int, str]):
+    """
+    用户名称变化后更新缓存, 只更新已缓存的用户
+    """
+    with _user_names_lock:
+        for user_id, full_name in names.items():
+            if user_id in _user_names:
+                _user_names[user_id] = full_name
+
+
+def get_user_fields(user: User | Chat | ChatFullInfo | ChatData) -> dict:
+    """
+    从 Telegram 对象中提取需要写入 UserData 的字段
     如果传递的是 Chat 或 ChatData 对象, full_name 为 chat.title
 
-    :return: UserData object
+    :return: dict of UserData columns
     """
     username = None
     full_name = None
     is_real_user = True
     is_bot = False
-    if isinstance(user, UserData):
-        return user
-    elif isinstance(user, ChatData):
+    if isinstance(user, ChatData):
         username = user.username
         full_name = user.title
         is_real_user = False
@@ -44,21 +97,35 @@ def add_user(user: User | Chat | ChatFullInfo | ChatData | UserData) -> UserData
         is_real_user = user.type in (ChatType.PRIVATE, ChatType.SENDER)
     else:
         raise ValueError(f"Invalid user type {type(user)}")
+    return {
+        "id": user.id,
+        "username": username,
+        "full_name": full_name,
+        "is_real_user": is_real_user,
+        "is_bot": is_bot,
+    }
+
+
+def add_user(user: User | Chat | ChatFullInfo | ChatData | UserData) -> UserData:
+    """
+    添加用户，如果用户已存在则返回已存在的用户
+    如果传递的是 Chat 或 ChatData 对象, full_name 为 chat.title
+
+    :return: UserData object
+    """
+    if isinstance(user, UserData):
+        return user
+    fields = get_user_fields(user)
 
     if userdata := get_user_by_id(user.id):
-        userdata.username = username
-        userdata.full_name = full_name
-        userdata.is_real_user = is_real_user
-        userdata.is_bot = is_bot
+        userdata.username = fields["username"]
+        userdata.full_name = fields["full_name"]
+        userdata.is_real_user = fields["is_real_user"]
+        userdata.is_bot = fields["is_bot"]
         commit()
+        update_user_display_names({user.id: fields["full_name"]})
         return userdata
-    userdata = UserData(
-        id=user.id,
-        username=username,
-        full_name=full_name,
-        is_real_user=is_real_user,
-        is_bot=is_bot,
-    )
+    userdata = UserData(**fields)
     _db.add(userdata)
     commit()
     return get_user_by_id(user.id)
@@ -140,13 +207,18 @@ def clear_inactived_users_avatar(days: int) -> int:
                 UserData.avatar_big_id: None,
                 UserData.avatar_small_blob: None,
                 UserData.avatar_big_blob: None,
-            }
+                UserData.avatar_small_hash: None,
+                UserData.avatar_big_hash: None,
+            },
+            synchronize_session=False,
         )
     )
     commit()
     _db.flush()
     if _db.bind.dialect.name == "sqlite":
         _db.execute(text("VACUUM"))
+        commit()
+        quote_dao.rebuild_quote_text_index()
     else:
         _db.execute(text("OPTIMIZE TABLE user_data"))
     commit()
@@ -154,5 +226,65 @@ def clear_inactived_users_avatar(days: int) -> int:
     return count
 
 
+def get_users_legacy_avatar(user_ids: list[int], big: bool) -> dict[int, bytes]:
+    """
+    读取旧版本保存在 user_data 表中的头像
+
+    :param big: True 为大尺寸头像, False 为小尺寸头像
+    :return: {user_id: avatar}
+    """
+    if not user_ids:
+        return {}
+    column = UserData.avatar_big_blob if big else UserData.avatar_small_blob
+    rows = (
+        _db.query(UserData.id, column)
+        .filter(UserData.id.in_(user_ids), column.isnot(None))
+        .all()
+    )
+    return {user_id: avatar for user_id, avatar in rows}
+
+
+def set_users_legacy_avatar_migrated(digests: dict[int, str], big: bool):
+    """
+    写入迁移后的头像 hash, 并在同一次提交中清除旧版本的头像, 需要先保存头像文件
+
+    :param digests: {user_id: 头像的 sha256}
+    """
+    if big:
+        blob_column, hash_column = UserData.avatar_big_blob, UserData.avatar_big_hash
+    else:
+        blob_column, hash_column = (
+            UserData.avatar_small_blob,
+            UserData.avatar_small_hash,
+        )
+    for user_id, digest in digests.items():
+        _db.execute(
+            update(UserData)
+            .where(UserData.id == user_id)
+            .values(
+                {
+                    blob_column: None,
+                    hash_column: digest,
+                    UserData.updated_at: UserData.updated_at,
+                }
+            )
+            .execution_options(synchronize_session=False)
+        )
+    commit()
+
+
+def get_all_avatar_hashes() -> set[str]:
+    hashes = set()
+    for small_hash, big_hash in _db.query(
+        UserData.avatar_small_hash, UserData.avatar_big_hash
+    ).filter(
+        or_(
+            UserData.avatar_small_hash.isnot(None), UserData.avatar_big_hash.isnot(None)
+        )
+    ):
+        hashes.update(filter(None, (small_hash, big_hash)))
+    return hashes
+
+
 def get_bot_global_admins() -> list[UserData]:
     return _db.query(UserData).filter(UserData.is_bot_global_admin).all()
@@ -1,8 +1,6 @@
 from telegram import Chat, User
 
 import kmua.dao.association as association_dao
-import kmua.dao.chat as chat_dao
-import kmua.dao.user as user_dao
 from kmua.models.models import ChatData, UserData
 
 from ._db import commit
@@ -30,8 +28,4 @@ def update_user_is_bot_admin_in_chat(
 
 
 def check_user_in_chat(user: User | UserData, chat: Chat | ChatData) -> bool:
-    db_user = user_dao.get_user_by_id(user.id)
-    db_chat = chat_dao.get_chat_by_id(chat.id)
-    if db_user is None or db_chat is None:
-        return False
-    return db_user in db_chat.members
+    return association_dao.get_association_in_chat_by_user(chat, user) is not None
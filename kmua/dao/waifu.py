@@ -1,7 +1,9 @@
 import random
+import threading
 from itertools import chain
 from typing import Generator
 
+from sqlalchemy import func
 from telegram import Chat, User
 from telegram.constants import ChatID
 
@@ -11,6 +13,31 @@ import kmua.dao.user as user_dao
 from kmua.models.models import ChatData, UserChatAssociation, UserData
 
 from ._db import _db, commit
+from ._profile import LoadProfile, user_load_options
+
+# 老婆关系的版本号, 用于判断缓存的关系图是否过期
+# 修改 chat 中的老婆关系时递增该 chat 的版本, 全部刷新时递增 epoch
+_waifu_version_lock = threading.Lock()
+_waifu_versions: dict[int, int] = {}
+_waifu_epoch = 0
+
+
+def bump_chat_waifu_version(chat_id: int | None = None):
+    """
+    chat_id 为 None 时使所有 chat 的版本失效
+    """
+    global _waifu_epoch
+    with _waifu_version_lock:
+        if chat_id is None:
+            _waifu_epoch += 1
+            _waifu_versions.clear()
+        else:
+            _waifu_versions[chat_id] = _waifu_versions.get(chat_id, 0) + 1
+
+
+def get_chat_waifu_version(chat_id: int) -> tuple[int, int]:
+    with _waifu_version_lock:
+        return _waifu_epoch, _waifu_versions.get(chat_id, 0)
 
 
 def _get_user_waifu_in_chat_common(
@@ -82,11 +109,16 @@ def get_user_waifu_of_in_chat(
 def get_chat_married_users(
     chat: Chat | ChatData,
 ) -> Generator[UserData, None, None] | None:
-    db_chat = chat_dao.get_chat_by_id(chat.id)
-    if db_chat is None:
+    if chat_dao.get_chat_by_id(chat.id, LoadProfile.IDENTITY) is None:
         chat_dao.add_chat(chat)
         return None
-    return (user for user in db_chat.members if user.is_married)
+    married_users = (
+        _db.query(UserData)
+        .join(UserChatAssociation, UserChatAssociation.user_id == UserData.id)
+        .filter(UserChatAssociation.chat_id == chat.id, UserData.is_married)
+        .all()
+    )
+    return (user for user in married_users)
 
 
 def get_chat_married_users_id(chat: Chat) -> Generator[int, None, None]:
@@ -115,10 +147,12 @@ def put_user_waifu_in_chat(
         if association.waifu_id is None:
             association.waifu_id = waifu.id
             commit()
+            bump_chat_waifu_version(chat.id)
             return True
         return False
     association_dao.add_association_in_chat(chat, user, waifu)
     commit()
+    bump_chat_waifu_version(chat.id)
     return True
 
 
@@ -128,6 +162,7 @@ def refresh_user_waifu_in_chat(user: User | UserData, chat: Chat | ChatData):
         return
     association.waifu_id = None
     commit()
+    bump_chat_waifu_version(chat.id)
 
 
 def get_chat_users_has_waifu(chat: Chat | ChatData) -> Generator[UserData, None, None]:
@@ -137,18 +172,16 @@ def get_chat_users_has_waifu(chat: Chat | ChatData) -> Generator[UserData, None,
     :param chat: Chat or ChatData object
     :return: list of UserData object
     """
-    db_chat = chat_dao.add_chat(chat)
-    associations = (
-        _db.query(UserChatAssociation)
+    users = (
+        _db.query(UserData)
+        .join(UserChatAssociation, UserChatAssociation.user_id == UserData.id)
         .filter(
-            UserChatAssociation.chat_id == db_chat.id,
-            UserChatAssociation.waifu_id is not None,
+            UserChatAssociation.chat_id == chat.id,
+            UserChatAssociation.waifu_id.isnot(None),
         )
         .all()
     )
-    return (
-        user_dao.get_user_by_id(association.user_id) for association in associations
-    )
+    return (user for user in users)
 
 
 def get_chat_users_was_waifu(chat: Chat | ChatData) -> Generator[UserData, None, None]:
@@ -158,52 +191,71 @@ def get_chat_users_was_waifu(chat: Chat | ChatData) -> Generator[UserData, None,
     :param chat: Chat or ChatData object
     :return: list of UserData object
     """
-    db_chat = chat_dao.add_chat(chat)
-    associations = (
-        _db.query(UserChatAssociation)
-        .filter(
-            UserChatAssociation.chat_id == db_chat.id,
-            UserChatAssociation.waifu_id is not None,
-        )
-        .all()
-    )
-    return (
-        user_dao.get_user_by_id(association.waifu_id) for association in associations
+    waifu_ids = _db.query(UserChatAssociation.waifu_id).filter(
+        UserChatAssociation.chat_id == chat.id,
+        UserChatAssociation.waifu_id.isnot(None),
     )
+    users = _db.query(UserData).filter(UserData.id.in_(waifu_ids)).all()
+    return (user for user in users)
 
 
-def get_chat_user_participated_waifu_data(
-    chat: Chat | ChatData,
-) -> tuple[Generator[UserData, None, None], int]:
+def get_chat_waifu_edges(chat: Chat | ChatData) -> list[tuple[int, int]]:
     """
-    获取 chat 中参与了抽老婆的用户生成器和参与人数
+    获取 chat 中所有的 (user_id, waifu_id) 关系, 不包括已婚的老婆
     """
-    db_chat = chat_dao.add_chat(chat)
-    associations = (
-        _db.query(UserChatAssociation)
+    return [
+        (user_id, waifu_id)
+        for user_id, waifu_id in _db.query(
+            UserChatAssociation.user_id, UserChatAssociation.waifu_id
+        )
         .filter(
-            UserChatAssociation.chat_id == db_chat.id,
+            UserChatAssociation.chat_id == chat.id,
             UserChatAssociation.waifu_id.isnot(None),
         )
         .all()
-    )
+    ]
 
-    users_id_participated = {association.user_id for association in associations} | {
-        association.waifu_id
-        for association in associations
-        if association.waifu_id is not None
-    }
 
-    def user_generator():
-        for user_id in users_id_participated:
-            yield user_dao.get_user_by_id(user_id)
+def get_chat_waifu_graph_data(
+    chat: Chat | ChatData,
+    profile: LoadProfile = LoadProfile.DISPLAY,
+) -> tuple[list[tuple[int, int]], list[UserData]]:
+    """
+    获取 chat 中的 (user_id, waifu_id) 关系和参与了抽老婆的用户, 共两次查询
+    """
+    edges = get_chat_waifu_edges(chat)
+    users_id_participated = {user_id for edge in edges for user_id in edge}
+    if not users_id_participated:
+        return edges, []
+    users = (
+        _db.query(UserData)
+        .options(*user_load_options(profile))
+        .filter(UserData.id.in_(users_id_participated))
+        .all()
+    )
+    return edges, users
+
 
-    return user_generator(), len(users_id_participated)
+def get_chats_id_has_waifu() -> list[int]:
+    """
+    获取今天有人抽过老婆的 chat id
+    """
+    return [
+        chat_id
+        for (chat_id,) in _db.query(UserChatAssociation.chat_id)
+        .filter(UserChatAssociation.waifu_id.isnot(None))
+        .distinct()
+        .all()
+    ]
 
 
-async def refresh_all_waifu_data():
-    association_dao.update_associations_all_waifu_id_to_none()
+def refresh_chat_waifu_data(chat_id: int):
+    _db.query(UserChatAssociation).filter(
+        UserChatAssociation.chat_id == chat_id,
+        UserChatAssociation.waifu_id.isnot(None),
+    ).update({UserChatAssociation.waifu_id: None})
     commit()
+    bump_chat_waifu_version(chat_id)
 
 
 def refresh_user_all_waifu(user: User | UserData):
@@ -212,6 +264,8 @@ def refresh_user_all_waifu(user: User | UserData):
     for association in associations:
         association.waifu_id = None
     commit()
+    for association in associations:
+        bump_chat_waifu_version(association.chat_id)
 
 
 def get_user_waifus(user: User | UserData) -> Generator[UserData, None, None]:
@@ -268,20 +322,30 @@ def take_waifu_for_user_in_chat(
     Returns:
         UserData -- Waifu for user in chat
     """
-    chat_dao.add_chat(chat)
-    user_dao.add_user(user)
-    members = chat_dao.get_chat_users_without_bots(chat)
-    filtered_members = (
-        userdata
-        for userdata in members
-        if not (
-            userdata.id == user.id
-            or userdata.is_married
-            or userdata.id
-            in (ChatID.FAKE_CHANNEL, ChatID.ANONYMOUS_ADMIN, ChatID.SERVICE_CHAT)
+    candidates = (
+        _db.query(UserData)
+        .join(UserChatAssociation, UserChatAssociation.user_id == UserData.id)
+        .filter(
+            UserChatAssociation.chat_id == chat.id,
+            UserData.is_bot.is_(False),
+            UserData.is_married.isnot(True),
+            UserData.id.notin_(
+                (
+                    user.id,
+                    ChatID.FAKE_CHANNEL,
+                    ChatID.ANONYMOUS_ADMIN,
+                    ChatID.SERVICE_CHAT,
+                )
+            ),
         )
     )
-    filtered_members_list = list(filtered_members)
-    if not filtered_members_list:
+    count = candidates.with_entities(func.count(UserData.id)).scalar()
+    if not count:
         return None
-    return random.choice(filtered_members_list)
+    # 只取随机偏移处的一行, 随机抽取不需要稳定的顺序, 省去排序
+    return (
+        candidates.options(*user_load_options(LoadProfile.DISPLAY))
+        .offset(random.randrange(count))
+        .limit(1)
+        .first()
+    )
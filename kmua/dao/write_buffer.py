@@ -0,0 +1,221 @@
+import time
+
+import cachetools
+from telegram import Chat, ChatFullInfo, User
+
+import kmua.dao.association as association_dao
+import kmua.dao.chat as chat_dao
+import kmua.dao.user as user_dao
+from kmua.config import settings
+from kmua.logger import logger
+from kmua.models.models import ChatData, UserData
+
+from ._db import _db
+
+
+def _upsert(model, update_columns: list[str]):
+    """
+    按数据库方言生成批量 upsert 语句
+
+    update_columns 为空时, 已存在的行保持不变 (insert ignore)
+    """
+    dialect = _db.bind.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(model)
+        if not update_columns:
+            return stmt.on_conflict_do_nothing()
+        return stmt.on_conflict_do_update(
+            index_elements=[column.name for column in model.__table__.primary_key],
+            set_={column: stmt.excluded[column] for column in update_columns},
+        )
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+
+        stmt = dialect_insert(model)
+        if not update_columns:
+            return stmt.prefix_with("IGNORE")
+        return stmt.on_duplicate_key_update(
+            {column: stmt.inserted[column] for column in update_columns}
+        )
+    raise NotImplementedError(f"upsert is not supported for {dialect}")
+
+
+class WriteBuffer:
+    """
+    store_data 的写缓冲
+
+    首次见到的用户, 群组和成员关系会立即写入, 保证后续的处理器能查到对应的行;
+    之后用户和群组的重复出现只在内存中合并, 按时间或数量阈值批量 upsert 到数据库
+    """
+
+    def __init__(self, max_size: int = 500, flush_interval: float = 5):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._users: dict[int, dict] = {}
+        self._chats: dict[int, dict] = {}
+        # 已确认存在于数据库中的 id
+        self._known_users = cachetools.LRUCache(maxsize=100000)
+        self._known_chats = cachetools.LRUCache(maxsize=20000)
+        self._known_associations = cachetools.LRUCache(maxsize=200000)
+        self._last_flush = time.monotonic()
+        self.rows_coalesced = 0
+        self.rows_flushed = 0
+        self.flush_count = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def pending(self) -> int:
+        return len(self._users) + len(self._chats)
+
+    def add_user(self, user: User | Chat | ChatFullInfo | ChatData):
+        if user.id not in self._known_users:
+            user_dao.add_user(user)
+            self._known_users[user.id] = True
+            return
+        if user.id in self._users:
+            self.rows_coalesced += 1
+        self._users[user.id] = user_dao.get_user_fields(user)
+        self._maybe_flush()
+
+    def add_chat(self, chat: Chat | ChatData):
+        if chat.id not in self._known_chats:
+            chat_dao.add_chat(chat)
+            self._known_chats[chat.id] = True
+            return
+        if chat.id in self._chats:
+            self.rows_coalesced += 1
+        self._chats[chat.id] = {
+            "id": chat.id,
+            "title": chat.title,
+            "username": chat.username,
+        }
+        self._maybe_flush()
+
+    def add_association(
+        self, chat: Chat | ChatData, user: User | UserData | Chat | ChatData
+    ):
+        key = (chat.id, user.id)
+        if key in self._known_associations:
+            self.rows_coalesced += 1
+            return
+        association_dao.add_association_in_chat(chat, user)
+        self._known_associations[key] = True
+
+    def forget_association(self, chat_id: int, user_id: int):
+        self._known_associations.pop((chat_id, user_id), None)
+
+    def forget_chat(self, chat_id: int):
+        self._chats.pop(chat_id, None)
+        self._known_chats.pop(chat_id, None)
+        for key in [key for key in self._known_associations if key[0] == chat_id]:
+            self._known_associations.pop(key, None)
+
+    def _maybe_flush(self):
+        if (
+            self.pending >= self.max_size
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        将缓冲区中的数据写入数据库
+
+        :return: 写入的行数
+        """
+        self._last_flush = time.monotonic()
+        if not self.pending:
+            return 0
+        users, self._users = list(self._users.values()), {}
+        chats, self._chats = list(self._chats.values()), {}
+        start = time.perf_counter()
+        try:
+            if users:
+                _db.execute(
+                    _upsert(
+                        UserData, ["username", "full_name", "is_real_user", "is_bot"]
+                    ),
+                    users,
+                )
+            if chats:
+                _db.execute(_upsert(ChatData, ["title", "username"]), chats)
+            _db.commit()
+        except NotImplementedError:
+            _db.rollback()
+            self._flush_fallback(users, chats)
+        except Exception as err:
+            _db.rollback()
+            logger.error(f"flush write buffer failed: {err.__class__.__name__}: {err}")
+            return 0
+        user_dao.update_user_display_names(
+            {user["id"]: user["full_name"] for user in users}
+        )
+        elapsed = (time.perf_counter() - start) * 1000
+        count = len(users) + len(chats)
+        self.flush_count += 1
+        self.rows_flushed += count
+        self.last_flush_ms = elapsed
+        self.total_flush_ms += elapsed
+        self.max_flush_ms = max(self.max_flush_ms, elapsed)
+        logger.trace(f"flushed {count} rows in {elapsed:.2f}ms")
+        return count
+
+    def _flush_fallback(self, users: list[dict], chats: list[dict]):
+        for user in users:
+            _db.merge(UserData(**user))
+        for chat in chats:
+            _db.merge(ChatData(**chat))
+        _db.commit()
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "pending": self.pending,
+            "rows_coalesced": self.rows_coalesced,
+            "rows_flushed": self.rows_flushed,
+            "flush_count": self.flush_count,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+            "avg_flush_ms": (
+                self.total_flush_ms / self.flush_count if self.flush_count else 0.0
+            ),
+        }
+
+
+_write_buffer = WriteBuffer(
+    max_size=settings.get("write_buffer_max_size", 500),
+    flush_interval=settings.get("write_buffer_interval", 5),
+)
+
+
+def buffer_user(user: User | Chat | ChatFullInfo | ChatData):
+    _write_buffer.add_user(user)
+
+
+def buffer_chat(chat: Chat | ChatData):
+    _write_buffer.add_chat(chat)
+
+
+def buffer_association(chat: Chat | ChatData, user: User | UserData | Chat | ChatData):
+    _write_buffer.add_association(chat, user)
+
+
+def forget_buffered_chat(chat_id: int):
+    _write_buffer.forget_chat(chat_id)
+
+
+def forget_buffered_association(chat_id: int, user_id: int):
+    _write_buffer.forget_association(chat_id, user_id)
+
+
+def flush_write_buffer() -> int:
+    return _write_buffer.flush()
+
+
+def get_write_buffer_stats() -> dict[str, float]:
+    return _write_buffer.stats()
@@ -1,12 +1,8 @@
-import pickle
-
 from telegram import Update
 from telegram.constants import ChatID, ChatType
 from telegram.ext import ContextTypes, MessageHandler, filters
 
 from kmua import common, dao
-from kmua.callbacks.search import update_index_job
-from kmua.config import settings
 from kmua.logger import logger
 
 
@@ -20,10 +16,10 @@ async def store_data(update: Update, _: ContextTypes):
         return
     if message.sender_chat:
         user = message.sender_chat
-    db_user = dao.add_user(user)
+    dao.buffer_user(user)
     if chat.type in (chat.GROUP, chat.SUPERGROUP):
-        dao.add_chat(chat)
-        dao.add_association_in_chat(chat, db_user)
+        dao.buffer_chat(chat)
+        dao.buffer_association(chat, user)
 
 
 _enable_search = common.meili_client is not None and common.redis_client is not None
@@ -62,13 +58,6 @@ async def store_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     if not dao.get_chat_message_search_enabled(chat):
         return
-    if not context.job_queue.get_jobs_by_name(f"update_index_{chat.id}"):
-        context.job_queue.run_repeating(
-            update_index_job,
-            settings.get("meilisearch_update_interval", 300),
-            chat_id=chat.id,
-            name=f"update_index_{chat.id}",
-        )
     for entity in message.entities:
         if entity.type == entity.BOT_COMMAND:
             return
@@ -99,34 +88,16 @@ async def store_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not text:
         return
     try:
-        if context.chat_data.get("updating_index"):
-            if not context.chat_data.get("pending_messages"):
-                context.chat_data["pending_messages"] = []
-            context.chat_data["pending_messages"].append(
-                common.MessageInMeili(
-                    message_id=message.message_id,
-                    text=text,
-                    user_id=user.id,
-                    type=message_type,
-                )
-            )
-            return
-        if context.chat_data.get("pending_messages"):
-            for pending_message in context.chat_data["pending_messages"]:
-                common.redis_client.rpush(
-                    f"kmua_chatmsg_{chat.id}", pickle.dumps(pending_message)
-                )
-            context.chat_data["pending_messages"] = []
-        common.redis_client.rpush(
-            f"kmua_chatmsg_{chat.id}",
-            pickle.dumps(
+        common.enqueue_messages(
+            chat.id,
+            [
                 common.MessageInMeili(
                     message_id=message.message_id,
                     text=text,
                     user_id=user.id,
                     type=message_type,
                 )
-            ),
+            ],
         )
     except Exception as e:
         logger.warning(f"saving message to failed: {e.__class__.__name__}: {e}")
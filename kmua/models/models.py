@@ -8,12 +8,14 @@ from sqlalchemy import (
     Column,
     DateTime,
     ForeignKey,
+    Index,
     LargeBinary,
     String,
+    Text,
     func,
 )
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 
 Base = declarative_base()
 
@@ -40,14 +42,21 @@ class UserChatAssociation(Base):
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
 
+    __table_args__ = (
+        Index("ix_user_chat_association_chat_id_waifu_id", "chat_id", "waifu_id"),
+    )
+
 
 class UserData(Base):
     __tablename__ = "user_data"
     id = Column(BigInteger, primary_key=True, index=True, autoincrement=False)
     username = Column(String(64))
     full_name = Column(String(256), nullable=False)
-    avatar_small_blob = Column(LargeBinary(65536), default=None)
-    avatar_big_blob = Column(LargeBinary(65536), default=None)
+    # 旧版本直接保存在表中的头像, 读取时会迁移到头像存储 (common.avatar)
+    avatar_small_blob = deferred(Column(LargeBinary(65536), default=None))
+    avatar_big_blob = deferred(Column(LargeBinary(65536), default=None))
+    avatar_small_hash = Column(String(64), default=None)
+    avatar_big_hash = Column(String(64), default=None)
     avatar_big_id = Column(String(256), default=None)
 
     is_married = Column(Boolean, default=False)
@@ -83,8 +92,8 @@ id: {self.id}
 username: {self.username}
 full_name: {self.full_name}
 头像缓存id(大尺寸): {True if self.avatar_big_id else None}
-头像(大尺寸): {True if self.avatar_big_blob else None}
-头像(小尺寸): {True if self.avatar_small_blob else None}
+头像(大尺寸): {True if self.avatar_big_hash else None}
+头像(小尺寸): {True if self.avatar_small_hash else None}
 已结婚: {self.is_married}
 已结婚的老婆id: {self.married_waifu_id}
 是否允许被提及: {self.waifu_mention}
@@ -159,6 +168,8 @@ class Quote(Base):
     user_id = Column(BigInteger, ForeignKey("user_data.id"), index=True)
     qer_id = Column(BigInteger, index=True)  # 使用 q 的人
     text = Column(String(4096), nullable=True, default=None)
+    # 逐字拆分的 text, sqlite 中用于 1~2 个字符的全文查询, 见 kmua.models.quote_index
+    text_ngram = deferred(Column(Text, nullable=True, default=None))
     img = Column(String(256), nullable=True, default=None, comment="图片的 file id")
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
@@ -0,0 +1,75 @@
+# 语录文本的全文索引, 由 alembic 迁移创建, 不在模型中定义
+# sqlite 使用两个 fts5 表: quotes_fts 为 trigram 分词, 处理 3 个字符以上的查询;
+# quotes_fts_ngram 索引逐字拆分的 text_ngram 列, 用短语查询处理 1~2 个字符的查询
+# mysql 使用 ngram 分词的 FULLTEXT 索引
+
+SQLITE_FTS_TABLES = ("quotes_fts", "quotes_fts_ngram")
+MYSQL_FULLTEXT_INDEX = "ix_quotes_text_fulltext"
+
+SQLITE_TRIGRAM_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS quotes_fts USING fts5("
+    "text, content='quotes', content_rowid='rowid', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS quotes_fts_ai AFTER INSERT ON quotes BEGIN "
+    "INSERT INTO quotes_fts(rowid, text) VALUES (new.rowid, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS quotes_fts_ad AFTER DELETE ON quotes BEGIN "
+    "INSERT INTO quotes_fts(quotes_fts, rowid, text) "
+    "VALUES ('delete', old.rowid, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS quotes_fts_au AFTER UPDATE OF text ON quotes BEGIN "
+    "INSERT INTO quotes_fts(quotes_fts, rowid, text) "
+    "VALUES ('delete', old.rowid, old.text); "
+    "INSERT INTO quotes_fts(rowid, text) VALUES (new.rowid, new.text); END",
+)
+# 逐字拆分后的文本保存在 quotes.text_ngram 中, 由 add_quote 写入,
+# 触发器只使用普通的 SQL, 没有注册任何函数的连接 (如 sqlite 命令行) 也可以修改 quotes
+SQLITE_NGRAM_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS quotes_fts_ngram USING fts5("
+    "text_ngram, content='quotes', content_rowid='rowid', tokenize='unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS quotes_fts_ngram_ai AFTER INSERT ON quotes BEGIN "
+    "INSERT INTO quotes_fts_ngram(rowid, text_ngram) "
+    "VALUES (new.rowid, new.text_ngram); END",
+    "CREATE TRIGGER IF NOT EXISTS quotes_fts_ngram_ad AFTER DELETE ON quotes BEGIN "
+    "INSERT INTO quotes_fts_ngram(quotes_fts_ngram, rowid, text_ngram) "
+    "VALUES ('delete', old.rowid, old.text_ngram); END",
+    "CREATE TRIGGER IF NOT EXISTS quotes_fts_ngram_au "
+    "AFTER UPDATE OF text_ngram ON quotes BEGIN "
+    "INSERT INTO quotes_fts_ngram(quotes_fts_ngram, rowid, text_ngram) "
+    "VALUES ('delete', old.rowid, old.text_ngram); "
+    "INSERT INTO quotes_fts_ngram(rowid, text_ngram) "
+    "VALUES (new.rowid, new.text_ngram); END",
+    # 只修改了 text 时清空 text_ngram, 在 rebuild_quote_text_index 中重新拆分
+    "CREATE TRIGGER IF NOT EXISTS quotes_text_ngram_reset AFTER UPDATE OF text ON quotes "
+    "WHEN new.text IS NOT old.text AND new.text_ngram IS old.text_ngram BEGIN "
+    "UPDATE quotes SET text_ngram = NULL WHERE rowid = new.rowid; END",
+)
+SQLITE_TRIGRAM_TRIGGERS = ("quotes_fts_ai", "quotes_fts_ad", "quotes_fts_au")
+SQLITE_NGRAM_TRIGGERS = (
+    "quotes_fts_ngram_ai",
+    "quotes_fts_ngram_ad",
+    "quotes_fts_ngram_au",
+    "quotes_text_ngram_reset",
+)
+# 重建索引, VACUUM 可能改变 rowid
+SQLITE_FTS_REBUILD = (
+    "INSERT INTO quotes_fts(quotes_fts) VALUES ('rebuild')",
+    "INSERT INTO quotes_fts_ngram(quotes_fts_ngram) VALUES ('rebuild')",
+)
+
+
+def split_chars(text: str | None) -> str | None:
+    """
+    逐字拆分, 每个字符在 unicode61 分词后都是一个词, 短语查询即为子串匹配
+    """
+    if text is None:
+        return None
+    return " ".join(text)
+
+
+def include_name(name: str | None, type_: str, _parent_names: dict) -> bool:
+    """
+    alembic 自动生成迁移时忽略全文索引, 避免被当作多余的表删除
+    """
+    if type_ == "table":
+        return not (name or "").startswith(SQLITE_FTS_TABLES[0])
+    if type_ == "index":
+        return name != MYSQL_FULLTEXT_INDEX
+    return True
@@ -0,0 +1,142 @@
+import os
+import threading
+from io import BytesIO
+from pathlib import Path
+
+import cachetools
+from pilmoji.source import BaseSource, TwitterEmojiSource
+
+
+def _get_emoji_name(emoji: str, strip_variation: bool = False) -> str:
+    """
+    emoji 的码位序列, 与 twemoji 的文件名格式相同, 如 "1f468-200d-1f4bb"
+    """
+    return "-".join(
+        f"{ord(char):x}" for char in emoji if not (strip_variation and char == "\ufe0f")
+    )
+
+
+class CachedEmojiSource(BaseSource):
+    """
+    带有本地缓存的 emoji 源
+
+    依次从内存, 本地缓存目录, 预置的 emoji 目录中查找, 都没有时才从网络获取并写入缓存.
+    offline 为 True 时不访问网络, 找不到的 emoji 会以文本绘制
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        bundled_dir: Path | None = None,
+        offline: bool = False,
+        memory_size: int = 1024,
+        max_files: int = 8192,
+        upstream: BaseSource | None = None,
+    ):
+        self.cache_dir = cache_dir
+        self.bundled_dir = bundled_dir
+        self.offline = offline
+        self.max_files = max_files
+        self._upstream = upstream
+        # 找不到的 emoji 也会缓存为 None, 避免重复请求
+        self._memory: cachetools.LRUCache[str, bytes | None] = cachetools.LRUCache(
+            maxsize=memory_size
+        )
+        self._lock = threading.Lock()
+        self._files_written = 0
+
+    @property
+    def upstream(self) -> BaseSource:
+        if self._upstream is None:
+            self._upstream = TwitterEmojiSource()
+        return self._upstream
+
+    def get_emoji(self, emoji: str, /) -> BytesIO | None:
+        with self._lock:
+            if emoji in self._memory:
+                data = self._memory[emoji]
+                return BytesIO(data) if data else None
+        data = self._read_local(emoji)
+        if data is None and not self.offline:
+            try:
+                data = self._fetch(emoji)
+            except Exception:
+                # 网络错误不缓存, 下次重试
+                return None
+        with self._lock:
+            self._memory[emoji] = data
+        return BytesIO(data) if data else None
+
+    def get_discord_emoji(self, id: int, /) -> BytesIO | None:
+        return None
+
+    def _read_local(self, emoji: str) -> bytes | None:
+        names = {_get_emoji_name(emoji), _get_emoji_name(emoji, strip_variation=True)}
+        for directory in (self.cache_dir, self.bundled_dir):
+            if directory is None:
+                continue
+            for name in names:
+                try:
+                    return (directory / f"{name}.png").read_bytes()
+                except OSError:
+                    continue
+        return None
+
+    def _fetch(self, emoji: str) -> bytes | None:
+        stream = self.upstream.get_emoji(emoji)
+        if stream is None:
+            return None
+        data = stream.read()
+        self._write_cache(emoji, data)
+        return data
+
+    def _write_cache(self, emoji: str, data: bytes):
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            path = self.cache_dir / f"{_get_emoji_name(emoji)}.png"
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            tmp_path.write_bytes(data)
+            tmp_path.replace(path)
+        except OSError:
+            return
+        self._files_written += 1
+        if self._files_written % 64 == 0:
+            self._prune_cache()
+
+    def _prune_cache(self):
+        """
+        缓存目录中的文件数超过 max_files 时, 删除最早写入的文件
+        """
+        try:
+            files = sorted(
+                self.cache_dir.glob("*.png"), key=lambda path: path.stat().st_mtime
+            )
+        except OSError:
+            return
+        for path in files[: max(0, len(files) - self.max_files)]:
+            try:
+                path.unlink()
+            except OSError:
+                continue
+
+    def prewarm(self) -> int:
+        """
+        将预置目录中的 emoji 读入内存
+
+        :return: 读入的数量
+        """
+        if self.bundled_dir is None or not self.bundled_dir.is_dir():
+            return 0
+        count = 0
+        for path in self.bundled_dir.glob("*.png"):
+            if count >= self._memory.maxsize:
+                break
+            try:
+                emoji = "".join(chr(int(code, 16)) for code in path.stem.split("-"))
+                data = path.read_bytes()
+            except (ValueError, OSError):
+                continue
+            with self._lock:
+                self._memory[emoji] = data
+            count += 1
+        return count
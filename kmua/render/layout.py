@@ -0,0 +1,118 @@
+import unicodedata
+
+from PIL import ImageFont
+
+# 不能出现在行首的标点
+_NO_LINE_START = set("，。、；：？！）》」』】〕〉’”…—～,.;:?!)]}%")
+# 不占宽度的字符: 零宽连接符, 变体选择符, 肤色修饰符
+_ZERO_WIDTH = {0x200D, 0xFE0E, 0xFE0F, *range(0x1F3FB, 0x1F400)}
+
+
+def _is_emoji(char: str) -> bool:
+    code = ord(char)
+    return code >= 0x1F000 or 0x2600 <= code <= 0x27BF
+
+
+def _is_wide(char: str) -> bool:
+    """
+    中日韩文字和 emoji, 可以在任意两个字之间换行
+    """
+    return _is_emoji(char) or unicodedata.east_asian_width(char) in ("W", "F")
+
+
+class TextMeasurer:
+    """
+    按字符缓存字形宽度, 每个字符只测量一次
+    """
+
+    def __init__(self, font: ImageFont.FreeTypeFont):
+        self.font = font
+        self._widths: dict[str, float] = {}
+
+    def char_width(self, char: str) -> float:
+        width = self._widths.get(char)
+        if width is None:
+            if ord(char) in _ZERO_WIDTH:
+                width = 0.0
+            elif _is_emoji(char):
+                # pilmoji 将 emoji 绘制为字号大小的正方形
+                width = float(self.font.size)
+            else:
+                width = self.font.getlength(char)
+            self._widths[char] = width
+        return width
+
+    def text_width(self, text: str) -> float:
+        return sum(self.char_width(char) for char in text)
+
+
+def _split_tokens(text: str) -> list[str]:
+    """
+    将文本切分为换行时不可拆分的片段:
+    宽字符单独成段, 连续的窄字符 (单词) 成段, 空白单独成段
+    """
+    tokens = []
+    word = ""
+    for char in text:
+        if ord(char) in _ZERO_WIDTH and (word or tokens):
+            # 附着在前一个字符上
+            if word:
+                word += char
+            else:
+                tokens[-1] += char
+            continue
+        if char.isspace() or _is_wide(char):
+            if word:
+                tokens.append(word)
+                word = ""
+            tokens.append(" " if char.isspace() else char)
+        else:
+            word += char
+    if word:
+        tokens.append(word)
+    return tokens
+
+
+def wrap_text(
+    text: str, measurer: TextMeasurer, max_width: float
+) -> list[tuple[str, float]]:
+    """
+    按像素宽度换行, 换行符会被保留
+
+    :return: [(行, 行宽)]
+    """
+    lines = []
+    for paragraph in text.split("\n"):
+        line, line_width = "", 0.0
+        for token in _split_tokens(paragraph):
+            token_width = measurer.text_width(token)
+            if token == " " and not line:
+                continue
+            if line_width + token_width <= max_width or token[0] in _NO_LINE_START:
+                line += token
+                line_width += token_width
+                continue
+            if line:
+                stripped = line.rstrip()
+                lines.append(
+                    (stripped, line_width - measurer.text_width(line[len(stripped) :]))
+                )
+                line, line_width = "", 0.0
+            if token == " ":
+                continue
+            if token_width <= max_width:
+                line, line_width = token, token_width
+                continue
+            # 过长的单词按字符拆分
+            for char in token:
+                char_width = measurer.char_width(char)
+                if line and line_width + char_width > max_width:
+                    lines.append((line, line_width))
+                    line, line_width = "", 0.0
+                line += char
+                line_width += char_width
+        stripped = line.rstrip()
+        lines.append(
+            (stripped, line_width - measurer.text_width(line[len(stripped) :]))
+        )
+    return lines
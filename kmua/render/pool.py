@@ -0,0 +1,269 @@
+# 渲染进程池, 运行在主进程中
+# 渲染进程只会导入 initializer 和渲染函数所在的模块, 设置由这里读取后传入
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any
+
+from kmua.config import data_dir, settings
+from kmua.logger import logger
+
+from .quote import (
+    EMOJI_DIR,
+    QuoteRenderConfig,
+    init_quote_renderer,
+    render_quote_img,
+)
+from .waifu import (
+    WaifuGraphRenderConfig,
+    clear_waifu_graph_cache,
+    init_waifu_graph_renderer,
+    render_waifu_graph,
+)
+
+_executor: Executor | None = None
+_graph_executor: Executor | None = None
+# 已提交, 尚未完成的关系图任务数, 超时的任务在渲染进程中真正结束后才减少
+_graph_jobs = 0
+_graph_jobs_lock = threading.Lock()
+# 在线程中渲染关系图时是否已初始化
+_graph_thread_initialized = False
+_graph_thread_init_lock = threading.Lock()
+_emoji_dir_checked = False
+
+waifu_graph_render_stats = {
+    "renders": 0,
+    "failures": 0,
+    "timeouts": 0,
+    "rejected": 0,
+    "render_seconds": 0.0,
+    "max_render_seconds": 0.0,
+    "wait_seconds": 0.0,
+}
+
+
+def _get_quote_render_config() -> QuoteRenderConfig:
+    global _emoji_dir_checked
+    config = QuoteRenderConfig(
+        emoji_cache_dir=str(settings.get("emoji_cache_dir", data_dir / "emoji")),
+        emoji_bundled_dir=str(settings.get("emoji_dir", EMOJI_DIR)),
+        emoji_offline=settings.get("emoji_offline", True),
+        emoji_cache_size=settings.get("emoji_cache_size", 1024),
+        emoji_cache_max_files=settings.get("emoji_cache_max_files", 8192),
+        emoji_prewarm=settings.get("emoji_prewarm", False),
+        img_format=settings.get("quote_img_format", "jpeg"),
+        img_quality=settings.get("quote_img_quality", 90),
+        img_compress_level=settings.get("quote_img_compress_level", 6),
+    )
+    if not _emoji_dir_checked:
+        _emoji_dir_checked = True
+        if config.emoji_offline and not any(
+            Path(config.emoji_bundled_dir).glob("*.png")
+        ):
+            logger.warning(
+                f"No emoji images in {config.emoji_bundled_dir}, emoji in quotes "
+                "will be drawn as text. Run scripts/fetch_emoji.py to download them"
+            )
+    return config
+
+
+def _render_quote_img_in_thread(avatar: bytes, text: str, name: str) -> bytes:
+    init_quote_renderer(_get_quote_render_config())
+    return render_quote_img(avatar, text, name)
+
+
+def _get_waifu_graph_render_config() -> WaifuGraphRenderConfig:
+    return WaifuGraphRenderConfig(
+        cache_dir=str(settings.get("waifu_graph_cache_dir", data_dir / "waifu_graph")),
+        avatar_cache_size=settings.get("waifu_graph_avatar_cache_size", 4096),
+        ortho_max_nodes=settings.get("waifu_graph_ortho_max_nodes", 50),
+        dot_max_nodes=settings.get("waifu_graph_dot_max_nodes", 200),
+        sfdp_overlap=settings.get("waifu_graph_sfdp_overlap", "scale"),
+        max_pixels=settings.get("waifu_graph_max_pixels", 36_000_000),
+        max_dpi=settings.get("waifu_graph_max_dpi", 300),
+        quality=settings.get("waifu_graph_quality", 80),
+        split_components=settings.get("waifu_graph_split_components", False),
+        split_min_nodes=settings.get("waifu_graph_split_min_nodes", 100),
+        component_workers=settings.get("waifu_graph_component_workers", 4),
+    )
+
+
+def _render_waifu_graph_in_thread(
+    relationships: list[tuple[int, int]],
+    user_info: list[dict[str, Any]],
+    length: int,
+    timeout: float,
+) -> tuple[bytes, float]:
+    try:
+        _init_waifu_graph_thread_renderer()
+        return render_waifu_graph(relationships, user_info, length, timeout)
+    finally:
+        _finish_graph_job()
+
+
+def _init_waifu_graph_thread_renderer():
+    """
+    与进程池一样, 第一次渲染前清理上次运行留下的头像文件
+    """
+    global _graph_thread_initialized
+    with _graph_thread_init_lock:
+        if _graph_thread_initialized:
+            return
+        config = _get_waifu_graph_render_config()
+        clear_waifu_graph_cache(config.cache_dir)
+        init_waifu_graph_renderer(config)
+        _graph_thread_initialized = True
+
+
+def _finish_graph_job(_future=None):
+    global _graph_jobs
+    with _graph_jobs_lock:
+        _graph_jobs -= 1
+
+
+def _get_executor() -> Executor | None:
+    """
+    渲染进程池, 在第一次使用时创建
+
+    quote_render_workers 为 0 时不使用进程池, 在线程中渲染
+    """
+    global _executor
+    if _executor is None and settings.get("quote_render_workers", 2) > 0:
+        # 使用 spawn 避免在多线程的事件循环进程中 fork
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.get("quote_render_workers", 2),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_quote_renderer,
+            initargs=(_get_quote_render_config(),),
+        )
+    return _executor
+
+
+def _get_graph_executor() -> Executor | None:
+    """
+    关系图渲染进程池, 与语录渲染分开, 避免耗时的关系图阻塞语录
+
+    waifu_graph_render_workers 为 0 时不使用进程池, 在线程中渲染
+    """
+    global _graph_executor
+    if _graph_executor is None and settings.get("waifu_graph_render_workers", 1) > 0:
+        config = _get_waifu_graph_render_config()
+        clear_waifu_graph_cache(config.cache_dir)
+        _graph_executor = ProcessPoolExecutor(
+            max_workers=settings.get("waifu_graph_render_workers", 1),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_waifu_graph_renderer,
+            initargs=(config,),
+        )
+    return _graph_executor
+
+
+async def render_quote_img_async(avatar: bytes, text: str, name: str) -> bytes:
+    global _executor
+    executor = _get_executor()
+    if executor is None:
+        return await asyncio.to_thread(_render_quote_img_in_thread, avatar, text, name)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            executor, render_quote_img, avatar, text, name
+        )
+    except BrokenProcessPool:
+        logger.warning("Quote render process pool is broken, recreating")
+        if _executor is executor:
+            _executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        return await asyncio.to_thread(_render_quote_img_in_thread, avatar, text, name)
+
+
+async def _run_graph_job(
+    relationships: list[tuple[int, int]],
+    user_info: list[dict[str, Any]],
+    length: int,
+    timeout: float,
+) -> tuple[bytes, float]:
+    global _graph_executor, _graph_jobs
+    executor = _get_graph_executor()
+    with _graph_jobs_lock:
+        _graph_jobs += 1
+    if executor is None:
+        # 线程结束时才减少计数, 等待的协程被取消时线程仍在渲染
+        return await asyncio.to_thread(
+            _render_waifu_graph_in_thread, relationships, user_info, length, timeout
+        )
+    try:
+        future = executor.submit(
+            render_waifu_graph, relationships, user_info, length, timeout
+        )
+    except BaseException:
+        _finish_graph_job()
+        raise
+    # 超时后渲染进程可能仍在运行, 任务真正结束时才减少计数
+    future.add_done_callback(_finish_graph_job)
+    try:
+        # dot 进程会在 timeout 后被终止, 这里多等一会作为兜底
+        return await asyncio.wait_for(
+            asyncio.wrap_future(future),
+            timeout=None if timeout is None else timeout * 2 + 30,
+        )
+    except BrokenProcessPool:
+        logger.warning("Waifu graph render process pool is broken, recreating")
+        if _graph_executor is executor:
+            _graph_executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+
+async def render_waifu_graph_async(
+    relationships: list[tuple[int, int]],
+    user_info: list[dict[str, Any]],
+    length: int = 0,
+) -> bytes:
+    """
+    在关系图进程池中渲染, 排队的任务超过 waifu_graph_queue_size 时直接失败
+    """
+    if _graph_jobs >= settings.get("waifu_graph_queue_size", 16):
+        waifu_graph_render_stats["rejected"] += 1
+        raise RuntimeError("waifu graph render queue is full")
+    timeout = settings.get("waifu_graph_timeout", 300)
+    start = time.perf_counter()
+    try:
+        image, render_seconds = await _run_graph_job(
+            relationships, user_info, length, timeout
+        )
+    except (TimeoutError, asyncio.TimeoutError):
+        waifu_graph_render_stats["timeouts"] += 1
+        raise
+    except Exception:
+        waifu_graph_render_stats["failures"] += 1
+        raise
+    total_seconds = time.perf_counter() - start
+    waifu_graph_render_stats["renders"] += 1
+    waifu_graph_render_stats["render_seconds"] += render_seconds
+    waifu_graph_render_stats["max_render_seconds"] = max(
+        waifu_graph_render_stats["max_render_seconds"], render_seconds
+    )
+    waifu_graph_render_stats["wait_seconds"] += max(0.0, total_seconds - render_seconds)
+    logger.debug(
+        f"Rendered waifu graph of {length} users in {render_seconds:.2f}s "
+        f"(waited {total_seconds - render_seconds:.2f}s), size: {len(image)}"
+    )
+    return image
+
+
+def get_waifu_graph_pending_jobs() -> int:
+    return _graph_jobs
+
+
+def shutdown_render_pool():
+    global _executor, _graph_executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    if _graph_executor is not None:
+        _graph_executor.shutdown(wait=False, cancel_futures=True)
+        _graph_executor = None
@@ -0,0 +1,154 @@
+# 语录图片的渲染, 运行在渲染进程中
+# 此模块只依赖 Pillow 和 Pilmoji, 不要在这里导入配置, 日志, 数据库或 bot 相关的模块
+import io
+from dataclasses import dataclass
+from pathlib import Path
+
+from PIL import Image, ImageFont
+from pilmoji import Pilmoji
+from pilmoji.source import BaseSource
+
+from .emoji import CachedEmojiSource
+from .layout import TextMeasurer, wrap_text
+
+_RESOURCE_DIR = Path(__file__).resolve().parent.parent / "resource"
+FONT_PATH = _RESOURCE_DIR / "TsukuA.ttc"
+BASE_IMG_PATH = _RESOURCE_DIR / "quote_base.png"
+# scripts/fetch_emoji.py 下载的 twemoji 图片
+EMOJI_DIR = _RESOURCE_DIR / "emoji"
+
+IMG_WIDTH, IMG_HEIGHT = 1200, 640
+FONT_SIZE = 42
+MIN_FONT_SIZE = 26
+NAME_FONT_SIZE = 24
+# 语录文本区域, 文本和名称都以中心线对齐
+TEXT_CENTER_X = 820
+TEXT_MAX_WIDTH = 560
+TEXT_MAX_HEIGHT = 560
+NAME_CENTER_X = 880
+TEXT_COLOR = (255, 255, 252)
+
+
+@dataclass(frozen=True)
+class QuoteRenderConfig:
+    """
+    渲染进程使用的设置, 由主进程读取后传入
+    """
+
+    emoji_cache_dir: str
+    emoji_bundled_dir: str | None = None
+    emoji_offline: bool = True
+    emoji_cache_size: int = 1024
+    emoji_cache_max_files: int = 8192
+    emoji_prewarm: bool = False
+    img_format: str = "jpeg"
+    img_quality: int = 90
+    img_compress_level: int = 6
+
+
+_measurers: dict[int, TextMeasurer] = {}
+_base_img: Image.Image | None = None
+_emoji_source: BaseSource | None = None
+_config: QuoteRenderConfig | None = None
+
+
+def _get_measurer(size: int) -> TextMeasurer:
+    measurer = _measurers.get(size)
+    if measurer is None:
+        measurer = TextMeasurer(ImageFont.truetype(str(FONT_PATH), size))
+        _measurers[size] = measurer
+    return measurer
+
+
+def init_quote_renderer(config: QuoteRenderConfig):
+    """
+    加载字体, 底图和 emoji 源, 每个渲染进程只加载一次, 作为进程池的 initializer
+    """
+    global _base_img, _emoji_source, _config
+    if _base_img is not None:
+        return
+    _get_measurer(FONT_SIZE)
+    _get_measurer(NAME_FONT_SIZE)
+    base_img = Image.open(BASE_IMG_PATH)
+    base_img.load()
+    _emoji_source = CachedEmojiSource(
+        cache_dir=Path(config.emoji_cache_dir),
+        bundled_dir=Path(config.emoji_bundled_dir)
+        if config.emoji_bundled_dir
+        else None,
+        offline=config.emoji_offline,
+        memory_size=config.emoji_cache_size,
+        max_files=config.emoji_cache_max_files,
+    )
+    if config.emoji_prewarm:
+        _emoji_source.prewarm()
+    _config = config
+    _base_img = base_img
+
+
+def _layout_text(text: str) -> tuple[TextMeasurer, list[tuple[str, float]]]:
+    """
+    按像素宽度换行, 行数过多时逐步缩小字号
+    """
+    size = FONT_SIZE
+    while True:
+        measurer = _get_measurer(size)
+        lines = wrap_text(text, measurer, TEXT_MAX_WIDTH)
+        if len(lines) * size <= TEXT_MAX_HEIGHT or size <= MIN_FONT_SIZE:
+            return measurer, lines
+        size = max(MIN_FONT_SIZE, size - 4)
+
+
+def _encode(img: Image.Image) -> bytes:
+    img_byte_arr = io.BytesIO()
+    img = img.convert("RGB")
+    img_format = _config.img_format.lower()
+    if img_format == "png":
+        img.save(img_byte_arr, format="png", compress_level=_config.img_compress_level)
+    elif img_format == "webp":
+        img.save(img_byte_arr, format="webp", quality=_config.img_quality)
+    else:
+        img.save(
+            img_byte_arr, format="jpeg", quality=_config.img_quality, optimize=True
+        )
+    return img_byte_arr.getvalue()
+
+
+def render_quote_img(avatar: bytes, text: str, name: str) -> bytes:
+    """
+    需要先调用 init_quote_renderer
+    """
+    avatar_img = Image.open(io.BytesIO(avatar))
+
+    img = Image.new("RGBA", (IMG_WIDTH, IMG_HEIGHT), (255, 255, 255, 0))
+    img.paste(avatar_img, (0, 0))
+    img.paste(_base_img, (0, 0), _base_img)
+
+    measurer, lines = _layout_text(text)
+    font_size = measurer.font.size
+    text_y = int((IMG_HEIGHT - font_size * len(lines)) / 2)
+
+    name_measurer = _get_measurer(NAME_FONT_SIZE)
+    _, top, _, bottom = name_measurer.font.getbbox(name)
+    name_x = int(NAME_CENTER_X - name_measurer.text_width(name) / 2)
+    name_y = IMG_HEIGHT - (bottom - top) - 20
+
+    with Pilmoji(img, source=_emoji_source, render_discord_emoji=False) as pilmoji:
+        for i, (line, line_width) in enumerate(lines):
+            if not line:
+                continue
+            pilmoji.text(
+                (int(TEXT_CENTER_X - line_width / 2), text_y + i * font_size),
+                text=line,
+                fill=TEXT_COLOR,
+                font=measurer.font,
+                emoji_position_offset=(0, font_size * 12 // FONT_SIZE),
+            )
+        pilmoji.text(
+            (name_x, name_y),
+            text=name,
+            font=name_measurer.font,
+            fill=TEXT_COLOR,
+        )
+
+    return _encode(img)
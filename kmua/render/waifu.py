@@ -0,0 +1,394 @@
+# 老婆关系图的渲染, 运行在渲染进程中
+# 此模块只依赖 graphviz 和 Pillow, 不要在这里导入配置, 日志, 数据库或 bot 相关的模块
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from math import ceil, sqrt
+from pathlib import Path
+from typing import Any
+
+import graphviz
+from PIL import Image
+
+# webp 图片单边的最大像素数
+WEBP_MAX_SIDE = 16383
+# 写入这么多头像文件后, 在渲染结束时清理一次
+PRUNE_INTERVAL = 256
+
+
+@dataclass(frozen=True)
+class WaifuGraphRenderConfig:
+    """
+    渲染进程使用的设置, 由主进程读取后传入
+    """
+
+    cache_dir: str
+    avatar_cache_size: int = 4096
+    ortho_max_nodes: int = 50
+    dot_max_nodes: int = 200
+    sfdp_overlap: str = "scale"
+    max_pixels: int = 36_000_000
+    max_dpi: int = 300
+    quality: int = 80
+    split_components: bool = False
+    split_min_nodes: int = 100
+    component_workers: int = 4
+
+
+_config: WaifuGraphRenderConfig | None = None
+_avatar_dir: Path | None = None
+# 在线程中渲染时可能有多个关系图同时使用头像目录
+_avatar_lock = threading.Lock()
+# 正在渲染的关系图引用的头像文件, 清理时跳过
+_avatar_files_in_use: Counter[Path] = Counter()
+_avatar_files_written = 0
+
+
+def clear_waifu_graph_cache(cache_dir: str):
+    """
+    清理上次运行留下的头像文件, 在创建渲染进程前调用
+    """
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def init_waifu_graph_renderer(config: WaifuGraphRenderConfig):
+    """
+    每个渲染进程使用单独的头像目录, 进程存活期间一直保留, 作为进程池的 initializer
+    """
+    global _avatar_dir, _config
+    if _avatar_dir is not None:
+        return
+    avatar_dir = Path(config.cache_dir) / str(os.getpid())
+    avatar_dir.mkdir(parents=True, exist_ok=True)
+    _config = config
+    _avatar_dir = avatar_dir
+
+
+def _get_avatar_file(avatar: bytes, used: set[Path]) -> str:
+    """
+    以内容的 sha256 作为文件名, 头像没有变化时不会重新写入
+
+    :param used: 当前关系图引用的头像文件, 渲染结束前不会被清理
+    """
+    global _avatar_files_written
+    path = _avatar_dir / f"{hashlib.sha256(avatar).hexdigest()}.png"
+    with _avatar_lock:
+        if path not in used:
+            used.add(path)
+            _avatar_files_in_use[path] += 1
+        if path.exists():
+            os.utime(path)
+            return str(path)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_bytes(avatar)
+        tmp_path.replace(path)
+        _avatar_files_written += 1
+    return str(path)
+
+
+def _release_avatar_files(used: set[Path]):
+    """
+    渲染结束后释放头像文件, 写入的文件足够多时清理一次
+    """
+    global _avatar_files_written
+    with _avatar_lock:
+        _avatar_files_in_use.subtract(used)
+        for path in used:
+            if _avatar_files_in_use[path] <= 0:
+                del _avatar_files_in_use[path]
+        if _avatar_files_written < PRUNE_INTERVAL:
+            return
+        _avatar_files_written = 0
+        _prune_avatar_files()
+
+
+def _prune_avatar_files():
+    """
+    头像文件数超过 avatar_cache_size 时, 删除最久未使用的文件,
+    正在渲染的关系图引用的文件不会被删除. 需要持有 _avatar_lock
+    """
+    try:
+        files = sorted(_avatar_dir.glob("*.png"), key=lambda path: path.stat().st_mtime)
+    except OSError:
+        return
+    for path in files[: max(0, len(files) - _config.avatar_cache_size)]:
+        if path in _avatar_files_in_use:
+            continue
+        try:
+            path.unlink()
+        except OSError:
+            continue
+
+
+def _get_layout(node_count: int) -> tuple[str, dict[str, str], bool]:
+    """
+    按节点数选择布局: 正交边的 dot 最好看但最慢, 节点较多时改用曲线边,
+    再多时改用 sfdp, sfdp 不支持子图, 头像和名称画在同一个节点里
+
+    :return: (engine, graph_attr, 是否使用子图)
+    """
+    if node_count <= _config.ortho_max_nodes:
+        return "dot", {"splines": "ortho", "compound": "true", "ranksep": "1"}, True
+    if node_count <= _config.dot_max_nodes:
+        return "dot", {"splines": "true", "compound": "true", "ranksep": "1"}, True
+    return (
+        "sfdp",
+        {"overlap": _config.sfdp_overlap, "splines": "false", "sep": "+8"},
+        False,
+    )
+
+
+def _get_max_side() -> int:
+    """
+    图片单边的最大像素数, 使总像素数不超过 max_pixels
+    """
+    return min(WEBP_MAX_SIDE, int(sqrt(_config.max_pixels)))
+
+
+def _build_graph(
+    relationships: list[tuple[int, int]],
+    users: list[dict[str, Any]],
+    dpi: int,
+    fmt: str,
+    used: set[Path],
+) -> graphviz.Digraph:
+    engine, layout_attr, use_cluster = _get_layout(len(users))
+    max_inches = _get_max_side() / dpi
+    dot = graphviz.Digraph(
+        engine=engine,
+        graph_attr={
+            "dpi": str(dpi),
+            # 超过 size 时整体缩小, 限制图片的像素数
+            "size": f"{max_inches:.2f},{max_inches:.2f}",
+            **layout_attr,
+        },
+        format=fmt,
+    )
+
+    # Create nodes
+    has_avatar = set()
+    for user in users:
+        user_id = user["id"]
+        username = user.get("username")
+        username = username[:6] + "..." if username and len(username) > 6 else username
+        if not user.get("avatar"):
+            dot.node(str(user_id), label=username)
+            continue
+        avatar_path = _get_avatar_file(user["avatar"], used)
+        if not use_cluster:
+            dot.node(
+                str(user_id),
+                label=username,
+                shape="none",
+                image=avatar_path,
+                imagescale="true",
+                imagepos="tc",
+                labelloc="b",
+                width="1",
+                height="1.25",
+                fixedsize="true",
+            )
+            continue
+        has_avatar.add(user_id)
+
+        with dot.subgraph(name=f"cluster_{user_id}") as subgraph:
+            # Set the attributes for the subgraph
+            subgraph.attr(label=username)
+            subgraph.attr(rank="same")  # Ensure nodes are on the same rank
+            subgraph.attr(labelloc="b")  # Label position at the bottom
+            subgraph.attr(style="filled")
+
+            # Create a node within the subgraph
+            subgraph.node(
+                str(user_id),
+                label="",
+                shape="none",
+                image=avatar_path,
+                imagescale="true",
+            )
+
+    # Create edges
+    for user_id, waifu_id in relationships:
+        dot.edge(
+            str(user_id),
+            str(waifu_id),
+            lhead=f"cluster_{waifu_id}" if waifu_id in has_avatar else "",
+            ltail=f"cluster_{user_id}" if user_id in has_avatar else "",
+        )
+    return dot
+
+
+def _run_engine(dot: graphviz.Digraph, timeout: float | None) -> bytes:
+    # graphviz 的 pipe 不支持超时, 直接调用, 超时后 dot 进程会被终止
+    try:
+        proc = subprocess.run(
+            [dot.engine, f"-T{dot.format}"],
+            input=dot.source.encode(),
+            capture_output=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired as err:
+        raise TimeoutError(f"{dot.engine} timed out after {timeout}s") from err
+    if proc.returncode != 0:
+        raise RuntimeError(
+            f"{dot.engine} exited with {proc.returncode}: "
+            f"{proc.stderr.decode(errors='replace').strip()}"
+        )
+    return proc.stdout
+
+
+def _group_components(
+    relationships: list[tuple[int, int]], users: list[dict[str, Any]]
+) -> list[tuple[list[tuple[int, int]], list[dict[str, Any]]]]:
+    """
+    按连通分量拆分关系图, 较小的分量合并为一组, 使每组都能使用正交边布局
+    """
+    parent = {user["id"]: user["id"] for user in users}
+
+    def find(user_id: int) -> int:
+        while parent[user_id] != user_id:
+            parent[user_id] = parent[parent[user_id]]
+            user_id = parent[user_id]
+        return user_id
+
+    for user_id, waifu_id in relationships:
+        parent.setdefault(user_id, user_id)
+        parent.setdefault(waifu_id, waifu_id)
+        parent[find(user_id)] = find(waifu_id)
+
+    components: dict[int, tuple[list, list]] = {}
+    for user in users:
+        components.setdefault(find(user["id"]), ([], []))[1].append(user)
+    for user_id, waifu_id in relationships:
+        if (root := find(user_id)) in components:
+            components[root][0].append((user_id, waifu_id))
+
+    group_size = _config.ortho_max_nodes
+    groups = []
+    current: tuple[list, list] = ([], [])
+    for edges, members in sorted(
+        components.values(), key=lambda component: len(component[1]), reverse=True
+    ):
+        if len(members) >= group_size:
+            groups.append((edges, members))
+            continue
+        if len(current[1]) + len(members) > group_size:
+            groups.append(current)
+            current = ([], [])
+        current[0].extend(edges)
+        current[1].extend(members)
+    if current[1]:
+        groups.append(current)
+    return groups
+
+
+def _stitch_images(images: list[bytes], padding: int = 32) -> bytes:
+    """
+    将各分量的图片按行排列拼接, 并缩小到像素限制以内
+    """
+    parts = sorted(
+        (Image.open(io.BytesIO(image)).convert("RGB") for image in images),
+        key=lambda part: part.height,
+        reverse=True,
+    )
+    row_width = max(
+        max(part.width for part in parts),
+        int(sqrt(sum(part.width * part.height for part in parts)) * 1.5),
+    )
+    rows: list[list[Image.Image]] = [[]]
+    width = 0
+    for part in parts:
+        if rows[-1] and width + part.width > row_width:
+            rows.append([])
+            width = 0
+        rows[-1].append(part)
+        width += part.width + padding
+
+    canvas_width = max(
+        sum(part.width for part in row) + padding * (len(row) - 1) for row in rows
+    )
+    canvas_height = sum(row[0].height for row in rows) + padding * (len(rows) - 1)
+    canvas = Image.new("RGB", (canvas_width, canvas_height), "white")
+    y = 0
+    for row in rows:
+        x = 0
+        for part in row:
+            canvas.paste(part, (x, y))
+            x += part.width + padding
+        y += row[0].height + padding
+
+    max_side = _get_max_side()
+    scale = min(1.0, max_side / canvas_width, max_side / canvas_height)
+    if scale < 1:
+        canvas = canvas.resize(
+            (max(1, int(canvas_width * scale)), max(1, int(canvas_height * scale))),
+            Image.Resampling.LANCZOS,
+        )
+    output = io.BytesIO()
+    canvas.save(output, format="webp", quality=_config.quality)
+    return output.getvalue()
+
+
+def render_waifu_graph(
+    relationships: list[tuple[int, int]],
+    user_info: list[dict[str, Any]],
+    length: int = 0,
+    timeout: float | None = None,
+) -> tuple[bytes, float]:
+    """
+    需要先调用 init_waifu_graph_renderer
+
+    节点数超过 split_min_nodes 且开启了 split_components 时,
+    按连通分量拆分后并行渲染再拼接
+
+    :return: (webp 图片, 渲染耗时)
+    """
+    start = time.perf_counter()
+    used: set[Path] = set()
+    try:
+        image = _render(relationships, user_info, length, timeout, used)
+    finally:
+        _release_avatar_files(used)
+    return image, time.perf_counter() - start
+
+
+def _render(
+    relationships: list[tuple[int, int]],
+    user_info: list[dict[str, Any]],
+    length: int,
+    timeout: float | None,
+    used: set[Path],
+) -> bytes:
+    dpi = min(max(150, ceil(5 * sqrt(length / 3)) * 20), _config.max_dpi)
+    groups = (
+        _group_components(relationships, user_info)
+        if _config.split_components and len(user_info) > _config.split_min_nodes
+        else []
+    )
+    if len(groups) <= 1:
+        return _run_engine(
+            _build_graph(relationships, user_info, dpi, "webp", used), timeout
+        )
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    graphs = [
+        _build_graph(edges, members, dpi, "png", used) for edges, members in groups
+    ]
+    with ThreadPoolExecutor(max_workers=_config.component_workers) as executor:
+        images = list(
+            executor.map(
+                lambda graph: _run_engine(
+                    graph,
+                    None if deadline is None else max(0.1, deadline - time.monotonic()),
+                ),
+                graphs,
+            )
+        )
+    return _stitch_images(images)
@@ -0,0 +1,156 @@
+"""
+语录图片的排版和编码测试, 与原来按 18 个字符切分, 每张图片重新加载字体的实现比较
+
+两种实现使用同一个离线 emoji 源, 只比较排版, 绘制和编码
+
+用法: python scripts/bench_quote_layout.py [--renders 50]
+"""
+
+import argparse
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image, ImageFont
+from pilmoji import Pilmoji
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kmua.render import quote  # noqa: E402
+from kmua.render.emoji import CachedEmojiSource  # noqa: E402
+
+TEXTS = {
+    "short": "喵",
+    "sentence": "今天也是元气满满的一天! 😀",
+    "long cjk": "这是一段比较长的语录, 用来测试换行和字号的调整, " * 4,
+    "mixed": "mixed 中文 and English words with emoji 🐱🐶 " * 2,
+}
+
+
+def legacy_render(avatar: bytes, text: str, name: str, source) -> bytes:
+    """
+    原来的 generate_quote_img, 只把 emoji 源换成了离线源
+    """
+    text = text.replace("\n", " ")
+    font_path = str(quote.FONT_PATH)
+    base_img_path = str(quote.BASE_IMG_PATH)
+
+    img_width, img_height = 1200, 640
+    font_size = 42
+    name_font_size = 24
+
+    font = ImageFont.truetype(font_path, font_size)
+    name_font = ImageFont.truetype(font_path, name_font_size)
+    base_img = Image.open(base_img_path)
+    avatar_img = Image.open(io.BytesIO(avatar))
+
+    img = Image.new("RGBA", (img_width, img_height), (255, 255, 255, 0))
+    img.paste(avatar_img, (0, 0))
+    img.paste(base_img, (0, 0), base_img)
+
+    text_list = [text[i : i + 18] for i in range(0, len(text), 18)]
+    new_text_height = font_size * len(text_list)
+    new_text_width = max(font.getbbox(x)[2] - font.getbbox(x)[0] for x in text_list)
+    text_x = 540 + int((560 - new_text_width) / 2)
+    text_y = int((img_height - new_text_height) / 2)
+
+    with Pilmoji(img, source=source) as pilmoji:
+        for i, v in enumerate(text_list):
+            pilmoji.text(
+                (text_x, text_y + i * font_size),
+                text=v,
+                fill=(255, 255, 252),
+                font=font,
+                align="center",
+                emoji_position_offset=(0, 12),
+            )
+
+    left, top, right, bottom = name_font.getbbox(name)
+    name_width = right - left
+    name_height = bottom - top
+    name_x = 600 + int((560 - name_width) / 2)
+    name_y = img_height - name_height - 20
+
+    with Pilmoji(img, source=source) as pilmoji:
+        pilmoji.text(
+            (name_x, name_y),
+            text=f"{name}",
+            font=name_font,
+            fill=(255, 255, 252),
+            align="center",
+        )
+
+    img_byte_arr = io.BytesIO()
+    img = img.convert("RGB")
+    img.save(img_byte_arr, format="png")
+    img_byte_arr.seek(0)
+    return img_byte_arr.getvalue()
+
+
+def legacy_layout(text: str) -> int:
+    """
+    原来的排版部分: 加载字体, 按字符数切分, 每行两次 getbbox
+    """
+    font = ImageFont.truetype(str(quote.FONT_PATH), 42)
+    text_list = [text[i : i + 18] for i in range(0, len(text), 18)]
+    return max(font.getbbox(x)[2] - font.getbbox(x)[0] for x in text_list)
+
+
+def _make_avatar() -> bytes:
+    # 带有噪点的头像, 使图片大小接近真实的照片
+    buf = io.BytesIO()
+    Image.effect_noise((640, 640), 40).convert("RGB").save(buf, format="png")
+    return buf.getvalue()
+
+
+def _timeit(func, renders: int) -> tuple[float, int]:
+    size = len(func())
+    start = time.perf_counter()
+    for _ in range(renders):
+        func()
+    return (time.perf_counter() - start) / renders * 1000, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="语录图片排版和编码")
+    parser.add_argument("--renders", type=int, default=50)
+    args = parser.parse_args()
+
+    avatar = _make_avatar()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        source = CachedEmojiSource(
+            cache_dir=Path(cache_dir), bundled_dir=quote.EMOJI_DIR, offline=True
+        )
+        print(f"{'text':>10} {'legacy layout':>14} {'layout':>8} (ms)")
+        for label, text in TEXTS.items():
+            legacy_ms, _ = _timeit(lambda: [legacy_layout(text)], args.renders)
+            # 与渲染进程一样, 字体和字形宽度的缓存在多次渲染间复用
+            ms, _ = _timeit(lambda: quote._layout_text(text)[1], args.renders)
+            print(f"{label:>10} {legacy_ms:14.2f} {ms:8.2f}")
+        print()
+        print(f"{'text':>10} {'impl':>12} {'ms/render':>10} {'bytes':>9}")
+        for label, text in TEXTS.items():
+            ms, size = _timeit(
+                lambda: legacy_render(avatar, text, "name", source), args.renders
+            )
+            print(f"{label:>10} {'legacy png':>12} {ms:10.1f} {size:9d}")
+            for img_format in ("png", "jpeg", "webp"):
+                # 每种格式重新初始化, 与渲染进程一样只加载一次字体和底图
+                quote._base_img = None
+                quote.init_quote_renderer(
+                    quote.QuoteRenderConfig(
+                        emoji_cache_dir=cache_dir,
+                        emoji_bundled_dir=str(quote.EMOJI_DIR),
+                        img_format=img_format,
+                    )
+                )
+                ms, size = _timeit(
+                    lambda: quote.render_quote_img(avatar, text, "name"), args.renders
+                )
+                print(f"{label:>10} {img_format:>12} {ms:10.1f} {size:9d}")
+
+
+if __name__ == "__main__":
+    main()
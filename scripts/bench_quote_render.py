@@ -0,0 +1,112 @@
+"""
+语录图片渲染的吞吐量测试, 比较在线程中渲染与不同数量的渲染进程
+
+只导入 kmua.render.quote, 不需要 bot 的配置和数据库
+
+用法: python scripts/bench_quote_render.py [--renders 200] [--workers 0 1 2 4]
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+TEXTS = [
+    "喵",
+    "今天也是元气满满的一天! 😀",
+    "这是一段比较长的语录, 用来测试换行和字号的调整, " * 4,
+    "mixed 中文 and English words with emoji 🐱🐶 " * 2,
+]
+
+
+def _make_avatar() -> bytes:
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.new("RGB", (640, 640), (90, 120, 200)).save(buf, format="png")
+    return buf.getvalue()
+
+
+def _make_config(cache_dir: str, img_format: str):
+    from kmua.render.quote import EMOJI_DIR, QuoteRenderConfig
+
+    return QuoteRenderConfig(
+        emoji_cache_dir=cache_dir,
+        emoji_bundled_dir=str(EMOJI_DIR),
+        emoji_offline=True,
+        img_format=img_format,
+    )
+
+
+def bench_thread(avatar: bytes, renders: int, config) -> float:
+    from kmua.render.quote import init_quote_renderer, render_quote_img
+
+    init_quote_renderer(config)
+    render_quote_img(avatar, TEXTS[0], "name")
+    start = time.perf_counter()
+    for i in range(renders):
+        render_quote_img(avatar, TEXTS[i % len(TEXTS)], "name")
+    return time.perf_counter() - start
+
+
+def bench_pool(avatar: bytes, renders: int, workers: int, config) -> float:
+    from kmua.render.quote import init_quote_renderer, render_quote_img
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_quote_renderer,
+        initargs=(config,),
+    ) as executor:
+        # 等待所有进程启动并完成 initializer
+        list(
+            executor.map(
+                render_quote_img,
+                [avatar] * workers * 2,
+                TEXTS[:1] * workers * 2,
+                ["name"] * workers * 2,
+            )
+        )
+        start = time.perf_counter()
+        futures = [
+            executor.submit(render_quote_img, avatar, TEXTS[i % len(TEXTS)], "name")
+            for i in range(renders)
+        ]
+        for future in futures:
+            future.result()
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="语录图片渲染吞吐量")
+    parser.add_argument("--renders", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument("--format", default="jpeg")
+    args = parser.parse_args()
+
+    avatar = _make_avatar()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        config = _make_config(cache_dir, args.format)
+        print(f"cpus: {os.cpu_count()}, renders: {args.renders}, format: {args.format}")
+        for workers in args.workers:
+            if workers == 0:
+                seconds = bench_thread(avatar, args.renders, config)
+                mode = "thread"
+            else:
+                seconds = bench_pool(avatar, args.renders, workers, config)
+                mode = f"{workers} process"
+            print(
+                f"{mode:>10}: {args.renders / seconds:7.1f} renders/s, "
+                f"{seconds / args.renders * 1000:6.1f} ms/render"
+            )
+
+
+if __name__ == "__main__":
+    main()
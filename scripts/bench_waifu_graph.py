@@ -0,0 +1,127 @@
+"""
+老婆关系图的渲染测试, 使用随机生成的关系图, 比较不同节点数下各布局的耗时和图片大小
+
+- ortho: 原来的布局, 无论节点数都使用 dot 和正交边
+- adaptive: 按节点数选择布局
+- split: 按节点数选择布局, 并按连通分量拆分后并行渲染
+
+需要安装 graphviz, 只导入 kmua.render.waifu
+
+用法: python scripts/bench_waifu_graph.py [--nodes 10 50 100 200 1000] [--timeout 300]
+"""
+
+import argparse
+import io
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kmua.render import waifu  # noqa: E402
+
+
+def _make_avatar(index: int) -> bytes:
+    buf = io.BytesIO()
+    color = (index * 37 % 256, index * 91 % 256, index * 53 % 256)
+    Image.new("RGB", (160, 160), color).save(buf, format="png")
+    return buf.getvalue()
+
+
+def make_graph(nodes: int, seed: int = 0):
+    """
+    每个用户有一个随机的老婆, 一半的用户有头像
+    """
+    rng = random.Random(seed)
+    users = [
+        {
+            "id": index,
+            "username": f"user{index}",
+            "avatar": _make_avatar(index) if index % 2 == 0 else None,
+        }
+        for index in range(nodes)
+    ]
+    relationships = [(index, rng.randrange(nodes)) for index in range(nodes)]
+    return relationships, users
+
+
+def bench(
+    variant: str, nodes: int, timeout: float, cache_dir: str, sfdp_overlap: str
+) -> str:
+    options = {
+        "ortho": {"ortho_max_nodes": 1 << 30},
+        "adaptive": {},
+        "split": {"split_components": True},
+    }[variant]
+    waifu._avatar_dir = None
+    waifu.init_waifu_graph_renderer(
+        waifu.WaifuGraphRenderConfig(
+            cache_dir=cache_dir, sfdp_overlap=sfdp_overlap, **options
+        )
+    )
+    relationships, users = make_graph(nodes)
+    engine = waifu._get_layout(nodes)[0]
+    prefix = f"{nodes:>6} {variant:>9} {engine:>6}"
+    try:
+        layout_seconds = bench_layout(relationships, users, timeout)
+        image, seconds = waifu.render_waifu_graph(relationships, users, nodes, timeout)
+    except TimeoutError:
+        return f"{prefix} {'timeout':>9}"
+    except RuntimeError as err:
+        return f"{prefix} {'error':>9} {err}"
+    width, height = Image.open(io.BytesIO(image)).size
+    return (
+        f"{prefix} {layout_seconds:9.2f} {seconds:9.2f} "
+        f"{len(image):>10} {width:>6}x{height}"
+    )
+
+
+def bench_layout(relationships, users, timeout: float) -> float:
+    """
+    只计算布局, 输出 plain 格式, 不绘制图片
+    """
+    if waifu._config.split_components:
+        groups = waifu._group_components(relationships, users)
+    else:
+        groups = [(relationships, users)]
+    used = set()
+    start = time.perf_counter()
+    try:
+        for edges, members in groups:
+            waifu._run_engine(
+                waifu._build_graph(edges, members, 150, "plain", used), timeout
+            )
+    finally:
+        waifu._release_avatar_files(used)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="老婆关系图渲染")
+    parser.add_argument(
+        "--nodes", type=int, nargs="+", default=[10, 50, 100, 200, 1000]
+    )
+    parser.add_argument("--variants", nargs="+", default=["ortho", "adaptive", "split"])
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--sfdp-overlap", default="scale")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        print(
+            f"{'nodes':>6} {'variant':>9} {'engine':>6} {'layout s':>9} "
+            f"{'total s':>9} {'bytes':>10} size"
+        )
+        for nodes in args.nodes:
+            for variant in args.variants:
+                print(
+                    bench(variant, nodes, args.timeout, cache_dir, args.sfdp_overlap),
+                    flush=True,
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+get_chat_users_has_waifu 和 get_chat_users_was_waifu 的回归测试,
+统计每次调用的查询次数和耗时, 并与原来逐个查询用户的实现比较
+
+使用临时的 sqlite 数据库, 不会修改 data 中的数据
+
+用法: python scripts/bench_waifu_queries.py [--sizes 1000 10000] [--calls 20]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_tmp_dir = tempfile.TemporaryDirectory()
+os.environ["KMUA_DB_URL"] = f"sqlite:///{_tmp_dir.name}/bench.db"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import event  # noqa: E402
+from telegram import Chat  # noqa: E402
+
+import kmua.dao.chat as chat_dao  # noqa: E402
+import kmua.dao.user as user_dao  # noqa: E402
+from kmua import dao  # noqa: E402
+from kmua.dao._db import _db, engine  # noqa: E402
+from kmua.models.models import ChatData, UserChatAssociation, UserData  # noqa: E402
+
+
+def legacy_has_waifu(chat):
+    """
+    原来的实现, waifu_id is not None 在 python 中恒为 True
+    """
+    db_chat = chat_dao.add_chat(chat)
+    associations = (
+        _db.query(UserChatAssociation)
+        .filter(
+            UserChatAssociation.chat_id == db_chat.id,
+            UserChatAssociation.waifu_id is not None,
+        )
+        .all()
+    )
+    return (
+        user_dao.get_user_by_id(association.user_id) for association in associations
+    )
+
+
+def legacy_was_waifu(chat):
+    db_chat = chat_dao.add_chat(chat)
+    associations = (
+        _db.query(UserChatAssociation)
+        .filter(
+            UserChatAssociation.chat_id == db_chat.id,
+            UserChatAssociation.waifu_id is not None,
+        )
+        .all()
+    )
+    return (
+        user_dao.get_user_by_id(association.waifu_id) for association in associations
+    )
+
+
+def populate(chat_id: int, size: int):
+    """
+    chat 中有 size 个成员, 其中十分之一抽过老婆
+    """
+    _db.add(ChatData(id=chat_id, title=f"bench {size}"))
+    _db.add_all(
+        UserData(id=chat_id * 100_000 - i, full_name=f"user {i}") for i in range(size)
+    )
+    _db.add_all(
+        UserChatAssociation(
+            chat_id=chat_id,
+            user_id=chat_id * 100_000 - i,
+            waifu_id=chat_id * 100_000 - (i + 1) % size if i % 10 == 0 else None,
+        )
+        for i in range(size)
+    )
+    _db.commit()
+
+
+def bench(func, chat, calls: int, queries: list) -> str:
+    count = len(list(func(chat)))
+    _db.expunge_all()
+    queries.clear()
+    start = time.perf_counter()
+    for _ in range(calls):
+        list(func(chat))
+        _db.expunge_all()
+    seconds = (time.perf_counter() - start) / calls
+    return f"{len(queries) / calls:9.0f} {seconds * 1000:9.2f} {count:>6}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="群组老婆查询")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--calls", type=int, default=20)
+    args = parser.parse_args()
+
+    queries = []
+    event.listen(engine, "before_cursor_execute", lambda *_: queries.append(1))
+    print(f"{'size':>6} {'function':>24} {'queries':>9} {'ms/call':>9} {'users':>6}")
+    for index, size in enumerate(args.sizes):
+        chat_id = -(index + 1)
+        populate(chat_id, size)
+        chat = Chat(id=chat_id, type=Chat.SUPERGROUP, title=f"bench {size}")
+        for name, func in (
+            ("legacy has_waifu", legacy_has_waifu),
+            ("get_chat_users_has_waifu", dao.get_chat_users_has_waifu),
+            ("legacy was_waifu", legacy_was_waifu),
+            ("get_chat_users_was_waifu", dao.get_chat_users_was_waifu),
+        ):
+            print(f"{size:>6} {name:>24} {bench(func, chat, args.calls, queries)}")
+    dao.aio.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+下载 twemoji 的 72x72 png 图片, 作为语录图片预置的 emoji
+
+默认保存到 kmua/resource/emoji, 即 KMUA_EMOJI_DIR 的默认值. docker 镜像在构建时执行此脚本
+
+用法: python scripts/fetch_emoji.py [目标目录] [--url 压缩包地址]
+"""
+
+import argparse
+import tarfile
+import time
+import urllib.request
+from pathlib import Path
+
+TWEMOJI_VERSION = "15.1.0"
+TWEMOJI_URL = (
+    f"https://github.com/jdecked/twemoji/archive/refs/tags/v{TWEMOJI_VERSION}.tar.gz"
+)
+DEFAULT_TARGET = Path(__file__).resolve().parent.parent / "kmua" / "resource" / "emoji"
+
+
+def fetch_emoji(url: str, target: Path) -> int:
+    """
+    以流的方式读取压缩包, 只解压 assets/72x72 中的 png
+
+    :return: 写入的文件数
+    """
+    target.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with urllib.request.urlopen(url, timeout=60) as response:
+        with tarfile.open(fileobj=response, mode="r|gz") as archive:
+            for member in archive:
+                path = Path(member.name)
+                if (
+                    not member.isfile()
+                    or path.parent.name != "72x72"
+                    or path.suffix != ".png"
+                ):
+                    continue
+                source = archive.extractfile(member)
+                if source is None:
+                    continue
+                (target / path.name).write_bytes(source.read())
+                count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="下载 twemoji 图片")
+    parser.add_argument("target", nargs="?", type=Path, default=DEFAULT_TARGET)
+    parser.add_argument("--url", default=TWEMOJI_URL)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    count = fetch_emoji(args.url, args.target)
+    if count == 0:
+        raise SystemExit(f"no emoji found in {args.url}")
+    print(f"saved {count} emoji to {args.target} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+AsyncMeiliClient 的测试, 使用本地的 http 服务模拟 meilisearch
+
+用法: python -m unittest discover tests
+"""
+
+import importlib.util
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+# 直接加载 client.py, 导入 kmua.common 会迁移并连接数据库, 还会写日志
+_spec = importlib.util.spec_from_file_location(
+    "meilisearch_client",
+    Path(__file__).resolve().parent.parent / "kmua/common/meilisearch/client.py",
+)
+_client = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_client)
+AsyncMeiliClient = _client.AsyncMeiliClient
+MeiliError = _client.MeiliError
+
+API_KEY = "test-key"
+
+
+class FakeMeilisearch(BaseHTTPRequestHandler):
+    """
+    只实现了客户端用到的接口, 写入立即生效, 搜索按子串匹配 text
+    """
+
+    # index -> (primary_key, message_id -> document)
+    indexes: dict[str, tuple[str | None, dict]] = {}
+    task_uid = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict | None = None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: int, code: str, message: str):
+        self._send(
+            status, {"message": message, "code": code, "type": "invalid_request"}
+        )
+
+    def _task(self, index: str, task_type: str):
+        FakeMeilisearch.task_uid += 1
+        self._send(
+            202,
+            {
+                "taskUid": FakeMeilisearch.task_uid,
+                "indexUid": index,
+                "status": "enqueued",
+                "type": task_type,
+            },
+        )
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _handle(self, method: str):
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        if parts == ["health"]:
+            return self._send(200, {"status": "available"})
+        if self.headers.get("Authorization") != f"Bearer {API_KEY}":
+            return self._error(
+                403, "invalid_api_key", "The provided API key is invalid."
+            )
+        if parts[0] != "indexes" or len(parts) < 2:
+            return self._error(404, "not_found", "Not found.")
+        index = parts[1]
+        if (method, parts[2:]) == ("POST", ["documents"]):
+            primary_key = parse_qs(url.query).get("primaryKey", [None])[0]
+            documents = self._read_json()
+            stored = self.indexes.setdefault(index, (primary_key, {}))[1]
+            for document in documents:
+                stored[document[primary_key]] = document
+            return self._task(index, "documentAdditionOrUpdate")
+        if index not in self.indexes:
+            return self._error(404, "index_not_found", f"Index `{index}` not found.")
+        if (method, parts[2:]) == ("POST", ["search"]):
+            query = self._read_json()
+            hits = [
+                document
+                for document in self.indexes[index][1].values()
+                if query["q"] in document["text"]
+            ]
+            limit = query.get("limit", 20)
+            return self._send(
+                200,
+                {
+                    "hits": hits[:limit],
+                    "query": query["q"],
+                    "limit": limit,
+                    "offset": 0,
+                    "estimatedTotalHits": len(hits),
+                },
+            )
+        if (method, parts[2:]) == ("DELETE", []):
+            del self.indexes[index]
+            return self._task(index, "indexDeletion")
+        return self._error(404, "not_found", "Not found.")
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+class AsyncMeiliClientTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeMeilisearch)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    async def asyncSetUp(self):
+        FakeMeilisearch.indexes.clear()
+        self.client = AsyncMeiliClient(self.url, API_KEY)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    def test_health(self):
+        self.assertEqual(self.client.health(), {"status": "available"})
+
+    async def test_add_documents_and_search(self):
+        task = await self.client.add_documents(
+            "kmua_1",
+            [
+                {"message_id": 1, "text": "早上好", "user_id": 10, "type": 0},
+                {"message_id": 2, "text": "晚上好", "user_id": 11, "type": 0},
+                {"message_id": 3, "text": "早上吃什么", "user_id": 10, "type": 0},
+            ],
+            primary_key="message_id",
+        )
+        self.assertEqual(task["indexUid"], "kmua_1")
+        self.assertEqual(task["status"], "enqueued")
+
+        result = await self.client.search("kmua_1", "早上", {"limit": 1})
+        self.assertEqual(result["estimatedTotalHits"], 2)
+        self.assertEqual(result["limit"], 1)
+        self.assertEqual(len(result["hits"]), 1)
+        self.assertIn("早上", result["hits"][0]["text"])
+
+        result = await self.client.search("kmua_1", "晚上")
+        self.assertEqual([hit["message_id"] for hit in result["hits"]], [2])
+
+    async def test_delete_index(self):
+        await self.client.add_documents(
+            "kmua_2", [{"message_id": 1, "text": "喵"}], primary_key="message_id"
+        )
+        task = await self.client.delete_index("kmua_2")
+        self.assertEqual(task["type"], "indexDeletion")
+        self.assertNotIn("kmua_2", FakeMeilisearch.indexes)
+
+    async def test_error_status(self):
+        with self.assertRaises(MeiliError) as context:
+            await self.client.search("kmua_404", "喵")
+        self.assertEqual(context.exception.status_code, 404)
+        self.assertEqual(context.exception.code, "index_not_found")
+        self.assertIn("kmua_404", str(context.exception))
+
+    async def test_invalid_api_key(self):
+        client = AsyncMeiliClient(f"http://{self.url}/", "wrong-key")
+        try:
+            with self.assertRaises(MeiliError) as context:
+                await client.delete_index("kmua_1")
+        finally:
+            await client.close()
+        self.assertEqual(context.exception.status_code, 403)
+        self.assertEqual(context.exception.code, "invalid_api_key")
+
+
+if __name__ == "__main__":
+    unittest.main()